@@ -1,14 +1,340 @@
+"""
+The admin panel, set up so it keeps working with millions of posts and comments.
+
+What the bare admin.site.register(...) did, and what is done instead:
+
+    - every changelist ran SELECT COUNT(*) over the whole table, twice (the page
+      count, and the "123 total" next to a search). show_full_result_count = False
+      drops the second one, and EstimatedCountPaginator replaces the first with
+      the database's own estimate of the table size (or a count that stops at
+      COUNT_LIMIT rows, for a filtered list),
+    - every row printed {{ comment }}, i.e. Comment.__str__, which loads its author
+      and post: two queries per row. list_select_related JOINs them in,
+    - foreign keys were <select>s listing every user / post / comment in the
+      database. They are an id box with a lookup popup now (raw_id_fields), or a
+      search-as-you-type box for communities (autocomplete_fields),
+    - searches were LIKE '%word%' on every row. Posts are searched with the
+      full-text index (core/search.py), the rest on exact, indexed columns,
+    - "delete selected" first collected EVERY row that would cascade (to list
+      them on the confirmation page), then deleted them all in one transaction.
+      Now posts and communities are soft-deleted (core/deletion.py), and
+      everything is deleted ACTION_BATCH_SIZE rows per transaction.
+      Users too: the built-in UserAdmin deleted a user with one big CASCADE that
+      skipped Comment.delete(), so the post and comment counters drifted,
+    - users can be suspended (is_active=False: logged out, can't log back in) and
+      reinstated in bulk, in the same batches. Posts, comments and communities
+      have no hidden state of their own: moderating them is the (soft) delete.
+"""
+
 from django.contrib import admin
-from .models import Community, Post, Comment, Subsriptions  # 1. Importing models
-# Registering models here
+from django.contrib.admin.actions import delete_selected
+# Importing it registers the built-in User admin (django.contrib.auth comes after
+# core in INSTALLED_APPS), so it can be swapped for UserAdmin below.
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
+from django.utils.text import Truncator, slugify
+
+from . import deletion, viewer
+from .models import Community, Deletion, Post, Comment, Subsriptions  # 1. Importing models
+from .search import get_backend, search_terms
+
+# Below this many rows, counting is cheap enough: the exact number is shown.
+ESTIMATE_ABOVE = 100_000
+
+# A filtered changelist counts at most this many rows ("10000" then means "a lot").
+COUNT_LIMIT = 10_000
+
+# Rows per transaction for the delete / suspend / reinstate actions.
+ACTION_BATCH_SIZE = 500
+
+# How many of the best full-text matches a post search in the admin shows.
+SEARCH_LIMIT = 1000
+
+# The confirmation page of "delete" lists at most this many of the selected rows.
+DELETE_PREVIEW = 100
+
+
+def estimated_row_count(model):
+    """
+    The database's own estimate of how many rows the table of `model` has (kept for
+    the query planner, so reading it costs nothing), or None if it doesn't have one.
+    """
+    table = model._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Updated by VACUUM / ANALYZE (and autovacuum). -1 = never analyzed.
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+
+        if connection.vendor == 'sqlite':
+            # Filled in by ANALYZE: one row per index, starting with the number of rows.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+
+            if cursor.fetchone() is None:
+                return None
+
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that never COUNTs a huge table. The numbers in the changelist
+    (how many rows, how many pages) become approximate for big tables.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        unfiltered = queryset.model._default_manager.all()
+
+        # The whole table (no filter or search apart from the default manager's):
+        # the estimate, as long as it says the table is big.
+        if str(queryset.query.where) == str(unfiltered.query.where):
+            estimate = estimated_row_count(queryset.model)
+
+            if estimate is not None and estimate > ESTIMATE_ABOVE:
+                return estimate
+
+        # SELECT COUNT(*) FROM (SELECT ... LIMIT COUNT_LIMIT): stops early.
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+def in_batches(queryset, batch_size=ACTION_BATCH_SIZE):
+    """
+    The ids of `queryset`, batch_size at a time (keyset on the id, no OFFSET).
+    """
+    last_pk = None
+
+    while True:
+        batch = queryset.order_by('pk')
+
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+
+        ids = list(batch.values_list('pk', flat=True)[:batch_size])
+
+        if not ids:
+            return
+
+        yield ids
+        last_pk = ids[-1]
+
+
+def delete_in_batches(modeladmin, request, queryset):
+    """
+    The built-in "Delete selected ..." action, except that the deleting itself is
+    modeladmin.delete_queryset() (in batches) and the rows aren't all loaded
+    first to write one log entry each.
+    """
+    if not request.POST.get('post'):
+        # Not confirmed yet: the usual confirmation page.
+        return delete_selected(modeladmin, request, queryset)
+
+    count = queryset.count()
+    modeladmin.delete_queryset(request, queryset)
+    modeladmin.message_user(request, f'Deleted {count} {modeladmin.opts.verbose_name_plural}.')
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """
+    What every ModelAdmin here has in common (see the top of this file).
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    # Newest first on the primary key: the changelist is an index read.
+    ordering = ('-pk',)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+
+        # Same name, so the confirmation page still posts back to it.
+        if 'delete_selected' in actions:
+            actions['delete_selected'] = (delete_in_batches, 'delete_selected', delete_selected.short_description)
+
+        return actions
+
+    def get_deleted_objects(self, objs, request):
+        # The default collects every row that would go with the selected ones, to list
+        # them on the confirmation page: a whole thread, a whole community...
+        # Only the selected rows are shown (and not all of them).
+        preview = [str(obj) for obj in objs[:DELETE_PREVIEW]]
+        return preview, {}, set(), []
+
+    def delete_queryset(self, request, queryset):
+        for ids in in_batches(queryset):
+            with transaction.atomic():
+                self.delete_batch(ids)
+
+    def delete_batch(self, ids):
+        self.model.objects.filter(pk__in=ids).delete()
+
+
+class SoftDeleteAdmin(ScalableAdmin):
+    """
+    Deleting hides the object right away and purges it in the background
+    (core/deletion.py), exactly like the "delete" button on the site.
+    """
+
+    def delete_model(self, request, obj):
+        deletion.soft_delete(obj)
+
+    def delete_batch(self, ids):
+        for obj in self.model.objects.filter(pk__in=ids):
+            deletion.soft_delete(obj)
+
 
 # 2. Telling the admin site to manage the Community model
-admin.site.register(Community)
+@admin.register(Community)
+class CommunityAdmin(SoftDeleteAdmin):
+
+    list_display = ('name', 'slug', 'subscriber_count', 'post_count', 'created_at')
+    list_select_related = ('stats',)
+
+    # Needed by the autocomplete box on the post form (see get_search_results).
+    search_fields = ('slug',)
+
+    # (A community made with bulk_create may not have its stats row yet.)
+    @admin.display(description='Members')
+    def subscriber_count(self, community):
+        stats = getattr(community, 'stats', None)
+        return stats.subscriber_count if stats else None
+
+    @admin.display(description='Posts')
+    def post_count(self, community):
+        stats = getattr(community, 'stats', None)
+        return stats.post_count if stats else None
+
+    def get_search_results(self, request, queryset, search_term):
+        # Name prefix as a range on the unique slug index (like search_communities()).
+        prefix = slugify(search_term)
+
+        if prefix:
+            queryset = queryset.filter(slug__gte=prefix, slug__lt=prefix + '\uffff')
+
+        return queryset, False
+
 
 # 3. Telling the admin site to manage the Post model
-admin.site.register(Post)
+@admin.register(Post)
+class PostAdmin(SoftDeleteAdmin):
+
+    list_display = ('title', 'author', 'community', 'score', 'comment_count', 'created_at')
+    list_select_related = ('author', 'community')
+
+    raw_id_fields = ('author',)
+    autocomplete_fields = ('community',)
+
+    # Kept up to date by votes and comments (core/votes.py, Comment.save()).
+    readonly_fields = ('upvote_count', 'downvote_count', 'score', 'comment_count', 'hot_rank', 'created_at')
+
+    # Shows the search box. The search itself is in get_search_results.
+    search_fields = ('title',)
+
+    def get_queryset(self, request):
+        # The changelist doesn't show the body.
+        return super().get_queryset(request).defer('content')
+
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index instead of title LIKE '%word%' on every row.
+        terms = search_terms(search_term)
+
+        if terms:
+            ids = [post_id for post_id, _, _ in get_backend().matches(terms, SEARCH_LIMIT, 0)]
+            queryset = queryset.filter(pk__in=ids)
+
+        return queryset, False
+
+
+@admin.register(Comment)
+class CommentAdmin(ScalableAdmin):
+
+    list_display = ('short_content', 'author', 'post', 'depth', 'reply_count', 'created_at')
+    list_select_related = ('author', 'post')
+
+    raw_id_fields = ('author', 'post', 'parent')
+
+    # '=' is an exact match: on the unique username index, not LIKE '%...%'.
+    search_fields = ('=author__username',)
+
+    @admin.display(description='Comment')
+    def short_content(self, comment):
+        return Truncator(comment.content).chars(80)
+
+    def get_queryset(self, request):
+        # Only the post's title is shown, not its body.
+        return super().get_queryset(request).defer('post__content')
+
+    def delete_batch(self, ids):
+        # One by one with Comment.delete(), so the post's and the parent comments'
+        # counters go down too. Deepest first, and each one is read again right
+        # before it is deleted: deleting a comment also deletes (and uncounts) the
+        # replies under it, which may be selected too.
+        for comment_id in Comment.objects.filter(pk__in=ids).order_by('-depth').values_list('pk', flat=True):
+            comment = Comment.objects.filter(pk=comment_id).first()
+
+            if comment is not None:
+                comment.delete()
+
+
+@admin.register(Subsriptions)
+class SubscriptionAdmin(ScalableAdmin):
+
+    list_display = ('user', 'community', 'created_at')
+    list_select_related = ('user', 'community')
+
+    raw_id_fields = ('user', 'community')
+
+    search_fields = ('=user__username', '=community__slug')
+
+
+# Deleting a user hides them (is_active=False) and purges their posts, votes and
+# comments in the background, with the counters kept right (core/deletion.py).
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class UserAdmin(SoftDeleteAdmin, BaseUserAdmin):
+
+    # '=' is an exact match on the unique username index, not LIKE '%...%'.
+    search_fields = ('=username',)
+
+    actions = ('suspend_users', 'reinstate_users')
+
+    @admin.action(description='Suspend selected users')
+    def suspend_users(self, request, queryset):
+        # (Never the admin doing it: they would lock themselves out.)
+        count = self.set_active(queryset.filter(is_active=True).exclude(pk=request.user.pk), False)
+        self.message_user(request, f'Suspended {count} users.')
+
+    @admin.action(description='Reinstate selected users')
+    def reinstate_users(self, request, queryset):
+        # A deleted user is inactive too, but stays that way until their purge is over.
+        deleted = Deletion.objects.filter(target=Deletion.USER, object_id=OuterRef('pk'))
+        count = self.set_active(queryset.filter(is_active=False).exclude(Exists(deleted)), True)
+        self.message_user(request, f'Reinstated {count} users.')
+
+    def set_active(self, queryset, is_active):
+        count = 0
 
+        for ids in in_batches(queryset):
+            with transaction.atomic():
+                count += User.objects.filter(pk__in=ids).update(is_active=is_active)
 
-admin.site.register(Comment)
+            # A queryset update sends no signal: the cached user rows have to go by hand.
+            for user_id in ids:
+                viewer.invalidate(user_id)
 
-admin.site.register(Subsriptions)
+        return count
@@ -0,0 +1,273 @@
+"""
+The JSON API (version 1), for the mobile app and anything else that isn't a browser:
+
+    GET /api/v1/posts                    every post        ?sort=hot|top|new|rising
+    GET /api/v1/t/<slug>/posts           one community     ?sort=...
+    GET /api/v1/post/<id>/comments       a post's comments, in thread order
+    GET /api/v1/search?q=...             matching posts and communities  ?page=
+
+Lists come one page at a time: {"data": [...], "next_cursor": "..."}. Send the
+cursor back as ?cursor= for the next page (keyset pagination, see core/pagination.py);
+?limit= sets the page size (up to MAX_LIMIT).
+
+Sparse fieldsets: ?fields=id,title,score returns just those fields. Only what is
+asked for is sent, and the full post body (`content`) is only read from the
+database when it is asked for (the default is the `excerpt`).
+
+Every response has an ETag built from the cache versions of the data it shows
+(core/cache.py) and the current PAGE_TIMEOUT window. A client that sends it back
+in If-None-Match gets an empty 304 Not Modified as long as nothing changed,
+without a single query. (Votes don't bump the listings' versions: the window is
+what makes a list with new scores get a new ETag, like the cached page expiring.)
+
+Exports: ?format=ndjson streams the WHOLE list instead of one page, one JSON
+object per line, read from the database in batches (memory stays flat however
+long the list is).
+"""
+
+import hashlib
+import json
+import time
+from functools import wraps
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag, require_GET
+
+from .cache import PAGE_TIMEOUT, cache_page_for_anonymous, get_versions
+from .models import Comment, Community, Post
+from .pagination import PAGE_SIZE, decode_cursor, next_cursor, paginate
+from .ranking import sort_posts
+from .search import search_communities, search_posts
+
+MAX_LIMIT = 100
+
+# Rows per query when streaming an export.
+EXPORT_BATCH_SIZE = 500
+
+# Comments in thread order: a comment's path starts with its parent's path, so
+# sorting by path puts every reply right after the comment it answers.
+COMMENT_KEYS = ('path',)
+
+
+def _timestamp(value):
+    return value.isoformat() if value else None
+
+
+# field name -> how to get it from the object. `request` is there for absolute URLs.
+POST_FIELDS = {
+    'id': lambda post, request: post.id,
+    'title': lambda post, request: post.title,
+    'excerpt': lambda post, request: post.excerpt,
+    'content': lambda post, request: post.content,
+    'url': lambda post, request: request.build_absolute_uri(reverse('post_detail', args=[post.id])),
+    'author': lambda post, request: post.author.username,
+    'community': lambda post, request: post.community.slug if post.community else None,
+    'score': lambda post, request: post.score,
+    'upvotes': lambda post, request: post.upvote_count,
+    'downvotes': lambda post, request: post.downvote_count,
+    'comment_count': lambda post, request: post.comment_count,
+    'image': lambda post, request: request.build_absolute_uri(post.card_image_url) if post.image else None,
+    'created_at': lambda post, request: _timestamp(post.created_at),
+}
+
+COMMENT_FIELDS = {
+    'id': lambda comment, request: comment.id,
+    'post': lambda comment, request: comment.post_id,
+    'parent': lambda comment, request: comment.parent_id,
+    'depth': lambda comment, request: comment.depth,
+    'author': lambda comment, request: comment.author.username,
+    'content': lambda comment, request: comment.content,
+    'reply_count': lambda comment, request: comment.reply_count,
+    'created_at': lambda comment, request: _timestamp(comment.created_at),
+}
+
+COMMUNITY_FIELDS = {
+    'slug': lambda community, request: community.slug,
+    'name': lambda community, request: community.name,
+    'description': lambda community, request: community.description,
+    'url': lambda community, request: request.build_absolute_uri(reverse('community_detail', args=[community.slug])),
+}
+
+# What you get without ?fields= (the full body only when asked for).
+DEFAULT_POST_FIELDS = [name for name in POST_FIELDS if name != 'content']
+
+
+class BadRequest(Exception):
+    pass
+
+
+def api_view(namespaces):
+    """
+    Decorator for the API views: GET only, an ETag from the versions of
+    `namespaces(request, **kwargs)` (see core/cache.py), the whole response
+    cached for anonymous clients, and bad parameters turned into a 400.
+    """
+    def etag_for(request, **kwargs):
+        versions = get_versions(*namespaces(request, **kwargs))
+        window = int(time.time() // PAGE_TIMEOUT)
+        return hashlib.sha1(f'{versions}:{window}:{request.get_full_path()}'.encode()).hexdigest()
+
+    def decorator(view):
+
+        @wraps(view)
+        def handle_bad_request(request, **kwargs):
+            try:
+                return view(request, **kwargs)
+            except BadRequest as error:
+                return JsonResponse({'error': str(error)}, status=400)
+
+        # no_cache: clients may keep the response, but must check the ETag before using it.
+        return require_GET(cache_control(no_cache=True)(
+            etag(etag_for)(cache_page_for_anonymous(namespaces)(handle_bad_request))
+        ))
+
+    return decorator
+
+
+def not_found(message):
+    return JsonResponse({'error': message}, status=404)
+
+
+def requested_fields(request, available, default=None):
+    """
+    The field names asked for with ?fields=a,b,c (all of `default` without it).
+    """
+    raw = request.GET.get('fields')
+
+    if not raw:
+        return list(default or available)
+
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+
+    if unknown:
+        raise BadRequest(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(available)}.")
+
+    return fields
+
+
+def page_size(request):
+    try:
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('limit must be a number.')
+
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def serialize(obj, fields, available, request):
+    return {name: available[name](obj, request) for name in fields}
+
+
+def post_queryset(fields):
+    posts = Post.objects.for_listing()
+
+    if 'content' in fields:
+        # for_listing() leaves the full body out, this client wants it.
+        posts = posts.defer(None)
+
+    return posts
+
+
+def list_response(request, queryset, keys, available, default=None):
+    """
+    One keyset page of `queryset` as {"data": [...], "next_cursor": ...},
+    or the whole list as streamed NDJSON with ?format=ndjson.
+    """
+    fields = requested_fields(request, available, default)
+
+    if request.GET.get('format') == 'ndjson':
+        rows = export_rows(queryset, keys)
+        lines = (json.dumps(serialize(obj, fields, available, request)) + '\n' for obj in rows)
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+    page = paginate(queryset, decode_cursor(request.GET.get('cursor')), 'data', keys, page_size(request))
+
+    return JsonResponse({
+        'data': [serialize(obj, fields, available, request) for obj in page],
+        'next_cursor': next_cursor(data=page),
+    })
+
+
+def export_rows(queryset, keys):
+    """
+    Every row of `queryset`, read EXPORT_BATCH_SIZE at a time with the same keyset
+    pagination as the pages (no OFFSET, no list of everything in memory).
+    """
+    cursor = {}
+
+    while True:
+        page = paginate(queryset, cursor, 'rows', keys, EXPORT_BATCH_SIZE)
+        yield from page
+
+        if not page.has_next:
+            return
+
+        cursor = {'rows': page.next_position}
+
+
+@api_view(lambda request: ['posts', 'communities'])
+def posts(request):
+    """
+    Every post, in ?sort= order.
+    """
+    fields = requested_fields(request, POST_FIELDS, DEFAULT_POST_FIELDS)
+    _, queryset, keys = sort_posts(post_queryset(fields), request.GET.get('sort'))
+
+    return list_response(request, queryset, keys, POST_FIELDS, DEFAULT_POST_FIELDS)
+
+
+@api_view(lambda request, slug: ['posts', 'communities'])
+def community_posts(request, slug):
+    """
+    The posts of one community, in ?sort= order.
+    """
+    community = Community.objects.filter(slug=slug).only('id').first()
+
+    if community is None:
+        return not_found('No such community.')
+
+    fields = requested_fields(request, POST_FIELDS, DEFAULT_POST_FIELDS)
+    _, queryset, keys = sort_posts(post_queryset(fields).filter(community=community), request.GET.get('sort'))
+
+    return list_response(request, queryset, keys, POST_FIELDS, DEFAULT_POST_FIELDS)
+
+
+@api_view(lambda request, post_id: [f'post:{post_id}'])
+def post_comments(request, post_id):
+    """
+    The comments of a post, flat and in thread order (every reply right after
+    its parent), with `parent` and `depth` to rebuild the tree.
+    """
+    if not Post.objects.filter(id=post_id).exists():
+        return not_found('No such post.')
+
+    # On the (post, path) index.
+    comments = Comment.objects.select_related('author').filter(post_id=post_id)
+
+    return list_response(request, comments, COMMENT_KEYS, COMMENT_FIELDS)
+
+
+@api_view(lambda request: ['posts', 'communities'])
+def search(request):
+    """
+    Full-text search: one ?page= of matching posts, and communities by name prefix.
+    """
+    query = request.GET.get('q', '')
+    post_fields = requested_fields(request, POST_FIELDS, DEFAULT_POST_FIELDS)
+
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise BadRequest('page must be a number.')
+
+    results = search_posts(query, page, posts=post_queryset(post_fields))
+
+    return JsonResponse({
+        'query': query,
+        'posts': [serialize(post, post_fields, POST_FIELDS, request) for post in results],
+        'communities': [serialize(community, COMMUNITY_FIELDS, COMMUNITY_FIELDS, request) for community in search_communities(query)],
+        'next_page': results.next_page,
+    })
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # On SQLite, a migration that adds a column to core_post rebuilds the table and
+        # drops the full-text search triggers with it, so put them back after every migrate.
+        from .search import install_index
+        post_migrate.connect(install_index, sender=self)
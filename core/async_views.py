@@ -0,0 +1,227 @@
+"""
+Async versions of the read-only pages, used when the site runs under an ASGI
+server (see threadit/asgi.py and settings.ASYNC_VIEWS).
+
+A sync view holds a whole worker thread while it waits: on the database, and on
+a slow client. An async view gives the event loop back every time it awaits, so
+one worker process can keep many more requests in flight.
+
+The database work is still Django's sync ORM code. These views run the queries
+that don't depend on each other at the same time, each on its own thread and
+database connection, with parallel():
+
+    home:  "Your Feed" page, "Explore" page, sidebar communities   -> 3 at once
+    post:  the viewer's vote, the page of comments                  -> 2 at once
+
+so a page takes as long as its slowest query instead of the sum of all of them.
+The HTML is the same as the sync views in views.py: same templates, same context.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import Http404
+from django.shortcuts import render
+
+from . import stats, timeline, views
+from .cache import attach_card_versions, cache_page_for_anonymous, get_versions
+from .models import Community, Comment, Post, User
+from .pagination import decode_cursor, next_cursor, paginate
+from .ranking import sort_posts
+from .search import search_communities, search_posts
+from .viewer import get_summary as get_viewer_summary
+from .votes import get_viewer_vote
+
+
+async def parallel(*functions):
+    """
+    Runs sync functions (that use the database) at the same time, each on its own
+    thread, and returns their results in order.
+    """
+    return await asyncio.gather(*[
+        sync_to_async(_with_own_connection(function), thread_sensitive=False)()
+        for function in functions
+    ])
+
+
+def _with_own_connection(function):
+    def run():
+        try:
+            return function()
+        finally:
+            # Each thread opened its own connection: close it like a request would.
+            close_old_connections()
+
+    return run
+
+
+async def get_viewer(request):
+    """
+    The logged-in user, or None. request.user is loaded from the session on
+    first use (a query), so that has to happen in a thread too.
+    """
+    return await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+
+
+async def render_page(request, template_name, context):
+    # Rendering can still run queries (lazy relations in the templates).
+    return await sync_to_async(render)(request, template_name, context)
+
+
+@cache_page_for_anonymous(lambda request: ['posts', 'communities'])
+async def home(request):
+    """
+    Async version of views.home.
+    """
+    cursor = decode_cursor(request.GET.get('cursor'))
+    sort = request.GET.get('sort')
+    user = await get_viewer(request)
+    posts = Post.objects.for_listing()
+
+    def feed_page():
+        if user is None:
+            return paginate(posts.none(), cursor, 'feed')
+
+        return timeline.feed_page(user, posts, sort_posts(posts, sort)[0], cursor)
+
+    def explore_page():
+        sort_used, explore_posts, keys = sort_posts(posts.not_subscribed_by(request.user), sort)
+        return sort_used, paginate(explore_posts, cursor, 'explore', keys)
+
+    def sidebar():
+        return list(stats.trending(5)), '-'.join(map(str, get_versions('communities', 'stats')))
+
+    feed_obj_list, (sort, explore_list), (top_communities, sidebar_version) = await parallel(
+        feed_page, explore_page, sidebar,
+    )
+
+    await sync_to_async(attach_card_versions)([*feed_obj_list, *explore_list])
+
+    return await render_page(request, 'home.html', {
+        'top_communities': top_communities,
+        'feed_obj_list': feed_obj_list,
+        'explore_list': explore_list,
+        'next_cursor': next_cursor(feed=feed_obj_list, explore=explore_list),
+        'is_first_page': not cursor,
+        'sort': sort,
+        'sidebar_version': sidebar_version,
+    })
+
+
+@cache_page_for_anonymous(lambda request, slug: ['posts', 'communities'])
+async def community_detail(request, slug):
+    """
+    Async version of views.community_detail.
+    """
+    community = await Community.objects.select_related('stats').filter(slug=slug).afirst()
+
+    if community is None:
+        raise Http404('No such community.')
+
+    await get_viewer(request)
+    cursor = decode_cursor(request.GET.get('cursor'))
+
+    def post_page():
+        posts = Post.objects.for_listing().filter(community=community).with_viewer_vote(request.user)
+        sort, posts, keys = sort_posts(posts, request.GET.get('sort'))
+        page = paginate(posts, cursor, 'posts', keys)
+        attach_card_versions(page)
+        return sort, page
+
+    def is_subscribed():
+        summary = get_viewer_summary(request)
+        return summary is not None and summary.has_joined(community)
+
+    (sort, page), subscribed = await parallel(post_page, is_subscribed)
+
+    return await render_page(request, 'community_detail.html', {
+        'community': community,
+        'posts': page,
+        'is_subscribed': subscribed,
+        'sort': sort,
+        'next_cursor': next_cursor(posts=page),
+        'is_first_page': not cursor,
+    })
+
+
+@cache_page_for_anonymous(lambda request, post_id: [f'post:{post_id}', 'communities'])
+async def post_detail(request, post_id):
+    """
+    Async version of views.post_detail (new comments are still handled by the sync view).
+    """
+    if request.method == 'POST':
+        return await sync_to_async(views.post_detail)(request, post_id=post_id)
+
+    post = await Post.objects.select_related('author', 'community').filter(id=post_id).afirst()
+
+    if post is None:
+        raise Http404('No such post.')
+
+    await get_viewer(request)
+
+    viewer_vote, comment_context = await parallel(
+        lambda: get_viewer_vote(request.user, post),
+        lambda: views.comment_page_context(request, post),
+    )
+
+    return await render_page(request, 'post_detail.html', {
+        'post': post,
+        'viewer_vote': viewer_vote,
+        'comment_form': views.CommentForm(),
+        **comment_context,
+    })
+
+
+async def profile_view(request, username):
+    """
+    Async version of views.profile_view.
+    """
+    profile_user = await User.objects.filter(username=username, is_active=True).afirst()
+
+    if profile_user is None:
+        raise Http404('No such user.')
+
+    posts, comments, communities = await parallel(
+        lambda: list(Post.objects.for_listing().filter(author=profile_user).order_by('-created_at')),
+        lambda: list(
+            Comment.objects.filter(author=profile_user, post__deleted_at=None)
+            .select_related('post')
+            .only('content', 'created_at', 'post__id', 'post__title')
+            .order_by('-created_at')
+        ),
+        lambda: list(Community.objects.filter(subscribers__user=profile_user)),
+    )
+
+    return await render_page(request, 'profile.html', {
+        'profile_user': profile_user,
+        'posts': posts,
+        'comments': comments,
+        'communities': communities,
+    })
+
+
+async def search(request):
+    """
+    Async version of views.search: the post and community searches run at the same time.
+    """
+    query = request.GET.get('q')
+    posts = []
+    communities = []
+
+    if query:
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+
+        posts, communities = await parallel(
+            lambda: search_posts(query, page),
+            lambda: list(search_communities(query)),
+        )
+
+    return await render_page(request, 'search.html', {
+        'query': query,
+        'posts': posts,
+        'communities': communities,
+    })
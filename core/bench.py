@@ -0,0 +1,201 @@
+"""
+View benchmarks (run with `python manage.py bench`).
+
+Each scenario is one request to one view, made through Django's test client
+(the whole stack: middleware, view, templates, database), repeated many times
+against a database filled by seed_threadit. For every scenario we record:
+
+    latency       p50 / p90 / p95 / p99 / max, in milliseconds
+    queries       SQL queries per request (the same on every run, unlike timings)
+    peak_memory   the most memory the request allocated at once, in KB (tracemalloc)
+
+compare() then checks the results against a stored baseline: any extra query is
+a regression, and latency / memory are regressions when they grow by more than
+a tolerance (timings are noisy, so small absolute changes are ignored).
+"""
+
+import logging
+import statistics
+import time
+import tracemalloc
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from .models import Comment, Community, Post, Subsriptions, Vote
+
+# Dataset sizes: the options passed to seed_threadit.
+SIZES = {
+    'tiny': {'users': 20, 'communities': 5, 'subscriptions': 60, 'posts': 100, 'votes': 400, 'comments': 300},
+    'small': {'users': 500, 'communities': 20, 'subscriptions': 2000, 'posts': 5000, 'votes': 25000, 'comments': 15000},
+    'medium': {'users': 5000, 'communities': 50, 'subscriptions': 20000, 'posts': 50000, 'votes': 250000, 'comments': 150000},
+    'large': {'users': 20000, 'communities': 100, 'subscriptions': 80000, 'posts': 250000, 'votes': 1000000, 'comments': 600000},
+}
+
+PERCENTILES = (50, 90, 95, 99)
+
+# Latency/memory changes smaller than these are noise, whatever the percentage.
+MIN_LATENCY_CHANGE_MS = 1.0
+MIN_MEMORY_CHANGE_KB = 64
+
+
+def seed(size):
+    """
+    Fills the (empty) current database with one of the SIZES.
+    """
+    call_command('seed_threadit', prefix='bench', stdout=StringIO(), **SIZES[size])
+
+    return {
+        'users': User.objects.count(),
+        'posts': Post.objects.count(),
+        'votes': Vote.objects.count(),
+        'comments': Comment.objects.count(),
+        'subscriptions': Subsriptions.objects.count(),
+    }
+
+
+def scenarios():
+    """
+    (name, method, url, logged_in) for every benchmarked request. The targets are
+    the busiest ones in the seeded data: the most active user, the most popular
+    community (seed_threadit gives the lowest ranks, so the lowest ids, the most
+    activity) and the most commented post.
+    """
+    community = Community.objects.order_by('pk').first()
+    post = Post.objects.order_by('-comment_count', 'pk').first()
+    username = User.objects.filter(username__startswith='bench').order_by('pk').values_list('username', flat=True).first()
+
+    return [
+        ('home', 'get', reverse('home'), True),
+        ('home_anonymous', 'get', reverse('home') + '?sort=top', False),
+        ('community_detail', 'get', reverse('community_detail', args=[community.slug]), True),
+        ('post_detail', 'get', reverse('post_detail', args=[post.pk]), True),
+        ('profile', 'get', reverse('profile', args=[username]), True),
+        ('search', 'get', reverse('search') + '?q=django+query', True),
+        # These two toggle (vote / unvote, join / leave), so every other run undoes the previous one.
+        ('upvote_post', 'post', reverse('upvote_post', args=[post.pk]), True),
+        ('join_community', 'post', reverse('join_community', args=[community.slug]), True),
+    ], username
+
+
+def run(iterations=50, warmup=5, only=None):
+    """
+    Runs every scenario against the current database and returns
+    {scenario: {latency_ms: {...}, queries, peak_memory_kb, status}}.
+    """
+    plan, username = scenarios()
+    user = User.objects.get(username=username)
+
+    logged_in = Client(HTTP_HOST='localhost')
+    logged_in.force_login(user)
+    anonymous = Client(HTTP_HOST='localhost')
+
+    results = {}
+
+    # No debug panel in the pages, and no log line per request.
+    perf_logger = logging.getLogger('core.perf')
+    old_level = perf_logger.level
+    perf_logger.setLevel(logging.ERROR)
+
+    try:
+        with override_settings(QUERY_DEBUG_PANEL=False):
+            for name, method, url, needs_login in plan:
+                if only and name not in only:
+                    continue
+
+                client = logged_in if needs_login else anonymous
+                results[name] = measure(lambda: getattr(client, method)(url), iterations, warmup)
+    finally:
+        perf_logger.setLevel(old_level)
+
+    return results
+
+
+def measure(request, iterations, warmup):
+    for _ in range(warmup):
+        request()
+
+    timings = []
+
+    for _ in range(iterations):
+        start = time.perf_counter()
+        request()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # Queries and memory from separate runs: the bookkeeping would slow the timed ones down.
+    queries = []
+
+    def count(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        response = request()
+
+    tracemalloc.start()
+    try:
+        request()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'queries': len(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'latency_ms': summarize(timings),
+    }
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    summary = {f'p{p}': round(percentile(ordered, p), 3) for p in PERCENTILES}
+    summary['mean'] = round(statistics.fmean(ordered), 3)
+    summary['max'] = round(ordered[-1], 3)
+    return summary
+
+
+def percentile(ordered, p):
+    # Linear interpolation between the two closest ranks.
+    position = (len(ordered) - 1) * p / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    The regressions of `results` against `baseline` (both {size: {'views': {...}}}),
+    as a list of human-readable lines. Sizes/scenarios missing on either side are skipped.
+    """
+    regressions = []
+
+    for size, current in results.items():
+        previous_views = baseline.get(size, {}).get('views', {})
+
+        for name, now in current['views'].items():
+            before = previous_views.get(name)
+
+            if before is None:
+                continue
+
+            where = f'{size}/{name}'
+
+            if now['queries'] > before['queries']:
+                regressions.append(f"{where}: {now['queries']} queries (baseline {before['queries']})")
+
+            now_p95, before_p95 = now['latency_ms']['p95'], before['latency_ms']['p95']
+
+            if now_p95 > before_p95 * (1 + tolerance) and now_p95 - before_p95 > MIN_LATENCY_CHANGE_MS:
+                regressions.append(f'{where}: p95 {now_p95:.1f} ms (baseline {before_p95:.1f} ms)')
+
+            now_memory, before_memory = now['peak_memory_kb'], before['peak_memory_kb']
+
+            if now_memory > before_memory * (1 + tolerance) and now_memory - before_memory > MIN_MEMORY_CHANGE_KB:
+                regressions.append(f'{where}: peak memory {now_memory:.0f} KB (baseline {before_memory:.0f} KB)')
+
+    return regressions
@@ -0,0 +1,202 @@
+"""
+Caching helpers: versioned keys, whole-page caching for anonymous visitors, and
+per-post versions for the {% cache %} fragments in the templates.
+
+Deleting every cache key that mentions a post when it changes is impossible
+(we'd have to know every page it appears on). Instead, every cached thing is
+stored under a key that includes a VERSION NUMBER of the data it was built from:
+
+    home page  -> 'page:<version of "posts">:<version of "communities">:/?sort=hot'
+
+When a post is created, bump('posts') makes the version go up by one. From then on
+every page asks for a key that doesn't exist yet, so it is rebuilt with fresh
+data, and the old entries simply expire. One cache write invalidates everything.
+
+The namespaces used:
+
+    'posts'        a post was created or deleted (the listings: home, community pages)
+    'communities'  a community was created/changed/deleted (the sidebar)
+    'stats'        a community's counters moved (the sidebar shows them, core/stats.py)
+    'post:<id>'    that one post, its comments or its votes changed
+
+Votes, comments and edits only bump 'post:<id>': bumping 'posts' on every vote
+would throw away every cached listing several times a second on a busy site. A
+listing may show an old score or title for up to PAGE_TIMEOUT seconds instead
+(the post cards inside it are keyed on 'post:<id>', so logged-in users, who never
+get a cached page, see the change right away).
+
+The bumps are sent from the post_save/post_delete receivers in models.py and
+from core/votes.py (votes are written with queryset updates, which send no signals).
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+# How long anonymous pages / post cards may be served from the cache. Changes are
+# picked up immediately through the versions, this is only the upper bound.
+PAGE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def _new_version():
+    # Starts from the clock (not 1), so a version key that got evicted from the
+    # cache can't restart at a number whose old pages are still stored.
+    return int(time.time() * 1000)
+
+
+def get_versions(*namespaces):
+    """
+    The current version of each namespace, in one cache round trip.
+    """
+    keys = [_version_key(namespace) for namespace in namespaces]
+    found = cache.get_many(keys)
+
+    missing = {key: _new_version() for key in keys if key not in found}
+
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+
+    return [found[key] for key in keys]
+
+
+def bump(*namespaces):
+    """
+    Invalidates everything cached under these namespaces.
+    """
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            # Not in the cache (never read, or evicted): any new number will do.
+            cache.set(_version_key(namespace), _new_version(), timeout=None)
+
+
+def invalidate_post(post_id):
+    bump(f'post:{post_id}')
+
+
+def invalidate_posts(post_ids):
+    """
+    invalidate_post() for many posts, in one cache round trip. The version keys are
+    deleted: the next read starts them over from the clock (see _new_version).
+    """
+    cache.delete_many([_version_key(f'post:{post_id}') for post_id in post_ids])
+
+
+def invalidate_listings():
+    bump('posts')
+
+
+def invalidate_communities():
+    bump('posts', 'communities')
+
+
+def attach_card_versions(posts):
+    """
+    Sets `post.card_version` on every post of a page (one cache round trip for the
+    whole page). The post card templates use it in their {% cache %} key, so a
+    vote or a new comment on ONE post only rebuilds that post's card.
+    """
+    posts = list(posts)
+    versions = get_versions(*[f'post:{post.pk}' for post in posts])
+
+    for post, version in zip(posts, versions):
+        post.card_version = version
+
+
+def cache_page_for_anonymous(namespaces):
+    """
+    View decorator: logged-out visitors get the whole page from the cache.
+
+    `namespaces(request, **view_kwargs)` returns the namespaces the page is built
+    from, e.g. lambda request, post_id: [f'post:{post_id}'].
+
+    Logged-in users are never served cached pages: their pages show their own
+    votes, subscriptions and username.
+
+    Works on sync and async views (core/async_views.py) alike.
+    """
+    def decorator(view):
+
+        if iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                # The user and cache lookups are sync code (database, cache client).
+                key, response = await sync_to_async(_cached_response)(request, namespaces, kwargs)
+
+                if response is not None:
+                    return response
+
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(_store_response)(request, response, key)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, response = _cached_response(request, namespaces, kwargs)
+
+            if response is not None:
+                return response
+
+            return _store_response(request, view(request, *args, **kwargs), key)
+
+        return wrapper
+
+    return decorator
+
+
+def _cached_response(request, namespaces, kwargs):
+    """
+    (cache key, cached response) for this request: (None, None) when the page must
+    not be cached at all, (key, None) on a miss.
+    """
+    # Only plain GETs from anonymous visitors, and never while they have a
+    # flash message waiting (it would be shown on the wrong page).
+    if request.method != 'GET' or request.user.is_authenticated or 'messages' in request.COOKIES:
+        return None, None
+
+    versions = get_versions(*namespaces(request, **kwargs))
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    key = f"page:{':'.join(map(str, versions))}:{path}"
+
+    response = cache.get(key)
+
+    if response is not None:
+        response['X-Cache'] = 'HIT'
+
+    return key, response
+
+
+def _store_response(request, response, key):
+    if key is None:
+        return response
+
+    if response.status_code == 200 and not response.streaming and not _is_personal(request, response):
+        cache.set(key, response, PAGE_TIMEOUT)
+
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def _is_personal(request, response):
+    # Don't store anything that belongs to this one visitor: a page that sets a
+    # cookie, or will get one from the middleware on the way out (a {% csrf_token %}
+    # in the page, or a session that was written to).
+    session = getattr(request, 'session', None)
+
+    return bool(
+        response.cookies
+        or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        or (session is not None and session.modified)
+    )
@@ -0,0 +1,138 @@
+"""
+Loading comment threads.
+
+Comments store their materialized path (see the Comment model), so a thread is
+one query ordered by path, and turning that flat list into a tree is a single
+pass in Python: because a comment always comes after its parent in path order,
+its parent is already in the `nodes` dict when we reach it.
+
+    load_page(post, cursor, sort)   one page of top-level comments, with their replies
+    load_thread(post, comment)      one comment and the replies under it ("continue this thread")
+
+A post page never loads every comment: it shows COMMENTS_PER_PAGE top-level
+comments (in ?sort=new|old|top order, with keyset pagination like the post
+lists) and at most REPLIES_PER_PAGE replies under them, DISPLAY_DEPTH levels deep.
+Everything that didn't fit is reachable through "Load more comments" and
+"Continue this thread" links.
+
+Every comment in the result gets:
+
+    comment.children       its replies that are shown
+    comment.more_replies   how many replies below it are NOT shown (0 = the whole subtree is there)
+"""
+
+from itertools import chain
+
+from .models import Comment
+from .pagination import paginate
+
+# Top-level comments per page.
+COMMENTS_PER_PAGE = 100
+
+# Replies (at any depth) loaded under one page of top-level comments.
+REPLIES_PER_PAGE = 400
+
+# How many levels of replies one page shows. Deeper ones get a "Continue this thread" link.
+DISPLAY_DEPTH = 6
+
+# How many direct replies of a single comment are shown.
+MAX_CHILDREN = 20
+
+# ?sort= value -> ordering of the top-level comments (each one matches an index on Comment).
+# Replies are always shown oldest first, under the comment they answer.
+# Comments have no votes, so "top" means "started the biggest discussion".
+SORT_KEYS = {
+    'new': ('-created_at', '-id'),
+    'old': ('created_at', 'id'),
+    'top': ('-reply_count', '-id'),
+}
+
+DEFAULT_SORT = 'top'
+
+
+def comments_for_display():
+    # The author (and their profile, for the avatar) come JOINed in:
+    # no query per comment when the template shows them.
+    return Comment.objects.select_related('author__profile')
+
+
+def load_page(post, cursor, sort):
+    """
+    Returns (sort, page): the sort actually used, and a KeysetPage of top-level
+    comments with their replies attached.
+    """
+    if sort not in SORT_KEYS:
+        sort = DEFAULT_SORT
+
+    roots = comments_for_display().filter(post=post, depth=0)
+    page = paginate(roots, cursor, 'comments', SORT_KEYS[sort], COMMENTS_PER_PAGE)
+
+    # All the replies under this page, in ONE query (on the (root, path) index).
+    replies = (
+        comments_for_display()
+        .filter(root_id__in=[comment.pk for comment in page], depth__gt=0, depth__lt=DISPLAY_DEPTH)
+        .order_by('path')[:REPLIES_PER_PAGE]
+    )
+
+    build_tree(chain(page, replies))
+
+    return sort, page
+
+
+def load_thread(post, root=None, depth=DISPLAY_DEPTH):
+    """
+    Returns the list of top-level comments (or [root]) with the replies attached.
+    """
+    comments = comments_for_display().filter(post=post)
+
+    if root is None:
+        max_depth = depth
+    else:
+        max_depth = root.depth + depth
+
+        # "path starts with root.path", written as a range so it is an index range
+        # read on (post, path). Paths are digits only and ':' sorts right after '9'.
+        comments = comments.filter(path__gte=root.path, path__lt=root.path + ':')
+
+    comments = comments.filter(depth__lt=max_depth).order_by('path')[:REPLIES_PER_PAGE]
+
+    return build_tree(comments)
+
+
+def build_tree(comments):
+    """
+    Turns comments into a tree, in one pass. Every comment must come after its
+    parent (path order does that), and comments whose parent isn't in the list
+    become roots.
+    """
+    nodes = {}
+    roots = []
+
+    for comment in comments:
+        comment.children = []
+        comment.shown_replies = 0
+        nodes[comment.pk] = comment
+
+        parent = nodes.get(comment.parent_id)
+
+        if parent is None:
+            roots.append(comment)
+            comment.shown = True
+            continue
+
+        comment.shown = parent.shown and len(parent.children) < MAX_CHILDREN
+
+        if not comment.shown:
+            continue
+
+        parent.children.append(comment)
+
+        # Count it as shown for every ancestor on this page.
+        while parent is not None:
+            parent.shown_replies += 1
+            parent = nodes.get(parent.parent_id)
+
+    for comment in nodes.values():
+        comment.more_replies = max(comment.reply_count - comment.shown_replies, 0)
+
+    return roots
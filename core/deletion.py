@@ -0,0 +1,283 @@
+"""
+Deleting posts, communities and users without one giant transaction.
+
+post.delete() looks harmless, but before Django deletes anything its "collector"
+loads every row that CASCADEs from it: every comment and vote of the post. For a
+community that is every post of it, plus all of THEIR comments and votes; for a
+user, all of their posts, comments, votes and subscriptions. That can be millions
+of rows in memory, inside one request and one transaction locking all of them.
+
+So deleting is done in two parts:
+
+    soft_delete(obj)    in the request: sets `deleted_at` (is_active=False for a
+                        user), which hides it at once (Post.objects and
+                        Community.objects leave deleted rows out), and records a
+                        Deletion row,
+    purge(deletion_id)  in the background (core/jobs.py): deletes what is under
+                        it, at most BATCH_SIZE rows per transaction, children
+                        before parents so a DELETE never cascades to more rows.
+
+Progress (the step and the number of rows deleted) is saved on the Deletion row
+after every batch, so a purge that stops halfway just carries on the next time.
+`manage.py purge_deleted` finishes every purge that isn't done yet.
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import stats, viewer
+from .cache import invalidate_communities, invalidate_listings, invalidate_post, invalidate_posts
+from .jobs import enqueue
+from .models import Comment, Community, Deletion, Post, Subsriptions, TimelineEntry, Vote
+from .votes import update_vote_counters
+
+# Rows per transaction.
+BATCH_SIZE = 500
+
+# One purge job runs for about this many seconds, then queues the rest as a new job
+# (so a huge community doesn't keep a worker thread busy for an hour).
+TIME_SLICE = 30
+
+
+def soft_delete(obj):
+    """
+    Hides a Post, Community or User right away and queues the purge of everything
+    under it. Returns the Deletion.
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        if isinstance(obj, Post):
+            target = Deletion.POST
+            Post.all_objects.filter(pk=obj.pk).update(deleted_at=now)
+            obj.deleted_at = now
+            stats.post_removed(obj)
+            invalidate_post(obj.pk)
+            invalidate_listings()
+
+        elif isinstance(obj, Community):
+            target = Deletion.COMMUNITY
+            Community.all_objects.filter(pk=obj.pk).update(deleted_at=now)
+            # Its posts too, or they would still show up on the home page and in search.
+            Post.objects.filter(community=obj).update(deleted_at=now)
+            obj.deleted_at = now
+            invalidate_communities()
+            transaction.on_commit(lambda: enqueue(forget_posts, key=f'forget-posts:community:{obj.pk}', community_id=obj.pk))
+
+        elif isinstance(obj, User):
+            target = Deletion.USER
+            # Can't log in any more, and their profile page is gone.
+            User.objects.filter(pk=obj.pk).update(is_active=False)
+            obj.is_active = False
+
+            posts = Post.objects.filter(author=obj)
+            community_ids = list(posts.exclude(community=None).values_list('community_id', flat=True).distinct())
+            posts.update(deleted_at=now)
+
+            stats.recount(community_ids)
+            viewer.invalidate(obj.pk)
+            invalidate_communities()
+            transaction.on_commit(lambda: enqueue(forget_posts, key=f'forget-posts:user:{obj.pk}', author_id=obj.pk))
+
+        else:
+            raise TypeError(f'Cannot soft-delete {obj!r}')
+
+        deletion, _ = Deletion.objects.get_or_create(target=target, object_id=obj.pk)
+
+        # Only once the rows are hidden for good: the purge runs in transactions of
+        # its own, never inside this one. (If the process dies in between, the
+        # Deletion row is there for `manage.py purge_deleted`.)
+        transaction.on_commit(lambda: enqueue(purge, key=f'purge:{deletion.pk}:0', deletion_id=deletion.pk))
+
+    return deletion
+
+
+def forget_posts(community_id=None, author_id=None):
+    """
+    The background job that invalidates the cached pages of the posts a community
+    or user soft-delete just hid. The post page, its comment pages and the API's
+    comments are cached under 'post:<id>' alone (core/cache.py), so bumping
+    'posts' and 'communities' doesn't reach them.
+    """
+    if community_id is not None:
+        posts = Post.all_objects.filter(community_id=community_id)
+    else:
+        posts = Post.all_objects.filter(author_id=author_id)
+
+    batch = []
+
+    for post_id in posts.order_by().values_list('pk', flat=True).iterator(chunk_size=BATCH_SIZE):
+        batch.append(post_id)
+
+        if len(batch) >= BATCH_SIZE:
+            invalidate_posts(batch)
+            batch = []
+
+    invalidate_posts(batch)
+
+
+def purge(deletion_id, batch_size=BATCH_SIZE):
+    """
+    The background job: purges for TIME_SLICE seconds, then queues itself again
+    if there is more to do.
+    """
+    deletion = Deletion.objects.filter(pk=deletion_id, finished_at=None).first()
+
+    if deletion is None:
+        return
+
+    deadline = time.monotonic() + TIME_SLICE
+
+    while purge_batch(deletion, batch_size):
+        if time.monotonic() >= deadline:
+            break
+    else:
+        return
+
+    if settings.JOBS_RUN_EAGERLY:
+        # Running inside a request (no worker): one slice is all it gets, or a huge
+        # community would purge in one endless request. `manage.py purge_deleted`
+        # finishes the rest.
+        return
+
+    # The key changes with every slice (the old job row keeps its key for a while).
+    enqueue(purge, key=f'purge:{deletion.pk}:{deletion.rows_deleted}', deletion_id=deletion.pk, batch_size=batch_size)
+
+
+def purge_batch(deletion, batch_size=BATCH_SIZE):
+    """
+    Deletes the next batch of rows of this deletion, in one transaction.
+    Returns how many rows were deleted: 0 means it is finished.
+    """
+    with transaction.atomic():
+        step, deleted = _run_steps(STEPS[deletion.target], deletion.object_id, batch_size)
+
+        if deleted:
+            deletion.step = step
+            deletion.rows_deleted += deleted
+            deletion.save(update_fields=['step', 'rows_deleted'])
+        else:
+            deletion.step = ''
+            deletion.finished_at = timezone.now()
+            deletion.save(update_fields=['step', 'finished_at'])
+
+    return deleted
+
+
+def _run_steps(steps, object_id, batch_size):
+    # The first step that still has rows deletes one batch of them. Steps don't keep
+    # any state: "is there anything left?" is asked again every time, so running a
+    # batch twice (a retried job) is harmless.
+    for name, delete_batch in steps:
+        deleted = delete_batch(object_id, batch_size)
+
+        if deleted:
+            return name, deleted
+
+    return None, 0
+
+
+def _delete_batch(queryset, order, batch_size):
+    ids = list(queryset.order_by(order).values_list('pk', flat=True)[:batch_size])
+
+    if not ids:
+        return 0
+
+    # _base_manager: the rows are found even when they are soft-deleted themselves.
+    deleted, _ = queryset.model._base_manager.filter(pk__in=ids).delete()
+    return deleted
+
+
+def _rows(queryset_for, order='pk'):
+    """
+    A step that deletes the rows of queryset_for(object_id), a batch at a time.
+    """
+    def delete_batch(object_id, batch_size):
+        return _delete_batch(queryset_for(object_id), order, batch_size)
+
+    return delete_batch
+
+
+# Everything under one post. Comments go deepest first: by the time a comment is
+# deleted its replies are gone, so the DELETE can't cascade to anything.
+POST_STEPS = [
+    ('comments', _rows(lambda post_id: Comment.objects.filter(post_id=post_id), '-depth')),
+    ('votes', _rows(lambda post_id: Vote.objects.filter(post_id=post_id))),
+    ('timeline', _rows(lambda post_id: TimelineEntry.objects.filter(post_id=post_id))),
+    ('post', _rows(lambda post_id: Post.all_objects.filter(pk=post_id))),
+]
+
+
+def _posts(posts_for):
+    """
+    A step that purges the posts of posts_for(object_id) one after the other,
+    each with POST_STEPS.
+    """
+    def delete_batch(object_id, batch_size):
+        post_id = posts_for(object_id).order_by('pk').values_list('pk', flat=True).first()
+
+        if post_id is None:
+            return 0
+
+        return _run_steps(POST_STEPS, post_id, batch_size)[1]
+
+    return delete_batch
+
+
+def _user_votes(user_id, batch_size):
+    # Unlike the votes on a deleted post, these are on posts that stay: their
+    # counters have to lose the vote too (core/votes.py).
+    votes = list(Vote.objects.filter(user_id=user_id).order_by('pk').values_list('pk', 'post_id', 'value')[:batch_size])
+
+    Vote.objects.filter(pk__in=[pk for pk, _, _ in votes]).delete()
+
+    for _, post_id, value in votes:
+        update_vote_counters(post_id, value, 0)
+        invalidate_post(post_id)
+
+    return len(votes)
+
+
+def _user_comments(user_id, batch_size):
+    # Their comments on other people's posts, newest first. The replies under a
+    # comment go with it (as with on_delete=CASCADE): deepest first, a batch at a
+    # time, then the comment itself with Comment.delete(), which takes all of them
+    # off the post's and the parent comments' counters.
+    comment = Comment.objects.filter(author_id=user_id).order_by('-created_at').first()
+
+    if comment is None:
+        return 0
+
+    replies = Comment.objects.filter(post_id=comment.post_id, path__startswith=comment.path, depth__gt=comment.depth)
+    deleted = _delete_batch(replies, '-depth', batch_size)
+
+    if deleted:
+        return deleted
+
+    comment.delete()
+    return 1
+
+
+STEPS = {
+    Deletion.POST: POST_STEPS,
+
+    Deletion.COMMUNITY: [
+        ('subscriptions', _rows(lambda community_id: Subsriptions.objects.filter(community_id=community_id))),
+        ('timeline', _rows(lambda community_id: TimelineEntry.objects.filter(community_id=community_id))),
+        ('posts', _posts(lambda community_id: Post.all_objects.filter(community_id=community_id))),
+        ('community', _rows(lambda community_id: Community.all_objects.filter(pk=community_id))),
+    ],
+
+    Deletion.USER: [
+        ('posts', _posts(lambda user_id: Post.all_objects.filter(author_id=user_id))),
+        ('votes', _user_votes),
+        ('comments', _user_comments),
+        ('subscriptions', _rows(lambda user_id: Subsriptions.objects.filter(user_id=user_id))),
+        ('timeline', _rows(lambda user_id: TimelineEntry.objects.filter(user_id=user_id))),
+        ('user', _rows(lambda user_id: User.objects.filter(pk=user_id))),
+    ],
+}
@@ -3,6 +3,9 @@ from django import forms
 
 from .models import Post, Comment, Community, Profile # importing Post to be used for the model in the Posting functionality
 from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.text import slugify
 
 """
 You have two classes because they do two different jobs:
@@ -115,8 +118,94 @@ class EditProfileForm(forms.ModelForm):
 
 #################################################################
 
+# --- THE COMMUNITY PICKER ---
+# A forms.Select writes one <option> per community into the page: with 100k communities
+# the create post page would be megabytes, and building it would load every community.
+# Instead, the form has a search box. As you type, the page asks
+# /communities/autocomplete?q=... (views.community_autocomplete) for the matching
+# communities, and the id of the one you pick goes into a hidden input. The search
+# box is sent too (as <name>_name), so a name typed without picking a suggestion
+# isn't silently dropped (see PostForm.clean_community).
+
+class CommunityPicker(forms.Widget):
+
+    # The community the form already has (set by PostForm), so it isn't read again.
+    selected = None
+
+    def render(self, name, value, attrs=None, renderer=None):
+
+        attrs = self.build_attrs(self.attrs, attrs)
+
+        # Only the community that is already selected (editing a post) is read.
+        community = None
+
+        if self.selected is not None and str(self.selected.pk) == str(value):
+            community = self.selected
+
+        elif value and str(value).isdigit():
+            community = Community.objects.filter(pk=value).only('name').first()
+
+        return format_html(
+            '<input type="hidden" name="{name}" id="{id}" value="{value}">'
+            '<input type="search" name="{name}_name" class="{css}" placeholder="Search communities..." autocomplete="off" '
+            'value="{label}" list="{id}_options" data-community-picker="{id}" data-url="{url}">'
+            '<datalist id="{id}_options"></datalist>',
+            name=name,
+            id=attrs.get('id', f'id_{name}'),
+            value=value or '',
+            css=attrs.get('class', 'form-control'),
+            label=community.name if community else '',
+            url=reverse('community_autocomplete'),
+        )
+
+
+class CommunityField(forms.ModelChoiceField):
+    """
+    A ModelChoiceField checks the submitted id with ONE `WHERE id = ...` query
+    (a deleted community isn't found, so it can't be picked). Its usual
+    <select> widget is what listed every community: the picker replaces it.
+    """
+
+    widget = CommunityPicker
+
+    def __init__(self, **kwargs):
+        super().__init__(queryset=Community.objects.only('id', 'name', 'slug'), **kwargs)
+
+
 class PostForm(forms.ModelForm):
 
+    # A post doesn't have to be in a community (Post.community is blank=True).
+    community = CommunityField(required=False, widget=CommunityPicker(attrs={'class': 'form-control'}))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # A Community the view already loaded (?community=... on create, or the
+        # post's own when it was select_related) is handed to the picker.
+        community = self.initial.get('community')
+
+        if not isinstance(community, Community) and Post.community.is_cached(self.instance):
+            community = self.instance.community
+
+        if isinstance(community, Community):
+            self.fields['community'].widget.selected = community
+
+    def clean_community(self):
+
+        community = self.cleaned_data.get('community')
+        typed = self.data.get(self.add_prefix('community') + '_name', '').strip()
+
+        # A name typed in the box but not picked from the suggestions (no JavaScript,
+        # or sent before the suggestions came back): look it up by its exact slug,
+        # instead of quietly posting to "General".
+        if community is None and typed:
+            community = Community.objects.filter(slug=slugify(typed)).only('id', 'name', 'slug').first()
+
+            if community is None:
+                raise forms.ValidationError(f'There is no community called "{typed}". Pick one from the list, or leave the box empty.')
+
+        return community
+
     class Meta:
 
         model = Post
@@ -125,7 +214,6 @@ class PostForm(forms.ModelForm):
         widgets = {
 
             # This 'widgets' part adds Bootstrap classes to the inputs automatically!
-            'community': forms.Select(attrs={'class': 'form-select'}),
             'title': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Enter title'}),
             'content': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'What is on your mind?'}),
             'image': forms.FileInput(attrs={'class': 'form-control'}),
@@ -157,6 +245,17 @@ class CommunityForm(forms.ModelForm):
             # 'slug': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'url-name (e.g. gaming)'}),
         }
 
+    def clean_name(self):
+
+        name = self.cleaned_data['name']
+
+        # The normal "already exists" check uses Community.objects, which can't see a
+        # deleted community. Its row (and name) stays until it is purged (core/deletion.py).
+        if Community.all_objects.filter(name=name, deleted_at__isnull=False).exists():
+            raise forms.ValidationError('A community with this name was just deleted. Please try again later.')
+
+        return name
+
 
 class ProfileForm(forms.ModelForm):
 
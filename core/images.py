@@ -0,0 +1,216 @@
+"""
+Uploaded image processing.
+
+A phone photo can be 4000px wide and several MB, and used to be sent as-is to
+every feed card that showed it (in a ~640px wide box). Now every upload goes
+through this pipeline:
+
+    1. validate_image_upload()  (in the request, cheap): size, format and pixel limits,
+    2. schedule_variants()      queues a background job (core/jobs.py), so the
+                                upload request doesn't wait for the resizing,
+    3. process_variants()       (in the job worker): decodes the image once, applies
+                                the EXIF rotation, and writes a WebP file per size.
+                                Re-encoding drops every piece of metadata (GPS
+                                position, camera serial...), so none of the served
+                                files carry it.
+
+The variant files are stored on the model (Post.image_variants / Profile.image_variants)
+as {'source': <original name>, 'card': {'name': ..., 'width': ...}, ...}, and the
+templates use them through src / srcset (see Post.image_srcset). Until the
+variants exist (or for good, if the file can't be decoded), the templates fall
+back to the original file.
+"""
+
+import logging
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Upload limits.
+MAX_UPLOAD_BYTES = getattr(settings, 'MAX_IMAGE_UPLOAD_BYTES', 10 * 1024 * 1024)
+MAX_PIXELS = 40_000_000   # a 40 megapixel image takes ~160 MB of memory once decoded
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+
+# name -> width in pixels. Images are never made bigger than the original.
+POST_VARIANTS = {
+    'thumb': 320,
+    'card': 640,      # the feed cards
+    'detail': 1280,   # the post page
+    'full': 2048,
+}
+
+PROFILE_VARIANTS = {
+    'avatar': 64,         # the navbar and comments
+    'avatar_large': 256,  # the profile page
+}
+
+WEBP_QUALITY = 80
+
+logger = logging.getLogger(__name__)
+
+
+def validate_image_upload(file):
+    """
+    Model field validator for uploaded images.
+    """
+    if file.size > MAX_UPLOAD_BYTES:
+        raise ValidationError(f'Images can be at most {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.')
+
+    try:
+        file.seek(0)
+        # Opening only reads the header: the size and format, not the pixels.
+        with Image.open(file) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise ValidationError('Upload a JPEG, PNG, WebP or GIF image.')
+
+            if image.width * image.height > MAX_PIXELS:
+                raise ValidationError('This image has too many pixels.')
+
+            # Decode the pixels too, so a cut-off upload fails here and not in the
+            # job. draft() lets a JPEG decode at 1/8 scale, which is much cheaper.
+            image.draft(None, (256, 256))
+            image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError):
+        raise ValidationError('This file is not a valid image.')
+    finally:
+        file.seek(0)
+
+
+def needs_variants(instance, field_name):
+    """
+    True when the image of `instance` changed since its variants were made.
+    """
+    image = getattr(instance, field_name)
+    return _source_name(type(instance), field_name, image.name) != instance.image_variants.get('source', '')
+
+
+def schedule_variants(instance, field_name, sizes):
+    """
+    Queues the processing of one row's image as a background job (core/jobs.py).
+    """
+    from .jobs import enqueue  # imported here because jobs.py imports the models, which import this file
+
+    label = instance._meta.label
+    source = getattr(instance, field_name).name
+
+    # The key makes saving the same row twice queue the work once.
+    enqueue(
+        process_variants, key=f'image:{label}:{instance.pk}:{source}',
+        model=label, pk=instance.pk, field_name=field_name, sizes=sizes,
+    )
+
+
+def process_variants(model, pk, field_name, sizes):
+    """
+    Writes the WebP variants of one row's image and stores their names on the row.
+    """
+    from .cache import invalidate_post
+
+    model = apps.get_model(model)
+    instance = model.objects.filter(pk=pk).only('pk', field_name, 'image_variants').first()
+
+    if instance is None:
+        return
+
+    image_field = getattr(instance, field_name)
+    old_variants = instance.image_variants
+    variants = {'source': _source_name(model, field_name, image_field.name)}
+
+    if variants['source']:
+        try:
+            with image_field.open('rb') as file, Image.open(file) as image:
+                # Apply the phone's "rotate me" EXIF tag, then forget all the metadata.
+                image = ImageOps.exif_transpose(image)
+                image = image.convert('RGBA' if _has_transparency(image) else 'RGB')
+
+                for name, width in sizes.items():
+                    variants[name] = _save_variant(image, image_field.name, model, pk, name, width)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError):
+            # A broken file (truncated, missing...): keep the source name without any
+            # variants, so the job isn't queued again and the templates show the original.
+            logger.exception('Could not make the variants of %s %s (%s)', model._meta.label, pk, image_field.name)
+            _delete_files(variants, keep={})
+            variants = {'source': variants['source']}
+
+    # Only if the image didn't change again while we were working on it.
+    updated = model.objects.filter(pk=pk, **{field_name: image_field.name}).update(image_variants=variants)
+
+    stale = old_variants if updated else variants
+    _delete_files(stale, keep=variants if updated else old_variants)
+
+    if updated and model.__name__ == 'Post':
+        invalidate_post(pk)
+
+    if updated and model.__name__ == 'Profile':
+        # A queryset update sends no signal: the cached navbar avatar has to go by hand.
+        from . import viewer
+        viewer.invalidate(model.objects.filter(pk=pk).values_list('user_id', flat=True).first())
+
+
+def _save_variant(image, source_name, model, pk, name, width):
+    if image.width > width:
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+    else:
+        resized = image
+
+    buffer = BytesIO()
+    resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+
+    directory = os.path.dirname(source_name)
+    file_name = f'{model.__name__.lower()}-{pk}-{name}.webp'
+    saved_name = default_storage.save(os.path.join(directory, 'variants', file_name), ContentFile(buffer.getvalue()))
+
+    return {'name': saved_name, 'width': resized.width}
+
+
+def _has_transparency(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _source_name(model, field_name, name):
+    # The shared default picture (Profile's 'default.jpg') is never processed:
+    # it counts as "no image".
+    if not name or name == model._meta.get_field(field_name).get_default():
+        return ''
+
+    return name
+
+
+def _delete_files(variants, keep):
+    keep_names = {value['name'] for value in keep.values() if isinstance(value, dict)}
+
+    for value in variants.values():
+        if isinstance(value, dict) and value['name'] not in keep_names:
+            default_storage.delete(value['name'])
+
+
+def variant_url(variants, name, fallback):
+    """
+    The URL of one variant, or of `fallback` (the original) while it doesn't exist yet.
+    """
+    variant = variants.get(name)
+    return default_storage.url(variant['name']) if variant else fallback
+
+
+def srcset(variants, names):
+    """
+    'url1 320w, url2 640w, ...' for an <img srcset="...">: the browser picks the
+    smallest file that is big enough for the screen.
+    """
+    found = {}
+
+    for name in names:
+        variant = variants.get(name)
+
+        if variant:
+            # Small originals give several variants of the same width, list each width once.
+            found.setdefault(variant['width'], default_storage.url(variant['name']))
+
+    return ', '.join(f'{url} {width}w' for width, url in sorted(found.items()))
@@ -0,0 +1,184 @@
+"""
+A small background job queue, stored in the database (the Job table).
+
+Some work doesn't need to be finished before we answer the request: resizing an
+uploaded image, copying a new post into thousands of timelines... Doing it in
+the request makes that request slow, and ties up a gunicorn worker meanwhile.
+
+    enqueue(func, **kwargs)     adds a row to the Job table (inside the caller's
+                                transaction.atomic() block, if there is one: if that
+                                rolls back, the job disappears with it. Requests have
+                                no transaction of their own: ATOMIC_REQUESTS is off),
+    manage.py runworker         a separate process that claims due jobs and runs them
+                                on a pool of threads.
+
+A job that raises is retried later (RETRY_DELAY seconds, then twice that, four
+times that...) until it has been tried `max_attempts` times; then it stays in the
+table as 'failed', with its traceback in `last_error`.
+
+Jobs can be run more than once (a worker can die after doing the work but before
+marking the job done), so job functions must be safe to repeat. Passing a `key`
+to enqueue() makes sure the same job isn't queued twice in the first place (while
+one is queued or running: a finished one gives its key up to the new job).
+
+With settings.JOBS_RUN_EAGERLY (the tests, or development without a worker),
+enqueue() runs the function in the same process instead, once the caller's
+transaction has committed. A failure there is logged, never retried.
+"""
+
+import logging
+import os
+import random
+import socket
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry. Doubled on every following attempt, up to MAX_RETRY_DELAY.
+RETRY_DELAY = getattr(settings, 'JOB_RETRY_DELAY', 10)
+MAX_RETRY_DELAY = 60 * 60
+
+# A job 'running' for longer than this belongs to a worker that died: it is queued again.
+LOCK_TIMEOUT = timedelta(seconds=getattr(settings, 'JOB_LOCK_TIMEOUT', 10 * 60))
+
+# Finished jobs (and so their keys) are kept this long, then purged by the worker.
+RETENTION = timedelta(days=getattr(settings, 'JOB_RETENTION_DAYS', 7))
+
+
+def task_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *, key=None, delay=0, max_attempts=5, **kwargs):
+    """
+    Runs func(**kwargs) in the background. The kwargs are stored as JSON, so pass
+    ids and plain values, not model instances.
+
+    Returns the Job (the existing one if a job with this `key` is still queued or
+    running), or None when it was run right away (settings.JOBS_RUN_EAGERLY).
+    """
+    if getattr(settings, 'JOBS_RUN_EAGERLY', False):
+        # Like a queued job, it starts once the caller's transaction has committed
+        # (right away outside of one), and a failure is logged, not raised into
+        # the request that queued it.
+        transaction.on_commit(lambda: run_eagerly(func, kwargs))
+        return None
+
+    fields = {
+        'task': task_name(func),
+        'kwargs': kwargs,
+        'max_attempts': max_attempts,
+        'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+
+    if key is None:
+        return Job.objects.create(**fields)
+
+    try:
+        # The savepoint keeps the caller's transaction usable if the key already exists.
+        with transaction.atomic():
+            return Job.objects.create(key=key, **fields)
+    except IntegrityError:
+        existing = Job.objects.get(key=key)
+
+    if existing.status in (Job.QUEUED, Job.RUNNING):
+        return existing
+
+    # Done or failed: that run is over, so this is new work. The old row stays (with
+    # its traceback) but hands its key over.
+    Job.objects.filter(pk=existing.pk).update(key=None)
+    return Job.objects.create(key=key, **fields)
+
+
+def run_eagerly(func, kwargs):
+    """
+    Runs one job in this process, once (settings.JOBS_RUN_EAGERLY: no retries).
+    """
+    try:
+        func(**kwargs)
+    except Exception:
+        logger.exception('Job %s failed (run eagerly, not retried)', task_name(func))
+
+
+def claim(limit):
+    """
+    Marks up to `limit` due jobs as running for this worker, and returns them.
+
+    Two workers can select the same ids, but the UPDATE only changes rows that are
+    still queued, so each job ends up claimed by exactly one of them.
+    """
+    now = timezone.now()
+    worker = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - LOCK_TIMEOUT).update(
+        status=Job.QUEUED, locked_by='', locked_at=None,
+    )
+
+    due = list(
+        Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+        .order_by('run_at')
+        .values_list('pk', flat=True)[:limit]
+    )
+
+    if not due:
+        return []
+
+    Job.objects.filter(pk__in=due, status=Job.QUEUED).update(
+        status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+    )
+
+    return list(Job.objects.filter(pk__in=due, locked_by=worker).order_by('run_at'))
+
+
+def run(job):
+    """
+    Runs one claimed job and records the outcome.
+    """
+    try:
+        import_string(job.task)(**job.kwargs)
+    except Exception:
+        logger.exception('Job %s (%s) failed, attempt %s of %s', job.pk, job.task, job.attempts, job.max_attempts)
+        _failed(job, traceback.format_exc())
+    else:
+        Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now(), last_error='')
+
+
+def _failed(job, error):
+    now = timezone.now()
+
+    if job.attempts >= job.max_attempts:
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED, finished_at=now, last_error=error)
+        return
+
+    Job.objects.filter(pk=job.pk).update(
+        status=Job.QUEUED, run_at=now + timedelta(seconds=retry_delay(job.attempts)),
+        locked_by='', locked_at=None, last_error=error,
+    )
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait after the `attempts`-th failed try: 10, 20, 40, 80...
+    The random part keeps jobs that failed together from all retrying together.
+    """
+    delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    return delay * random.uniform(1, 1.25)
+
+
+def purge():
+    """
+    Deletes the jobs that finished successfully more than RETENTION ago.
+    Failed ones are kept until someone looks at them.
+    """
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=timezone.now() - RETENTION).delete()
+    return deleted
@@ -0,0 +1,126 @@
+import json
+import os
+import platform
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core import bench
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the main views (core/bench.py) against seeded databases of one or
+    more sizes, writes the results as JSON, and compares them with a baseline:
+
+        python manage.py bench --save-baseline             # once, on the reference commit
+        python manage.py bench                             # later: fails if something regressed
+        python manage.py bench --sizes small,medium --iterations 200
+
+    Each size runs in its own throwaway test database, so the real data is never
+    touched. On SQLite it is a file (like the real one), not the in-memory
+    database the tests use. The numbers depend on the machine:
+    only compare results and baselines made on the same one.
+    """
+
+    help = 'Benchmarks the main views and compares them with a stored baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='small', help=f"Comma-separated, from: {', '.join(bench.SIZES)}.")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--views', help='Comma-separated scenario names (default: all).')
+        parser.add_argument('--output', default='bench-results.json')
+        parser.add_argument('--baseline', default='bench-baseline.json')
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed latency/memory growth (0.25 = 25%%).')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'].split(',')
+        unknown = set(sizes) - set(bench.SIZES)
+
+        if unknown:
+            raise CommandError(f"Unknown size(s): {', '.join(sorted(unknown))}.")
+
+        only = set(options['views'].split(',')) if options['views'] else None
+        results = {}
+
+        for size in sizes:
+            self.stdout.write(f'Seeding a {size} database...')
+
+            with test_database():
+                rows = bench.seed(size)
+                views = bench.run(options['iterations'], options['warmup'], only)
+
+            results[size] = {'rows': rows, 'views': views}
+            self.print_table(size, views)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'sizes': results,
+        }
+
+        Path(options['output']).write_text(json.dumps(report, indent=2))
+        self.stdout.write(f"Results written to {options['output']}.")
+
+        baseline_path = Path(options['baseline'])
+
+        if options['save_baseline']:
+            baseline_path.write_text(json.dumps(report, indent=2))
+            self.stdout.write(self.style.SUCCESS(f'Saved as the baseline ({baseline_path}).'))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f'No baseline at {baseline_path}, run with --save-baseline first.'))
+            return
+
+        baseline = json.loads(baseline_path.read_text())
+        regressions = bench.compare(results, baseline['sizes'], options['tolerance'])
+
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def print_table(self, size, views):
+        self.stdout.write(f"\n{size:<18} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'peak KB':>9}")
+
+        for name, result in views.items():
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{name:<18} {latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f} "
+                f"{result['queries']:>8} {result['peak_memory_kb']:>9.0f}"
+            )
+
+        self.stdout.write('')
+
+
+@contextmanager
+def test_database():
+    """
+    Creates an empty, migrated test database, and deletes it afterwards.
+    """
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+
+    if connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(tempfile.gettempdir(), 'threadit-bench.sqlite3')
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    cache.clear()
+
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
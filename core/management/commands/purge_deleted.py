@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from core.deletion import BATCH_SIZE, purge_batch
+from core.models import Deletion
+
+
+class Command(BaseCommand):
+    """
+    Finishes purging every deleted post, community and user (see core/deletion.py).
+
+    Normally the background worker does this right after the delete, a batch at a
+    time. Run this by hand (or from cron) to finish the ones whose job failed or
+    when no worker is running:
+
+        python manage.py purge_deleted
+        python manage.py purge_deleted --batch-size 2000
+    """
+
+    help = 'Deletes the rows under soft-deleted posts, communities and users, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        finished = 0
+
+        for deletion in Deletion.objects.filter(finished_at=None).order_by('pk'):
+            # One transaction per batch: the locks never cover more than batch_size rows.
+            while purge_batch(deletion, batch_size):
+                self.stdout.write(f'{deletion}: {deletion.rows_deleted} rows deleted ({deletion.step})')
+
+            finished += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Finished {finished} deletions.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.search import get_backend
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the full-text search index of posts (core/search.py).
+
+    The index keeps itself up to date (triggers on SQLite, an expression index
+    on PostgreSQL), so this is only needed after restoring a database from a
+    dump, after changing the tokenizer/dictionary, or to defragment the index:
+
+        python manage.py rebuild_search_index
+    """
+
+    help = 'Rebuilds the full-text search index of posts.'
+
+    def handle(self, *args, **options):
+        get_backend().rebuild()
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the post search index ({connection.vendor}).'))
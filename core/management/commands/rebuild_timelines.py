@@ -0,0 +1,62 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from core import timeline
+from core.models import Community, Subsriptions, TimelineEntry
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the materialized home timelines (core/timeline.py) from the
+    subscriptions table.
+
+    Timelines are kept up to date as posts are created and communities are
+    joined/left, so this is only needed after changing TIMELINE_LENGTH or
+    TIMELINE_FANOUT_LIMIT, or to repair timelines after restoring data:
+
+        python manage.py rebuild_timelines
+        python manage.py rebuild_timelines --user alice
+    """
+
+    help = 'Rebuilds every user\'s materialized home timeline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild the timeline of this username.')
+
+    def handle(self, *args, **options):
+        # Big communities may have crossed (or dropped back under) the fan-out limit.
+        for community in Community.objects.only('id', 'fanout_on_read').iterator():
+            community.fanout_on_read = False
+            timeline.update_fanout_mode(community)
+
+            Community.objects.filter(pk=community.pk).update(fanout_on_read=community.fanout_on_read)
+
+        subscriptions = Subsriptions.objects.select_related('user', 'community').order_by('user_id')
+        entries = TimelineEntry.objects.all()
+
+        if options['user']:
+            subscriptions = subscriptions.filter(user__username=options['user'])
+            entries = entries.filter(user__username=options['user'])
+
+        # The loop below only visits users with subscriptions: whatever is left in
+        # the timelines of everyone else (they left every community) goes here.
+        entries.filter(~Exists(Subsriptions.objects.filter(user_id=OuterRef('user_id')))).delete()
+
+        rebuilt = 0
+
+        # Subscriptions come ordered by user, so groupby() hands us one user at a time.
+        for user_id, user_subscriptions in groupby(subscriptions.iterator(), key=lambda s: s.user_id):
+
+            # One transaction per user: a reader sees either the old or the new timeline.
+            with transaction.atomic():
+                TimelineEntry.objects.filter(user_id=user_id).delete()
+
+                for subscription in user_subscriptions:
+                    timeline.backfill(subscription.user, subscription.community)
+
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} timelines.'))
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Post
+from core.ranking import hot_rank
+
+
+class Command(BaseCommand):
+    """
+    Recomputes Post.hot_rank from each post's score and created_at.
+
+    Votes already move hot_rank incrementally (core/votes.py), so this is the
+    periodic safety net: it fixes posts whose counters were edited by hand or
+    reconciled (run it after reconcile_vote_counts), and any tiny rounding drift
+    from many incremental updates. Schedule it e.g. nightly:
+
+        python manage.py recompute_hot_ranks
+        python manage.py recompute_hot_ranks --since-hours 48   # only recent posts
+    """
+
+    help = 'Recomputes the stored hot ranking of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--since-hours', type=int, default=None,
+            help='Only recompute posts created in the last N hours.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        posts = Post.objects.only('id', 'score', 'created_at', 'hot_rank').order_by('pk')
+
+        if options['since_hours'] is not None:
+            posts = posts.filter(created_at__gte=timezone.now() - timedelta(hours=options['since_hours']))
+
+        checked = 0
+        fixed = 0
+        last_id = 0
+
+        # Walk the posts in id order, one batch per transaction, so memory stays flat.
+        while True:
+            batch = list(posts.filter(pk__gt=last_id)[:batch_size])
+
+            if not batch:
+                break
+
+            last_id = batch[-1].pk
+            stale = []
+
+            for post in batch:
+                rank = hot_rank(post.score, post.created_at)
+
+                if abs(post.hot_rank - rank) > 1e-6:
+                    post.hot_rank = rank
+                    stale.append(post)
+
+            with transaction.atomic():
+                Post.objects.bulk_update(stale, ['hot_rank'])
+
+            checked += len(batch)
+            fixed += len(stale)
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts, updated {fixed}.'))
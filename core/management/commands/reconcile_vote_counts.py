@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from core.models import Post, Vote
+from core.ranking import hot_rank
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds Post.upvote_count / downvote_count / score from the Vote table
+    (and the hot_rank of every post whose score was wrong, see core/ranking.py).
+
+    core/votes.py keeps these columns in sync on every click, so normally
+    there is nothing to fix. Run this after importing data by hand, after
+    editing votes in the admin, or whenever you suspect the numbers drifted:
+
+        python manage.py reconcile_vote_counts
+    """
+
+    help = 'Backfills and reconciles the denormalized vote counters on Post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='How many posts to check per transaction (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        checked = 0
+        fixed = 0
+        last_id = 0
+
+        # We walk through the posts in id order, one batch at a time, so memory
+        # use stays the same no matter how many posts the database holds.
+        while True:
+            batch = list(
+                Post.objects.filter(pk__gt=last_id)
+                .order_by('pk')
+                .values('pk', 'upvote_count', 'downvote_count', 'score', 'created_at')[:batch_size]
+            )
+
+            if not batch:
+                break
+
+            last_id = batch[-1]['pk']
+            fixed += self.reconcile_batch(batch)
+            checked += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts, fixed {fixed}.'))
+
+    def reconcile_batch(self, batch):
+        ids = [row['pk'] for row in batch]
+
+        with transaction.atomic():
+            # One GROUP BY query over the Vote table gives the real totals for the batch.
+            totals = self.count_votes(ids)
+
+            stale = []
+
+            for row in batch:
+                up_count, down_count = totals.get(row['pk'], (0, 0))
+
+                if (row['upvote_count'], row['downvote_count'], row['score']) != (up_count, down_count, up_count - down_count):
+                    stale.append(Post(
+                        pk=row['pk'],
+                        upvote_count=up_count,
+                        downvote_count=down_count,
+                        score=up_count - down_count,
+                        # hot_rank was computed from the wrong score too.
+                        hot_rank=hot_rank(up_count - down_count, row['created_at']),
+                    ))
+
+            # Only the rows that are actually wrong get written.
+            Post.objects.bulk_update(stale, ['upvote_count', 'downvote_count', 'score', 'hot_rank'])
+
+        return len(stale)
+
+    def count_votes(self, post_ids):
+        rows = (
+            Vote.objects.filter(post_id__in=post_ids)
+            .values('post_id')
+            .annotate(
+                up=Count('id', filter=Q(value=Vote.UP)),
+                down=Count('id', filter=Q(value=Vote.DOWN)),
+            )
+            .values_list('post_id', 'up', 'down')
+        )
+        return {post_id: (up, down) for post_id, up, down in rows}
@@ -0,0 +1,120 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core import jobs
+
+# How often the queue is checked when it is empty, and old jobs are purged.
+POLL_INTERVAL = 1
+PURGE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    """
+    Runs the background jobs queued with core.jobs.enqueue(). Start it next to
+    gunicorn (the `worker` line of the Procfile) and keep it running:
+
+        python manage.py runworker
+        python manage.py runworker --threads 8 --processes 2
+        python manage.py runworker --once     # run what is due, then exit (cron, tests)
+
+    Each process claims due jobs and runs them on its own pool of threads
+    (--threads 1 runs them one by one in the process itself).
+    Threads are enough for jobs that mostly wait on the database or storage;
+    more processes help with CPU-heavy ones (image resizing). On SQLite, keep
+    it to a few threads: it only allows one writer at a time.
+
+    SIGTERM / Ctrl-C stops claiming new jobs and waits for the running ones.
+    """
+
+    help = 'Runs queued background jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'JOB_WORKER_THREADS', 4))
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due.')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+
+        if options['processes'] <= 1:
+            self.work(options['threads'], options['once'])
+            return
+
+        # The children must not share the parent's database connection.
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        children = [
+            context.Process(target=self.work, args=(options['threads'], options['once']))
+            for _ in range(options['processes'])
+        ]
+
+        for child in children:
+            child.start()
+
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            # Ctrl-C reached the children too, let them finish their jobs.
+            for child in children:
+                child.join()
+
+    def work(self, threads, once):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job-worker') if threads > 1 else None
+        running = set()
+        done = 0
+        last_purge = 0
+
+        while not self.stopping:
+            if time.monotonic() - last_purge > PURGE_INTERVAL:
+                jobs.purge()
+                last_purge = time.monotonic()
+
+            running = {future for future in running if not future.done()}
+            claimed = jobs.claim(threads - len(running)) if len(running) < threads else []
+
+            for job in claimed:
+                if executor is None:
+                    jobs.run(job)
+                else:
+                    running.add(executor.submit(run_in_thread, job))
+
+            done += len(claimed)
+
+            if claimed:
+                continue
+
+            if once and not running:
+                break
+
+            # Nothing to claim: wait for a thread to free up, or for new jobs to arrive.
+            if running:
+                wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(POLL_INTERVAL)
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs.'))
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+
+def run_in_thread(job):
+    try:
+        jobs.run(job)
+    finally:
+        # Each worker thread has its own database connection: don't leave it open.
+        close_old_connections()
@@ -0,0 +1,317 @@
+import random
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+
+from core.cache import invalidate_communities
+from core.models import Comment, Community, Post, Profile, Subsriptions, Vote
+from core.ranking import hot_rank
+
+WORDS = (
+    'python django query index cache thread post vote comment feed timeline page '
+    'server database latency request worker queue image search ranking score '
+    'community user profile sqlite postgres redis memory disk network socket '
+    'async batch bulk stream cursor offset keyset zipf benchmark profile trace '
+    'open source release bug patch review deploy rollback config docker linux '
+    'coffee weekend music movie garden travel photo recipe question answer idea'
+).split()
+
+# Seed users can log in with this password (useful for load tests of logged-in pages).
+PASSWORD = 'password'
+
+
+class Command(BaseCommand):
+    """
+    Fills the database with a large, realistic-looking dataset, to measure the
+    performance features against production-sized tables:
+
+        python manage.py seed_threadit
+        python manage.py seed_threadit --users 100000 --posts 1000000 --votes 5000000 --comments 3000000
+
+    Real sites are very uneven, so everything is drawn from a Zipf distribution
+    (the k-th most popular thing gets ~1/k^s of the activity): a few communities
+    get most of the posts and subscribers, a few users write most of the posts,
+    and a few posts get most of the votes and comments.
+
+    The same --seed always produces the same rows (the timestamps are relative to
+    now). Rows are written with bulk_create, one transaction per --batch-size posts
+    (with their votes and comments), and ids are assigned here so comment paths can
+    be computed before the INSERT. bulk_create sends no post_save signals, so the
+    counters are computed here, and the timelines are rebuilt at the end (up to
+    TIMELINE_LENGTH rows per user: with many users that is the slowest part, and
+    --skip-timelines leaves it for a later `manage.py rebuild_timelines`).
+    """
+
+    help = 'Generates users, communities, posts, votes, subscriptions and comments for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--communities', type=int, default=50)
+        parser.add_argument('--subscriptions', type=int, default=10000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--votes', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--days', type=int, default=30, help='Spread the posts over the last N days.')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponent s of the Zipf distributions.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--prefix', default='seed', help='Usernames are <prefix><n>.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Posts per transaction.')
+        parser.add_argument('--skip-timelines', action='store_true', help="Don't rebuild the home timelines.")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['communities'] < 1:
+            raise CommandError('Seeding needs at least one user and one community.')
+
+        if User.objects.filter(username=f"{options['prefix']}0").exists():
+            raise CommandError(f"Users named {options['prefix']}<n> already exist, pick another --prefix.")
+
+        self.rng = random.Random(options['seed'])
+        self.zipf = options['zipf']
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=options['days'])
+
+        with explicit_timestamps(Community, Post, Vote, Comment, Subsriptions):
+            users = self.create_users(options['users'], options['prefix'])
+            communities = self.create_communities(options['communities'], options['prefix'])
+            self.create_subscriptions(users, communities, options['subscriptions'])
+            self.create_posts(users, communities, options['posts'], options['votes'], options['comments'])
+
+        # Explicit ids leave PostgreSQL's id sequences behind: move them past the new rows.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Profile, Community, Subsriptions, Post, Vote, Comment]):
+                cursor.execute(sql)
+
+        # bulk_create sent no signals: count the community stats in one go.
+        call_command('reconcile_community_stats', stdout=StringIO())
+        invalidate_communities()
+
+        if not options['skip_timelines']:
+            call_command('rebuild_timelines', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(communities)} communities, {self.subscriptions} subscriptions, "
+            f"{options['posts']} posts, {self.votes} votes and {self.comments} comments."
+        ))
+
+    # --- helpers ---
+
+    def zipf_weights(self, n):
+        # Cumulative weights of ranks 0..n-1 (rank 0 is the most popular).
+        return list(accumulate(1 / (rank + 1) ** self.zipf for rank in range(n)))
+
+    def pick(self, population, cum_weights, k=1):
+        return self.rng.choices(population, cum_weights=cum_weights, k=k)
+
+    def text(self, min_words, max_words):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(min_words, max_words)))
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def between(self, start, end):
+        return start + (end - start) * self.rng.random()
+
+    # --- the tables ---
+
+    def create_users(self, count, prefix):
+        password = make_password(PASSWORD)  # hashing is slow on purpose: once for everyone
+        first_id = self.next_id(User)
+        first_profile_id = self.next_id(Profile)
+        users = []
+
+        for start in range(0, count, self.batch_size):
+            batch = [
+                User(
+                    id=first_id + n, username=f'{prefix}{n}', password=password,
+                    date_joined=self.between(self.start - timedelta(days=365), self.start),
+                )
+                for n in range(start, min(start + self.batch_size, count))
+            ]
+
+            with transaction.atomic():
+                User.objects.bulk_create(batch)
+                Profile.objects.bulk_create([Profile(id=first_profile_id + user.id - first_id, user=user) for user in batch])
+
+            users.extend(user.id for user in batch)
+
+        return users
+
+    def create_communities(self, count, prefix):
+        first_id = self.next_id(Community)
+        communities = []
+
+        for n in range(count):
+            name = f'{prefix}-{self.rng.choice(WORDS)}-{n}'
+            communities.append(Community(
+                id=first_id + n, name=name, slug=slugify(name), description=self.text(5, 20),
+                created_at=self.between(self.start - timedelta(days=365), self.start),
+            ))
+
+        Community.objects.bulk_create(communities, batch_size=self.batch_size)
+
+        return [community.id for community in communities]
+
+    def create_subscriptions(self, users, communities, total):
+        # Active users (the low ranks) join more communities, and the popular
+        # communities (also the low ranks) get most of the members.
+        per_user = Counter(self.pick(range(len(users)), self.zipf_weights(len(users)), total))
+        community_weights = self.zipf_weights(len(communities))
+        next_id = self.next_id(Subsriptions)
+        batch = []
+        self.subscriptions = 0
+
+        for rank, user_id in enumerate(users):
+            wanted = min(per_user[rank], len(communities))
+            joined = set()
+
+            while len(joined) < wanted:
+                joined.update(self.pick(communities, community_weights, wanted - len(joined)))
+
+            for community_id in sorted(joined):
+                batch.append(Subsriptions(id=next_id, user_id=user_id, community_id=community_id, created_at=self.now))
+                next_id += 1
+
+            if len(batch) >= self.batch_size * 10:
+                self.subscriptions += self.flush(Subsriptions, batch)
+
+        self.subscriptions += self.flush(Subsriptions, batch)
+
+    def create_posts(self, users, communities, total, total_votes, total_comments):
+        user_weights = self.zipf_weights(len(users))
+        community_weights = self.zipf_weights(len(communities))
+
+        # How popular each post is: a shuffled Zipf rank, so popular posts are spread over time.
+        post_ranks = list(range(total))
+        self.rng.shuffle(post_ranks)
+        post_weights = self.zipf_weights(total)
+
+        # Exact totals: every vote/comment is handed to a post (by rank).
+        votes_per_rank = Counter(self.pick(range(total), post_weights, total_votes)) if total else Counter()
+        comments_per_rank = Counter(self.pick(range(total), post_weights, total_comments)) if total else Counter()
+
+        post_id = self.next_id(Post)
+        self.vote_id = self.next_id(Vote)
+        self.comment_id = self.next_id(Comment)
+        self.votes = 0
+        self.comments = 0
+        span = (self.now - self.start) / max(total, 1)
+
+        for start in range(0, total, self.batch_size):
+            posts, votes, comments = [], [], []
+
+            for n in range(start, min(start + self.batch_size, total)):
+                # Evenly spread over the period (with some jitter), oldest first: ids follow time.
+                created_at = self.start + span * (n + self.rng.random())
+
+                post = Post(
+                    id=post_id, title=self.text(3, 12).capitalize(), content=self.text(10, 150),
+                    author_id=self.pick(users, user_weights)[0],
+                    community_id=self.pick(communities, community_weights)[0],
+                    created_at=created_at,
+                )
+                post.render_body()  # save() would do it, bulk_create doesn't
+                post_id += 1
+
+                votes.extend(self.make_votes(post, users, votes_per_rank[post_ranks[n]]))
+                comments.extend(self.make_comments(post, users, user_weights, comments_per_rank[post_ranks[n]]))
+                posts.append(post)
+
+            with transaction.atomic():
+                Post.objects.bulk_create(posts)
+                self.votes += self.flush(Vote, votes)
+                self.comments += self.flush(Comment, comments)
+
+    def make_votes(self, post, users, count):
+        # Distinct voters; most votes on a post are upvotes.
+        voters = self.rng.sample(users, min(count, len(users)))
+        upvote_share = self.rng.uniform(0.55, 0.95)
+        votes = []
+
+        for user_id in voters:
+            value = Vote.UP if self.rng.random() < upvote_share else Vote.DOWN
+            votes.append(Vote(
+                id=self.vote_id, user_id=user_id, post_id=post.id, value=value,
+                created_at=self.between(post.created_at, self.now),
+            ))
+            self.vote_id += 1
+
+        post.upvote_count = sum(1 for vote in votes if vote.value == Vote.UP)
+        post.downvote_count = len(votes) - post.upvote_count
+        post.score = post.upvote_count - post.downvote_count
+        post.hot_rank = hot_rank(post.score, post.created_at)
+
+        return votes
+
+    def make_comments(self, post, users, user_weights, count):
+        comments = []
+        created_at = post.created_at
+
+        for _ in range(count):
+            # A third start a new thread, the others answer an earlier comment.
+            parent = None
+
+            if comments and self.rng.random() > 0.35:
+                parent = comments[self.rng.randrange(len(comments))]
+
+                if parent.depth >= Comment.MAX_DEPTH:
+                    parent = parent.parent
+
+            created_at = min(created_at + timedelta(seconds=self.rng.expovariate(1 / 600)), self.now)
+
+            comment = Comment(
+                id=self.comment_id, post_id=post.id, content=self.text(3, 60),
+                author_id=self.pick(users, user_weights)[0], created_at=created_at,
+                parent=parent,
+                root_id=parent.root_id if parent else self.comment_id,
+                depth=parent.depth + 1 if parent else 0,
+                path=(parent.path if parent else '') + f'{self.comment_id:0{Comment.PATH_SEGMENT}d}',
+            )
+            self.comment_id += 1
+
+            # +1 reply on every comment above this one.
+            while parent is not None:
+                parent.reply_count += 1
+                parent = parent.parent
+
+            comments.append(comment)
+
+        post.comment_count = len(comments)
+
+        return comments
+
+    def flush(self, model, rows):
+        count = len(rows)
+        model.objects.bulk_create(rows, batch_size=self.batch_size * 10)
+        rows.clear()
+        return count
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Lets bulk_create keep the created_at values we set: auto_now_add would
+    overwrite them all with the current time.
+    """
+    fields = [field for model in models for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+
+    for field in fields:
+        field.auto_now_add = False
+
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
@@ -0,0 +1,261 @@
+"""
+Per-request performance instrumentation.
+
+QueryBudgetMiddleware watches every request and records:
+
+    - how many SQL queries ran and how long the database took,
+    - which queries ran more than once (the tell-tale sign of an N+1 problem),
+    - how long the template took to render,
+
+and then reports them in three places:
+
+    1. a `Server-Timing` response header (shown in the browser dev tools, Network -> Timing),
+    2. one JSON log line per request on the 'core.perf' logger,
+    3. a small panel at the bottom of HTML pages when DEBUG is on.
+
+It also enforces settings.QUERY_BUDGETS ({'url name': max queries}). Going over the
+budget logs a warning, or raises QueryBudgetExceeded when settings.QUERY_BUDGET_STRICT
+is True (it is while the test suite runs, so a regression fails the tests).
+
+It works for sync and async views alike. An async view runs its queries on other
+threads (sync_to_async), so the recorder isn't tied to one thread's connection:
+it sits on every database connection and looks up the current request's stats
+in a ContextVar, which asgiref carries over into those threads.
+"""
+
+import contextvars
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import Template as DjangoTemplate
+from django.utils.html import escape
+
+logger = logging.getLogger('core.perf')
+
+# The stats of the request currently being handled (None outside of a request).
+# A ContextVar is like a global variable, but every thread / async task gets its own copy.
+_current_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = []        # (sql, params, seconds) for every query
+        self.template_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        # Runs the query ourselves (execute(...)) with a stopwatch around it.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, params, time.perf_counter() - start))
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def db_time(self):
+        return sum(seconds for _, _, seconds in self.queries)
+
+    def duplicates(self):
+        """
+        Queries whose SQL text ran more than once, most repeated first, as
+        [(fingerprint, times, sql)]. The SQL still has %s placeholders, so
+        "SELECT ... WHERE id = %s" run once per post shows up here even though
+        each run had a different id.
+        """
+        counts = Counter(sql for sql, _, _ in self.queries)
+
+        return [
+            (fingerprint(sql), times, sql)
+            for sql, times in counts.most_common()
+            if times > 1
+        ]
+
+
+def _record_query(execute, sql, params, many, context):
+    # A "database execute wrapper": Django calls it INSTEAD of running each query.
+    stats = _current_stats.get()
+
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    return stats.record_query(execute, sql, params, many, context)
+
+
+# Every connection opened from now on (in any thread) gets the recorder.
+@receiver(connection_created)
+def install_query_recorder(sender=None, connection=None, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def fingerprint(sql):
+    return hashlib.sha1(sql.encode()).hexdigest()[:10]
+
+
+def _timed_template_render(original_render):
+    # Wraps Django's template render() so the time it takes is added to the
+    # current request's stats. Only the outermost render is a backend Template,
+    # {% include %}s happen inside it, so nothing is counted twice.
+    def render(self, *args, **kwargs):
+        stats = _current_stats.get()
+
+        if stats is None:
+            return original_render(self, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return original_render(self, *args, **kwargs)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+    render._query_budget_wrapped = True
+    return render
+
+
+class QueryBudgetMiddleware:
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        # Under ASGI with async views, Django hands us an async get_response: then
+        # we must be async too, or every request would be forced back into a thread.
+        self.is_async = iscoroutinefunction(get_response)
+
+        if self.is_async:
+            markcoroutinefunction(self)
+
+        if not getattr(DjangoTemplate.render, '_query_budget_wrapped', False):
+            DjangoTemplate.render = _timed_template_render(DjangoTemplate.render)
+
+        # The connections that are already open (the rest get it from connection_created).
+        for connection in connections.all():
+            install_query_recorder(connection=connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        start = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, total_time):
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+
+        response['Server-Timing'] = self.server_timing(stats, total_time)
+        self.log(request, response, stats, total_time, url_name)
+        self.check_budget(stats, url_name)
+
+        if settings.DEBUG and getattr(settings, 'QUERY_DEBUG_PANEL', True):
+            self.add_debug_panel(request, response, stats, total_time, url_name)
+
+        return response
+
+    def server_timing(self, stats, total_time):
+        # Format: name;dur=<milliseconds>;desc="<label>", ...
+        return ', '.join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.query_count} queries"',
+            f'dup;desc="{sum(times - 1 for _, times, _ in stats.duplicates())} repeated"',
+            f'tpl;dur={stats.template_time * 1000:.1f};desc="template"',
+            f'total;dur={total_time * 1000:.1f}',
+        ])
+
+    def log(self, request, response, stats, total_time, url_name):
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'url_name': url_name,
+            'status': response.status_code,
+            'queries': stats.query_count,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'template_ms': round(stats.template_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+            'duplicates': {fp: times for fp, times, _ in stats.duplicates()},
+        }))
+
+    def check_budget(self, stats, url_name):
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+
+        if budget is None or stats.query_count <= budget:
+            return
+
+        message = f"View '{url_name}' ran {stats.query_count} queries (budget is {budget})."
+
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            repeated = '\n'.join(f'  {times}x {sql}' for _, times, sql in stats.duplicates())
+            raise QueryBudgetExceeded(f'{message}\nRepeated queries:\n{repeated or "  (none)"}')
+
+        logger.warning(message)
+
+    def add_debug_panel(self, request, response, stats, total_time, url_name):
+        if response.streaming or 'text/html' not in response.get('Content-Type', ''):
+            return
+
+        content = response.content.decode(response.charset)
+
+        if '</body>' not in content:
+            return
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        over_budget = budget is not None and stats.query_count > budget
+
+        repeated = ''.join(
+            f'<li><b>{times}x</b> <code>{escape(sql[:300])}</code></li>'
+            for _, times, sql in stats.duplicates()[:10]
+        )
+
+        panel = (
+            '<div id="query-debug-panel" style="position:fixed;bottom:0;right:0;z-index:9999;'
+            'max-width:45%;max-height:40%;overflow:auto;font-size:12px;opacity:.92" '
+            f'class="card shadow-sm {"border-danger" if over_budget else ""}"><div class="card-body p-2">'
+            f'<b>{escape(url_name or request.path)}</b>: '
+            f'{stats.query_count} queries{f" (budget {budget})" if budget is not None else ""} '
+            f'&bull; db {stats.db_time * 1000:.1f} ms &bull; template {stats.template_time * 1000:.1f} ms '
+            f'&bull; total {total_time * 1000:.1f} ms'
+            f'{f"<ul class=mb-0>{repeated}</ul>" if repeated else ""}'
+            '</div></div>'
+        )
+
+        response.content = content.replace('</body>', panel + '</body>', 1).encode(response.charset)
+
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = len(response.content)
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.25 on 2026-10-18 00:54
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_vote_counters(apps, schema_editor):
+    # Fill the new columns for posts that already have votes.
+    # Only posts with at least one vote need touching, the rest stay at 0.
+    Post = apps.get_model('core', 'Post')
+
+    up = dict(
+        Post.upvotes.through.objects.values('post_id')
+        .annotate(n=Count('id')).values_list('post_id', 'n')
+    )
+    down = dict(
+        Post.downvotes.through.objects.values('post_id')
+        .annotate(n=Count('id')).values_list('post_id', 'n')
+    )
+
+    for post_id in set(up) | set(down):
+        Post.objects.filter(pk=post_id).update(
+            upvote_count=up.get(post_id, 0),
+            downvote_count=down.get(post_id, 0),
+            score=up.get(post_id, 0) - down.get(post_id, 0),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_subsriptions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='downvote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='upvote_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_vote_counters, migrations.RunPython.noop),
+    ]
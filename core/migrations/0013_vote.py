@@ -0,0 +1,75 @@
+# Generated by Django 4.2.25 on 2026-10-18 00:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_m2m_votes(apps, schema_editor):
+    # Move every row of the old upvotes/downvotes join tables into the Vote table.
+    # Upvotes are copied first, so if a user somehow sits in BOTH tables the
+    # upvote wins (ignore_conflicts skips the duplicate downvote).
+    Post = apps.get_model('core', 'Post')
+    Vote = apps.get_model('core', 'Vote')
+
+    for through, value in ((Post.upvotes.through, 1), (Post.downvotes.through, -1)):
+        batch = []
+
+        for post_id, user_id in through.objects.values_list('post_id', 'user_id').iterator(chunk_size=2000):
+            batch.append(Vote(post_id=post_id, user_id=user_id, value=value))
+
+            if len(batch) >= 2000:
+                Vote.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+
+        Vote.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def copy_votes_back(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Vote = apps.get_model('core', 'Vote')
+
+    for through, value in ((Post.upvotes.through, 1), (Post.downvotes.through, -1)):
+        through.objects.bulk_create(
+            (through(post_id=post_id, user_id=user_id)
+             for post_id, user_id in Vote.objects.filter(value=value).values_list('post_id', 'user_id').iterator()),
+            batch_size=2000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0012_post_vote_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.SmallIntegerField(choices=[(1, 'Upvote'), (-1, 'Downvote')])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='core.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_vote_per_user_post'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.CheckConstraint(check=models.Q(('value__in', [1, -1])), name='vote_value_is_plus_or_minus_one'),
+        ),
+        migrations.RunPython(copy_m2m_votes, copy_votes_back),
+        migrations.RemoveField(
+            model_name='post',
+            name='downvotes',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='upvotes',
+        ),
+    ]
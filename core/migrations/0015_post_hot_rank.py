@@ -0,0 +1,57 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:00
+
+import math
+
+from django.db import migrations, models
+
+
+def backfill_hot_rank(apps, schema_editor):
+    # Same formula as core.ranking.hot_rank (copied, so this migration keeps
+    # working even if that module changes later).
+    Post = apps.get_model('core', 'Post')
+
+    batch = []
+
+    for post in Post.objects.only('id', 'score', 'created_at').iterator(chunk_size=2000):
+        order = math.log10(max(abs(post.score), 1))
+        sign = (post.score > 0) - (post.score < 0)
+        post.hot_rank = round(sign * order + (post.created_at.timestamp() - 1134028003) / 45000, 7)
+        batch.append(post)
+
+        if len(batch) >= 2000:
+            Post.objects.bulk_update(batch, ['hot_rank'])
+            batch = []
+
+    Post.objects.bulk_update(batch, ['hot_rank'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_post_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_rank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_hot_rank, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_rank', '-id'], name='post_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-score', '-id'], name='post_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['community', '-hot_rank', '-id'], name='post_community_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['community', '-score', '-id'], name='post_community_top_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_timelines(apps, schema_editor):
+    # Every existing subscription gets the latest posts of its community, so
+    # "Your Feed" isn't empty right after deploying. (Same as core.timeline.backfill,
+    # copied so this migration keeps working if that module changes later.)
+    Post = apps.get_model('core', 'Post')
+    Subsriptions = apps.get_model('core', 'Subsriptions')
+    TimelineEntry = apps.get_model('core', 'TimelineEntry')
+
+    length = getattr(settings, 'TIMELINE_LENGTH', 1000)
+
+    for user_id, community_id in Subsriptions.objects.values_list('user_id', 'community_id').iterator():
+        latest = (
+            Post.objects.filter(community_id=community_id)
+            .order_by('-created_at', '-id')
+            .values_list('id', 'created_at')[:length]
+        )
+
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=user_id, post_id=post_id, community_id=community_id, created_at=created_at)
+                for post_id, created_at in latest
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0015_post_hot_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='community',
+            name='fanout_on_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('community', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.community')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='core.post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'), models.Index(fields=['user', 'community'], name='timeline_user_community_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Full-text search index for posts (see core/search.py).
+#
+# The SQL is different for every database, so it runs from RunPython where we
+# can check which database we are on. The statements are copied here (not
+# imported from core.search) so this migration keeps working if that module changes.
+
+from django.db import migrations
+
+SQLITE_INSTALL = [
+    # External-content FTS5 table: it stores only the index, the text stays in core_post.
+    """
+    CREATE VIRTUAL TABLE core_post_fts USING fts5(
+        title, content,
+        content='core_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    # Keep the index in sync with every INSERT / DELETE / UPDATE on core_post, including
+    # bulk_create() and queryset.update(), which never send Django signals.
+    """
+    CREATE TRIGGER core_post_fts_insert AFTER INSERT ON core_post BEGIN
+        INSERT INTO core_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER core_post_fts_delete AFTER DELETE ON core_post BEGIN
+        INSERT INTO core_post_fts(core_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    # Only when the text changes: a vote updates the counters on core_post many
+    # times a second and must not rewrite the search index every time.
+    """
+    CREATE TRIGGER core_post_fts_update AFTER UPDATE OF title, content ON core_post BEGIN
+        INSERT INTO core_post_fts(core_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO core_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    # Index the posts that already exist.
+    "INSERT INTO core_post_fts(core_post_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS core_post_fts_insert',
+    'DROP TRIGGER IF EXISTS core_post_fts_delete',
+    'DROP TRIGGER IF EXISTS core_post_fts_update',
+    'DROP TABLE IF EXISTS core_post_fts',
+]
+
+# An expression index: PostgreSQL keeps it up to date by itself, no triggers needed.
+POSTGRESQL_INSTALL = [
+    """
+    CREATE INDEX core_post_search_idx ON core_post USING GIN ((
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ))
+    """,
+]
+
+POSTGRESQL_UNINSTALL = [
+    'DROP INDEX IF EXISTS core_post_search_idx',
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_timeline_entry'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_INSTALL, 'postgresql': POSTGRESQL_INSTALL}),
+            run({'sqlite': SQLITE_UNINSTALL, 'postgresql': POSTGRESQL_UNINSTALL}),
+        ),
+    ]
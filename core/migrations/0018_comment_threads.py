@@ -0,0 +1,68 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill(apps, schema_editor):
+    # Every existing comment is top-level: its path is just its own id.
+    # Then each post gets its comment_count.
+    Comment = apps.get_model('core', 'Comment')
+    Post = apps.get_model('core', 'Post')
+
+    batch = []
+
+    for comment in Comment.objects.only('id').iterator(chunk_size=2000):
+        comment.path = f'{comment.pk:010d}'
+        batch.append(comment)
+
+        if len(batch) >= 2000:
+            Comment.objects.bulk_update(batch, ['path'])
+            batch = []
+
+    Comment.objects.bulk_update(batch, ['path'])
+
+    counts = Comment.objects.values('post_id').annotate(total=models.Count('id')).order_by()
+
+    for row in counts.iterator():
+        Post.objects.filter(pk=row['post_id']).update(comment_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='core.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
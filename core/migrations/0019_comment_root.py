@@ -0,0 +1,49 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_root(apps, schema_editor):
+    # The root is the first id in the path.
+    Comment = apps.get_model('core', 'Comment')
+
+    batch = []
+
+    for comment in Comment.objects.only('id', 'path').iterator(chunk_size=2000):
+        comment.root_id = int(comment.path[:10] or comment.pk)
+        batch.append(comment)
+
+        if len(batch) >= 2000:
+            Comment.objects.bulk_update(batch, ['root'])
+            batch = []
+
+    Comment.objects.bulk_update(batch, ['root'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.comment'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', '-created_at', '-id'], name='comment_post_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', '-reply_count', '-id'], name='comment_post_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['root', 'path'], name='comment_root_path_idx'),
+        ),
+        migrations.RunPython(backfill_root, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_comment_root'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['author', '-created_at'], name='comment_author_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='community',
+            index=models.Index(fields=['-created_at'], name='community_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['community', '-created_at', '-id'], name='post_community_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='post_author_new_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subsriptions',
+            index=models.Index(fields=['community', 'user'], name='subscription_community_idx'),
+        ),
+    ]
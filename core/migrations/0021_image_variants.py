@@ -0,0 +1,34 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:17
+
+import core.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='post_image/', validators=[core.images.validate_image_upload]),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='profile_image',
+            field=models.ImageField(default='default.jpg', upload_to='profile_images', validators=[core.images.validate_image_upload]),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import timedelta
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+
+def fill_community_stats(apps, schema_editor):
+    # One row per existing community, counted from the real tables.
+    # (Same as core.stats.recount, copied so this migration keeps working if that module changes.)
+    Community = apps.get_model('core', 'Community')
+    CommunityStats = apps.get_model('core', 'CommunityStats')
+    Post = apps.get_model('core', 'Post')
+    Subsriptions = apps.get_model('core', 'Subsriptions')
+
+    since = timezone.now() - timedelta(hours=24)
+
+    subscribers = dict(
+        Subsriptions.objects.values('community_id').annotate(total=Count('id')).values_list('community_id', 'total')
+    )
+    posts = {
+        row[0]: row[1:]
+        for row in Post.objects.filter(community__isnull=False)
+        .values('community_id')
+        .annotate(total=Count('id'), recent=Count('id', filter=Q(created_at__gte=since)), last=Max('created_at'))
+        .values_list('community_id', 'total', 'recent', 'last')
+    }
+
+    rows = []
+
+    for community_id in Community.objects.values_list('id', flat=True).iterator():
+        post_count, recent, last = posts.get(community_id, (0, 0, None))
+        rows.append(CommunityStats(
+            community_id=community_id, subscriber_count=subscribers.get(community_id, 0),
+            post_count=post_count, posts_last_24h=recent, last_post_at=last,
+        ))
+
+    CommunityStats.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommunityStats',
+            fields=[
+                ('community', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='core.community')),
+                ('subscriber_count', models.PositiveIntegerField(default=0)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('posts_last_24h', models.PositiveIntegerField(default=0)),
+                ('last_post_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-posts_last_24h', '-subscriber_count', '-community'], name='community_stats_trending_idx')],
+            },
+        ),
+        migrations.RunPython(fill_community_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.25 on 2026-10-18 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_community_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(choices=[('post', 'Post'), ('community', 'Community'), ('user', 'User')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('step', models.CharField(blank=True, max_length=20)),
+                ('rows_deleted', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='community',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='deletion',
+            constraint=models.UniqueConstraint(fields=('target', 'object_id'), name='unique_deletion'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.25 on 2026-10-18 02:17
+
+from django.db import migrations, models
+from django.utils.html import linebreaks
+from django.utils.text import Truncator
+
+
+def fill_excerpts(apps, schema_editor):
+    # The excerpt and HTML of every existing post, 1000 posts per UPDATE batch.
+    # (Same as Post.render_body, copied so this migration keeps working if that changes.)
+    Post = apps.get_model('core', 'Post')
+
+    last_id = 0
+
+    while True:
+        posts = list(Post.objects.filter(pk__gt=last_id).order_by('pk').only('id', 'content')[:1000])
+
+        if not posts:
+            break
+
+        for post in posts:
+            post.excerpt = Truncator(' '.join(post.content.split())).words(50)
+            post.content_html = linebreaks(post.content, autoescape=True)
+
+        Post.objects.bulk_update(posts, ['excerpt', 'content_html'])
+        last_id = posts[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,33 @@
 from django.db import models
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Subquery
 
 # --- 1. ADD THIS IMPORT ---
 # Import the built-in User model from Django's authentication system
 from django.contrib.auth.models import User
-from django.utils.text import slugify
+from django.utils import timezone
+from django.utils.html import linebreaks
+from django.utils.text import Truncator, slugify
+
+from . import images
+from .cache import invalidate_communities, invalidate_listings, invalidate_post
+from .ranking import hot_rank
 
 # in order to create and sync the profile functionality, below imports are done
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver 
 
 # Create your models here.
 
+# The default manager of the models that can be soft-deleted (see core/deletion.py):
+# a deleted row stays in the table until it is purged, but no page should ever show it.
+# (Following a foreign key, e.g. comment.post, still works: Django uses a plain manager for that.)
+class NotDeletedManager(models.Manager):
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 # This is the model for our "Subreddit"
 # models.Model turns your Python class into a Django database table with superpowers.
 class Community(models.Model):
@@ -21,6 +38,26 @@ class Community(models.Model):
     description = models.TextField(blank=True) # blank=True means this field is optional
     created_at = models.DateTimeField(auto_now_add=True) # Automatically sets the time when created
 
+    # Communities with a LOT of subscribers are too big to copy every new post into every
+    # subscriber's home timeline (see core/timeline.py). For those, this flag is switched on
+    # and the home feed reads their posts directly instead ("fan-out on read").
+    fanout_on_read = models.BooleanField(default=False)
+
+    # Set when the community is deleted. From then on it is hidden everywhere, and the
+    # rows under it are removed in the background, a batch at a time (see core/deletion.py).
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Community.objects never returns deleted communities. all_objects does.
+    objects = NotDeletedManager()
+    all_objects = models.Manager()
+
+    class Meta:
+
+        indexes = [
+            # The "newest communities" sidebar on the home page.
+            models.Index(fields=['-created_at'], name='community_created_idx'),
+        ]
+
     def save(self, *args, **kwargs):
 
         if not self.slug:
@@ -32,6 +69,61 @@ class Community(models.Model):
     def __str__(self):
         return self.name
     
+# A QuerySet is Django's "lazy list of rows". By writing our own, we can give Post
+# reusable building blocks, e.g. Post.objects.for_listing().filter(community=c)
+class PostQuerySet(models.QuerySet):
+
+    def for_listing(self):
+        """
+        Everything a post card (home, community, profile, search) needs, in ONE query.
+        """
+        return (
+            self
+            # select_related = SQL JOIN. Without it, every {{ post.author.username }}
+            # and {{ post.community.name }} in a template would run its own query
+            # (the classic "N+1 queries" problem: 1 for the list + 1 per post).
+            .select_related('author', 'community')
+            # defer = "don't SELECT this column". The full body can be huge; the cards
+            # use the stored 'excerpt' (its first EXCERPT_WORDS words) instead.
+            # (The vote and comment numbers are real columns too: upvote_count,
+            # score, comment_count... Nothing is counted per post.)
+            .defer('content', 'content_html')
+        )
+
+    def with_viewer_vote(self, user):
+        """
+        Adds 'viewer_vote' (1, -1 or None) to every post, so the templates can
+        highlight the arrows the logged-in user already clicked without running
+        one query per post.
+        """
+        if not user.is_authenticated:
+            return self
+
+        return self.annotate(
+            viewer_vote=Subquery(
+                Vote.objects.filter(post=OuterRef('pk'), user=user).values('value')[:1]
+            )
+        )
+
+    def not_subscribed_by(self, user):
+        """
+        Posts in the communities `user` did NOT join (the "Explore" list).
+
+        NOT EXISTS (an anti-join) rather than NOT IN (<every joined id>): the
+        database can stop at the first matching subscription.
+        Posts without a community count as not joined.
+        """
+        if not user.is_authenticated:
+            return self
+
+        return self.filter(~Exists(_joined_community(user)))
+
+
+def _joined_community(user):
+    # "Did `user` join the community of the outer post?"
+    return Subsriptions.objects.filter(user=user, community=OuterRef('community'))
+
+
 # This is the model for our "Post"
 class Post(models.Model):
 
@@ -52,52 +144,188 @@ class Post(models.Model):
     # all of their posts are deleted too.
     author = models.ForeignKey(User, on_delete=models.CASCADE)
 
-    # We use a ManyToManyField to link a Post to many Users (who upvoted).
-    # related_name='post_upvotes' gives us a way to find all posts a user
-    # has upvoted (e.g., user.post_upvotes.all()).
-    # blank=True means a post can have zero upvotes.
-
-    # Forward name: upvotes (the field name you wrote on the Post model).
-
-    # Reverse name: post_upvotes (the related_name you specified, which gets attached to the User model).
-    # post.upvotes.all() → “Who liked this post?”
-    # user.post_upvotes.all() → “Which posts did this user like?”
-
-
-
-    # VERY IMPORTANT NOTE REGARDING ACCESSING FIELDS VIA FOREIGNKEY AND MANYTOMANYFIELDS:
+    # VERY IMPORTANT NOTE REGARDING ACCESSING FIELDS VIA FOREIGNKEY AND REVERSE RELATIONS:
 
     # we can use post.author.username to get the username of the author of the post, because:
     # it is a single object, so we can access its fields directly using dot notation.
 
-    # but, for upvotes and downvotes, they are ManyToManyFields, so they can have multiple users associated with them.
-    # therefore, we cannot access a single field directly using dot notation.
-    # instead, we have to use the .all() method to get a queryset of all related users, 
-    # and then we can iterate over that queryset or use other queryset methods to access individual user fields
-    
-    
-    upvotes = models.ManyToManyField(User, related_name='post_upvotes', blank=True)
-
-    # We do the same for downvotes.
-    downvotes = models.ManyToManyField(User, related_name='post_downvotes', blank=True)
+    # but, votes are stored in their own table (see the Vote model below), and a post can have
+    # many of them. therefore, we cannot access a single vote directly using dot notation.
+    # instead, we use the reverse relation post.votes (related_name='votes') to get a queryset,
+    # e.g. post.votes.filter(value=Vote.UP) → "Who liked this post?"
+    # and user.votes.filter(value=Vote.UP) → "Which posts did this user like?"
 
     # upload_to='post_images/': This tells Django where to save the images.
     #   It will save them to 'MEDIA_ROOT/post_images/'
     # blank=True, null=True: This makes the image optional.
     #   A user can create a post *without* uploading an image.
-    image = models.ImageField(upload_to='post_image/', blank=True, null=True)
+    image = models.ImageField(upload_to='post_image/', blank=True, null=True, validators=[images.validate_image_upload])
+
+    # The resized WebP copies of 'image' (made in the background, see core/images.py).
+    # The templates use these instead of the full-size upload.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # --- DENORMALIZED VOTE COUNTERS ---
+    # The old 'score' was a @property that ran upvotes.count() - downvotes.count(),
+    # which is 2 COUNT queries for EVERY post card a template shows.
+    # Now the numbers live in real columns on the post row itself, so reading
+    # {{ post.score }} costs zero extra queries.
+    # They are kept up to date by core/votes.py (with F() expressions, so two
+    # people voting at the same time can't overwrite each other's vote), and can be
+    # rebuilt from the vote tables with: python manage.py reconcile_vote_counts
+    upvote_count = models.PositiveIntegerField(default=0)
+    downvote_count = models.PositiveIntegerField(default=0)
+    score = models.IntegerField(default=0)
+
+    # Same idea for comments (replies included), kept up to date by Comment.save()/delete().
+    comment_count = models.PositiveIntegerField(default=0)
+
+    # --- "HOT" RANKING ---
+    # A mix of the score and how new the post is (the formula is explained in core/ranking.py).
+    # It is stored (and indexed) so ?sort=hot is a plain index scan. It is set when the post
+    # is created, moved by every vote, and can be rebuilt with: python manage.py recompute_hot_ranks
+    hot_rank = models.FloatField(default=0)
+
+    # --- STORED EXCERPT AND HTML ---
+    # The cards used to run |truncatewords:50|linebreaks over the body on every render,
+    # so every listing read (and split into words) whole posts. Both are made ONCE
+    # instead, when the post is saved (see render_body), and the listings only
+    # SELECT the short excerpt.
+    EXCERPT_WORDS = 50
+
+    excerpt = models.TextField(blank=True, editable=False)
+    # The body as HTML paragraphs (escaped: safe to show with |safe). For the post page.
+    content_html = models.TextField(blank=True, editable=False)
+
+    # Set when the post (or its community, or its author) is deleted: see core/deletion.py.
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Post.objects now has our extra methods (for_listing, with_viewer_vote, ...),
+    # and leaves the deleted posts out. all_objects includes them.
+    objects = NotDeletedManager.from_queryset(PostQuerySet)()
+    all_objects = PostQuerySet.as_manager()
+
+    class Meta:
+
+        indexes = [
+            # Every post listing is "newest first" (see core/pagination.py), and the
+            # cursor for the next page is (created_at, id). With this index the
+            # database reads the page straight out of the index in order.
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),
+            # The same idea for ?sort=hot and ?sort=top, on the whole site and inside a community.
+            models.Index(fields=['-hot_rank', '-id'], name='post_hot_idx'),
+            models.Index(fields=['-score', '-id'], name='post_top_idx'),
+            models.Index(fields=['community', '-hot_rank', '-id'], name='post_community_hot_idx'),
+            models.Index(fields=['community', '-score', '-id'], name='post_community_top_idx'),
+            # ?sort=new inside a community (and the timeline backfill when joining one).
+            models.Index(fields=['community', '-created_at', '-id'], name='post_community_new_idx'),
+            # A user's posts on their profile page, newest first.
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_new_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+
+        # A brand new post starts with the "hot" value of its score at this moment.
+        # After that, only votes change it (see core/votes.py).
+        if self._state.adding:
+
+            self.hot_rank = hot_rank(self.score, self.created_at or timezone.now())
+
+        # The excerpt and the HTML follow the body (save(update_fields=[...]) without
+        # 'content' leaves them alone).
+        update_fields = kwargs.get('update_fields')
+
+        if update_fields is None or 'content' in update_fields:
+            self.render_body()
+
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'excerpt', 'content_html'}
+
+        super().save(*args, **kwargs)
+
+    def render_body(self):
+        """
+        Fills in 'excerpt' and 'content_html' from 'content'. save() calls it; call it
+        yourself before a bulk_create() or after an .update(content=...).
+        """
+        # One line of plain text: the cards show it as it is (no |linebreaks), so
+        # short and long posts look the same. Truncator only joins the lines of
+        # a text it actually cuts, hence the split() first.
+        self.excerpt = Truncator(' '.join(self.content.split())).words(self.EXCERPT_WORDS)
+        self.content_html = linebreaks(self.content, autoescape=True)
+
+    # --- IMAGE URLS for the templates (fall back to the original until the variants exist) ---
 
     @property
-    def score(self):
+    def card_image_url(self):
+        return images.variant_url(self.image_variants, 'card', self.image.url if self.image else '')
 
-        return self.upvotes.count() - self.downvotes.count()
+    @property
+    def detail_image_url(self):
+        return images.variant_url(self.image_variants, 'detail', self.image.url if self.image else '')
+
+    @property
+    def image_srcset(self):
+        return images.srcset(self.image_variants, images.POST_VARIANTS)
 
     def __str__(self):
         return self.title
-    
+
+
+# One row per (user, post) pair that has a vote.
+# This replaces the old 'upvotes' and 'downvotes' ManyToManyFields. With those, checking
+# "did this user already vote?" meant `user in post.upvotes.all()`, which loads EVERY
+# voter of the post into Python. With this table it is a single lookup on the
+# (user, post) unique index, no matter how popular the post is.
+class Vote(models.Model):
+
+    UP = 1
+    DOWN = -1
+
+    VALUE_CHOICES = [
+        (UP, 'Upvote'),
+        (DOWN, 'Downvote'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='votes')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='votes')
+    value = models.SmallIntegerField(choices=VALUE_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+
+        constraints = [
+            # A user can only have ONE vote on a post (either up or down).
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_vote_per_user_post'),
+            models.CheckConstraint(check=models.Q(value__in=[1, -1]), name='vote_value_is_plus_or_minus_one'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {'+1' if self.value == self.UP else '-1'} on post {self.post_id}"
+
 # Creating a new model for the comment functionality
 
 class Comment(models.Model):
+
+    # --- THREADS ---
+    # A reply points at the comment it answers (parent). To load a whole thread in
+    # ONE query, every comment also stores its "materialized path": the ids of all
+    # its ancestors and itself, each zero-padded to PATH_SEGMENT characters:
+    #
+    #     comment 5                     path = '0000000005'
+    #       reply 9 (to 5)              path = '00000000050000000009'
+    #         reply 12 (to 9)           path = '000000000500000000090000000012'
+    #     comment 7                     path = '0000000007'
+    #
+    # ORDER BY path then gives exactly the order a thread is read in (every comment
+    # followed by its replies, oldest first), and "everything under comment 5" is
+    # just "path starts with '0000000005'". See core/comments.py.
+    PATH_SEGMENT = 10
+
+    # path is 255 characters long, so at most 25 levels fit. Replies to a comment that
+    # is already this deep are attached to its parent instead (they appear next to it).
+    MAX_DEPTH = 24
+
     # This is the actual text content of the comment.
     content = models.TextField()
 
@@ -112,6 +340,79 @@ class Comment(models.Model):
     # If a Post is deleted, all its comments are deleted too.
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
 
+    # The comment this one replies to (None for a top-level comment).
+    # Deleting a comment deletes its replies too.
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+
+    # The top-level comment this one is under (itself, for a top-level comment). Lets a
+    # page of top-level comments load all of their replies with one "root_id IN (...)".
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, editable=False, related_name='+')
+
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    # How many replies are under this comment, at any depth ("12 more replies").
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+
+        indexes = [
+            # Loading a thread: WHERE post_id = ? ORDER BY path
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            # One page of top-level comments, ?sort=new|old and ?sort=top (core/comments.py)
+            models.Index(fields=['post', 'depth', '-created_at', '-id'], name='comment_post_new_idx'),
+            models.Index(fields=['post', 'depth', '-reply_count', '-id'], name='comment_post_top_idx'),
+            # The replies under a page of top-level comments: WHERE root_id IN (...) ORDER BY path
+            models.Index(fields=['root', 'path'], name='comment_root_path_idx'),
+            # A user's comments on their profile page, newest first.
+            models.Index(fields=['author', '-created_at'], name='comment_author_new_idx'),
+        ]
+
+    def ancestor_ids(self):
+        """
+        The ids of every comment above this one, read from the path (no queries).
+        """
+        size = self.PATH_SEGMENT
+        return [int(self.path[i:i + size]) for i in range(0, len(self.path) - size, size)]
+
+    def save(self, *args, **kwargs):
+
+        if not self._state.adding:
+            # An edit: only the text changes, the place in the thread stays the same.
+            return super().save(*args, **kwargs)
+
+        parent = self.parent
+
+        if parent is not None and parent.depth >= self.MAX_DEPTH:
+            # Too deep to nest any further: becomes a sibling of its parent.
+            parent = parent.parent
+            self.parent = parent
+
+        self.depth = parent.depth + 1 if parent is not None else 0
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # The id only exists after the INSERT, so the path is written right after it.
+            self.path = (parent.path if parent is not None else '') + f'{self.pk:0{self.PATH_SEGMENT}d}'
+            self.root_id = parent.root_id if parent is not None else self.pk
+            Comment.objects.filter(pk=self.pk).update(path=self.path, root_id=self.root_id)
+
+            # Counters: +1 on the post, and +1 reply on every comment above this one.
+            Post.objects.filter(pk=self.post_id).update(comment_count=F('comment_count') + 1)
+            Comment.objects.filter(pk__in=self.ancestor_ids()).update(reply_count=F('reply_count') + 1)
+
+    def delete(self, *args, **kwargs):
+
+        # The replies under this comment go with it (on_delete=CASCADE).
+        removed = 1 + self.reply_count
+
+        with transaction.atomic():
+            Post.objects.filter(pk=self.post_id).update(comment_count=F('comment_count') - removed)
+            Comment.objects.filter(pk__in=self.ancestor_ids()).update(reply_count=F('reply_count') - removed)
+
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         # This will make the admin panel show the first 50 characters
         # of the comment, so it's easy to identify.
@@ -126,7 +427,18 @@ class Profile(models.Model):
     bio = models.TextField(max_length=500, blank=True)
     location = models.CharField(max_length=30, blank=True)
 
-    profile_image = models.ImageField(default='default.jpg', upload_to='profile_images')
+    profile_image = models.ImageField(default='default.jpg', upload_to='profile_images', validators=[images.validate_image_upload])
+
+    # Small WebP copies of the profile picture (see core/images.py).
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    @property
+    def avatar_url(self):
+        return images.variant_url(self.image_variants, 'avatar', self.profile_image.url)
+
+    @property
+    def avatar_large_url(self):
+        return images.variant_url(self.image_variants, 'avatar_large', self.profile_image.url)
 
     def __str__(self):
         return f'{self.user.username} Profile'
@@ -140,7 +452,12 @@ def create_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
     
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
+def save_profile(sender, instance, update_fields=None, **kwargs):
+
+    # Logging in saves the user with update_fields={'last_login'}: nothing about
+    # the profile changed, so don't write it again on every login.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
 
     instance.profile.save()
 
@@ -155,10 +472,267 @@ class Subsriptions(models.Model):
     class Meta:
 
         # A specific combination of user and community can only exist once.
+        # (This also gives an index on (user, community): "has this user joined?")
         unique_together = ('user', 'community')
 
+        indexes = [
+            # "Who is subscribed to this community?" (fanning a new post out to their
+            # timelines). Both columns are in the index, so the table itself isn't read.
+            models.Index(fields=['community', 'user'], name='subscription_community_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} -> {self.community.name}"
+
+
+# Counters shown next to a community (members, posts, activity), kept up to date on every
+# post and join instead of being counted each time a page is shown. See core/stats.py.
+class CommunityStats(models.Model):
+
+    community = models.OneToOneField(Community, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+
+    subscriber_count = models.PositiveIntegerField(default=0)
+    post_count = models.PositiveIntegerField(default=0)
+
+    # Approximate between two runs of `manage.py reconcile_community_stats`.
+    posts_last_24h = models.PositiveIntegerField(default=0)
+    last_post_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+
+        indexes = [
+            # The "Trending Communities" sidebar (core.stats.trending).
+            models.Index(
+                fields=['-posts_last_24h', '-subscriber_count', '-community'],
+                name='community_stats_trending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"stats of community {self.community_id}"
+
+
+# The materialized home feed: one row per (user, post) that should appear in that user's
+# "Your Feed". Rows are written when a post is created in a community the user joined
+# ("fan-out on write") and when the user joins a community, so reading the feed is one
+# range read on the (user, created_at, post) index instead of an IN-list scan over every
+# post of every joined community. See core/timeline.py.
+class TimelineEntry(models.Model):
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+
+    # Copied from the post, so leaving a community can delete its rows and
+    # the timeline can be read newest-first without touching the post table.
+    community = models.ForeignKey(Community, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'),
+            models.Index(fields=['user', 'community'], name='timeline_user_community_idx'),
+        ]
+
+    def __str__(self):
+        return f"post {self.post_id} in the timeline of user {self.user_id}"
+
+
+# Work that doesn't have to happen inside the request (resizing images, filling
+# timelines...). Views and signals add a row with core.jobs.enqueue(), and the
+# `manage.py runworker` process runs it. See core/jobs.py.
+class Job(models.Model):
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    # The dotted path of the function to call, and its keyword arguments.
+    task = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+
+    # Optional: a second enqueue() with the same key doesn't add a second job.
+    key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+
+    # Not before this time (retries are pushed back further each time).
+    run_at = models.DateTimeField(default=timezone.now)
+
+    # Which worker thread is running it, and since when.
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+
+        indexes = [
+            # "The next jobs that are due": what every worker polls for.
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+
+# A post, community or user that was deleted, and how far purging the rows under it
+# has got. core.deletion.soft_delete() adds the row, core.deletion.purge() does the work.
+class Deletion(models.Model):
+
+    POST = 'post'
+    COMMUNITY = 'community'
+    USER = 'user'
+
+    TARGET_CHOICES = [
+        (POST, 'Post'),
+        (COMMUNITY, 'Community'),
+        (USER, 'User'),
+    ]
+
+    target = models.CharField(max_length=10, choices=TARGET_CHOICES)
+    object_id = models.PositiveIntegerField()
+
+    # Progress: what the last batch deleted ('comments', 'votes'...) and how many rows so far.
+    step = models.CharField(max_length=20, blank=True)
+    rows_deleted = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+
+        constraints = [
+            models.UniqueConstraint(fields=['target', 'object_id'], name='unique_deletion'),
+        ]
+
+    def __str__(self):
+        return f"deletion of {self.target} {self.object_id}"
+
+
+# Every NEW post is copied into the timeline of its community's subscribers, wherever it
+# was created from (the create form, the admin, the shell...).
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+
+    if created:
+        # Imported here because jobs.py and timeline.py import this file.
+        from .jobs import enqueue
+        from .timeline import fan_out
+
+        # A big community means thousands of rows: done by the worker, not in the request.
+        enqueue(fan_out, key=f'fan-out:{instance.pk}', post_id=instance.pk)
+
+
+# The community counters (see core/stats.py), wherever the change comes from.
+@receiver(post_save, sender=Community)
+def create_community_stats(sender, instance, created, **kwargs):
+
+    if created:
+        CommunityStats.objects.get_or_create(community=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+
+    if created:
+        from . import stats  # stats.py imports this file
+        stats.post_added(instance)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+
+    # A soft-deleted post was already taken off the counters when it was hidden.
+    if instance.deleted_at is None:
+        from . import stats
+        stats.post_removed(instance)
+
+
+@receiver(post_save, sender=Subsriptions)
+def count_new_subscriber(sender, instance, created, **kwargs):
+
+    if created:
+        from . import stats
+        stats.subscriber_added(instance.community_id)
+
+
+@receiver(post_delete, sender=Subsriptions)
+def count_lost_subscriber(sender, instance, **kwargs):
+    from . import stats
+    stats.subscriber_removed(instance.community_id)
+
+
+# The cached logged-in user and their "viewer summary" (see core/viewer.py) are
+# dropped whenever something they contain changes.
+@receiver([post_save, post_delete], sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    from . import viewer  # viewer.py imports this file
+    viewer.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def forget_cached_avatar(sender, instance, **kwargs):
+    from . import viewer
+    viewer.invalidate(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Subsriptions)
+def forget_cached_subscriptions(sender, instance, **kwargs):
+    from . import viewer
+    viewer.invalidate(instance.user_id)
+
+
+# Cache invalidation (see core/cache.py): anything that changes what a page shows
+# bumps the version of that page's cached copy. Votes are bumped in core/votes.py.
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_post_cache(sender, instance, **kwargs):
+    invalidate_post(instance.pk)
+
+    # A new or deleted post changes which posts the listings show. An edit only
+    # changes its own card (the listings pick it up within PAGE_CACHE_TIMEOUT).
+    if kwargs.get('created', True):
+        invalidate_listings()
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_comment_cache(sender, instance, **kwargs):
+    invalidate_post(instance.post_id)
+
+
+@receiver([post_save, post_delete], sender=Community)
+def invalidate_community_cache(sender, instance, **kwargs):
+    invalidate_communities()
+
+
+# A new or changed upload gets its resized variants made in the background (see core/images.py).
+@receiver(post_save, sender=Post)
+def process_post_image(sender, instance, **kwargs):
+
+    if images.needs_variants(instance, 'image'):
+        images.schedule_variants(instance, 'image', images.POST_VARIANTS)
+
+
+@receiver(post_save, sender=Profile)
+def process_profile_image(sender, instance, **kwargs):
+
+    if images.needs_variants(instance, 'profile_image'):
+        images.schedule_variants(instance, 'profile_image', images.PROFILE_VARIANTS)
     
 
 
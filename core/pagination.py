@@ -0,0 +1,170 @@
+"""
+Keyset (a.k.a. "cursor") pagination.
+
+The classic Paginator does `ORDER BY ... LIMIT 20 OFFSET 4000` for page 201, which makes
+the database walk past 4000 rows just to throw them away, and it also runs a COUNT(*)
+over the whole table to know how many pages there are.
+
+Keyset pagination remembers WHERE the last page stopped instead of a page number:
+
+    page 1:  ORDER BY created_at DESC, id DESC LIMIT 21
+    page 2:  WHERE (created_at, id) < (last_created_at, last_id) ORDER BY ... LIMIT 21
+
+With an index on (created_at, id) both queries are a short index range read, so
+page 500 costs the same as page 1. The "where we stopped" values travel in an
+opaque ?cursor= token, which can hold the positions of several lists at once
+(the home page paginates 'feed' and 'explore' together).
+"""
+
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGE_SIZE = 20
+
+# The order every post listing uses unless told otherwise: newest first, and the id
+# breaks ties between posts created in the same microsecond.
+DEFAULT_KEYS = ('-created_at', '-id')
+
+
+class KeysetPage:
+    """
+    One page of results plus the position to continue from.
+    """
+
+    def __init__(self, items, next_position):
+        self.items = items
+        # None means "there is nothing after this page".
+        self.next_position = next_position
+
+    @property
+    def has_next(self):
+        return self.next_position is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(positions):
+    """
+    Turns {'feed': [...], 'explore': [...]} into a URL-safe token.
+    """
+    payload = json.dumps(positions, separators=(',', ':'), default=_json_default)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    The opposite of encode_cursor(). A missing or tampered token just means
+    "start from the beginning", so this never raises.
+    """
+    if not token:
+        return {}
+
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        positions = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        return {}
+
+    return positions if isinstance(positions, dict) else {}
+
+
+def paginate(queryset, cursor, stream, keys=DEFAULT_KEYS, per_page=PAGE_SIZE):
+    """
+    Returns the KeysetPage of `queryset` that comes after the position stored
+    under `stream` in the decoded `cursor`.
+
+    `keys` are the ordering fields ('-' prefix = descending). The last key must
+    be unique (normally 'id') so that every row has exactly one position.
+    """
+    queryset = queryset.order_by(*keys)
+
+    if stream in cursor:
+        after = _parse_position(queryset.model, keys, cursor[stream])
+
+        # This list was already finished on an earlier page (or the cursor is junk).
+        if after is None:
+            return KeysetPage([], None)
+
+        queryset = queryset.filter(_after_filter(keys, after))
+
+    # Fetch ONE extra row: if it exists there is a next page, and we never need a COUNT(*).
+    items = list(queryset[:per_page + 1])
+
+    if len(items) <= per_page:
+        return KeysetPage(items, None)
+
+    items = items[:per_page]
+    last = items[-1]
+    next_position = [getattr(last, key.lstrip('-')) for key in keys]
+
+    return KeysetPage(items, next_position)
+
+
+def next_cursor(**pages):
+    """
+    Builds the ?cursor= token for the "Load more" link from one or more KeysetPages,
+    e.g. next_cursor(feed=feed_page, explore=explore_page).
+
+    Returns None when every page is finished.
+    """
+    if not any(page.has_next for page in pages.values()):
+        return None
+
+    # A finished list is stored as null, so the next page shows it as empty
+    # instead of starting it over from the top.
+    return encode_cursor({name: page.next_position for name, page in pages.items()})
+
+
+def _after_filter(keys, values):
+    # For keys (a, b, c) all descending this builds:
+    #   a < va  OR  (a = va AND b < vb)  OR  (a = va AND b = vb AND c < vc)
+    # which is the row-value comparison (a, b, c) < (va, vb, vc) that every database understands.
+    condition = Q()
+    equal_so_far = {}
+
+    for key, value in zip(keys, values):
+        name = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') else 'gt'
+
+        condition |= Q(**equal_so_far, **{f'{name}__{lookup}': value})
+        equal_so_far[name] = value
+
+    return condition
+
+
+def _parse_position(model, keys, raw_values):
+    if not isinstance(raw_values, list) or len(raw_values) != len(keys):
+        return None
+
+    values = []
+
+    for key, raw in zip(keys, raw_values):
+        field = model._meta.get_field(key.lstrip('-'))
+
+        try:
+            values.append(field.to_python(raw))
+        except ValidationError:
+            return None
+
+        if values[-1] is None:
+            return None
+
+    return values
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
@@ -0,0 +1,103 @@
+"""
+Post ranking: the "hot", "top", "new" and "rising" sort orders.
+
+"hot" is Reddit's classic formula:
+
+    hot = sign(score) * log10(max(|score|, 1)) + (created_at - EPOCH) / 45000
+
+The first half rewards votes, but on a log scale: the first 10 votes count as much
+as the next 90. The second half rewards being new: every 45000 seconds (12.5 hours)
+adds +1, the same as a 10x bigger score. So a great post stays on the front page for
+a while, but a day-old post needs ~100x more votes to beat a brand new one.
+
+Because the time half never changes for a post, the value only moves when the
+score does. That's why it can be a stored, indexed column (Post.hot_rank) that
+core/votes.py updates in the same UPDATE as the vote counters, instead of
+something we compute in Python for every post on every page view.
+
+"rising" is a simplification: the best scores among the posts of the last
+RISING_WINDOW, i.e. "top of the last 12 hours". It has no velocity term (score
+gained per hour): that changes with the clock, so it could be neither an indexed
+column nor a stable keyset for the "Load more" cursor.
+"""
+
+import math
+from datetime import timedelta
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Cast, Greatest, Log, Sign
+from django.utils import timezone
+
+# Reddit's epoch (2005-12-08), any fixed moment works.
+EPOCH = 1134028003
+
+# Seconds of "newness" worth one order of magnitude of score.
+DECAY_SECONDS = 45000
+
+# "rising" only looks at posts younger than this.
+RISING_WINDOW = timedelta(hours=12)
+
+# ?sort= value -> the ordering used for it (each one but 'rising' matches an index on Post).
+SORT_KEYS = {
+    'hot': ('-hot_rank', '-id'),
+    'top': ('-score', '-id'),
+    'new': ('-created_at', '-id'),
+    # "top" over RISING_WINDOW (see the top of this file).
+    'rising': ('-score', '-id'),
+}
+
+DEFAULT_SORT = 'hot'
+
+
+def hot_rank(score, created_at):
+    """
+    The hot formula, in Python (used for new posts and by recompute_hot_ranks).
+    """
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    seconds = created_at.timestamp() - EPOCH
+
+    return round(sign * order + seconds / DECAY_SECONDS, 7)
+
+
+def score_term(score):
+    """
+    The vote half of the hot formula, as a database expression, so it can be
+    used inside an UPDATE. `score` is an expression such as F('score').
+    """
+    return Cast(
+        Sign(score) * Log(Value(10.0), Cast(Greatest(Abs(score), Value(1)), FloatField())),
+        FloatField(),
+    )
+
+
+def hot_rank_after_score_change(score_change):
+    """
+    The new hot_rank of a post whose score moves by `score_change`, written so the
+    database can compute it in the same UPDATE that moves the score:
+
+        hot_rank - score_term(old score) + score_term(old score + change)
+
+    (Inside an UPDATE, F('score') on the right-hand side is always the OLD value.)
+    """
+    return F('hot_rank') - score_term(F('score')) + score_term(F('score') + score_change)
+
+
+def sort_posts(queryset, sort):
+    """
+    Applies a ?sort= mode to a Post queryset.
+
+    Returns (sort, queryset, keys): the sort actually used (unknown values fall
+    back to DEFAULT_SORT), the filtered queryset, and the ordering keys to hand
+    to core.pagination.paginate().
+    """
+    if sort not in SORT_KEYS:
+        sort = DEFAULT_SORT
+
+    if sort == 'rising':
+        # Only recent posts, best first. The created_at index narrows this down to a
+        # few hours of posts, which are then sorted by score (in memory: no index
+        # is on both created_at and score).
+        queryset = queryset.filter(created_at__gte=timezone.now() - RISING_WINDOW)
+
+    return sort, queryset, SORT_KEYS[sort]
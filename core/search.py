@@ -0,0 +1,327 @@
+"""
+Full-text search over posts.
+
+The old search did `title LIKE '%word%' OR content LIKE '%word%'`: a leading
+wildcard can't use any index, so every search read the body of every post, and
+the results came back in no particular order.
+
+This module uses the database's own full-text engine instead. Both keep an
+"inverted index" (word -> the posts containing it), so a search only touches
+the posts that actually match:
+
+    - SQLite:      an FTS5 virtual table `core_post_fts`, kept in sync with
+                   core_post by triggers,
+    - PostgreSQL:  a GIN index on a tsvector expression of title + content.
+
+Both sit behind the same interface:
+
+    results = search_posts('djang tip', page=1)
+    for post in results: post.search_snippet   # '... <mark>django</mark> tips ...'
+
+Every word typed is matched as a prefix ("djang" finds "django"), all words must
+match, and results are ordered by relevance (a match in the title counts more
+than one in the body).
+
+The index is created by migration 0017, and install_index() runs again after every
+`migrate` (see CoreConfig.ready): on SQLite, adding a column to core_post rebuilds
+the table, which silently drops its triggers.
+"""
+
+import re
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.text import slugify
+
+from .cache import PAGE_TIMEOUT, get_versions
+from .models import Community, Post
+
+RESULTS_PER_PAGE = 20
+
+# Longer queries are cut, each extra word makes the search more expensive.
+MAX_TERMS = 8
+
+# snippet()/ts_headline() wrap matches in these, and we turn them into <mark> tags
+# AFTER escaping the text (so a post body can't inject HTML into the results page).
+_START, _STOP = '\x02', '\x03'
+
+# How much a title match counts compared to a body match.
+TITLE_WEIGHT = 10.0
+
+
+class SearchResults:
+    """
+    One page of matching posts, best match first.
+    """
+
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+
+    @property
+    def next_page(self):
+        return self.page + 1 if self.has_next else None
+
+    @property
+    def previous_page(self):
+        return self.page - 1 if self.page > 1 else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def search_terms(query):
+    """
+    Splits what the user typed into plain words. Everything else (quotes,
+    operators, punctuation) is dropped, so no query can break the search syntax.
+    """
+    return [term.lower() for term in re.findall(r'\w+', query or '')][:MAX_TERMS]
+
+
+def search_posts(query, page=1, posts=None, per_page=RESULTS_PER_PAGE):
+    """
+    Returns the SearchResults `page` (1-based) of posts matching `query`.
+
+    `posts` is the base queryset the matches are loaded from (for_listing()
+    by default); every post gets `search_rank` and `search_snippet` attributes.
+    """
+    terms = search_terms(query)
+
+    if not terms:
+        return SearchResults([], 1, False)
+
+    if posts is None:
+        posts = Post.objects.for_listing()
+
+    page = max(page, 1)
+
+    # Ask the index for ONE extra id, if it exists there is a next page (no COUNT(*)).
+    rows = get_backend().matches(terms, per_page + 1, (page - 1) * per_page)
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    # Load the matching posts in one query and put them back in relevance order.
+    by_id = posts.in_bulk([post_id for post_id, _, _ in rows])
+    items = []
+
+    for post_id, rank, snippet in rows:
+        post = by_id.get(post_id)
+
+        if post is None:
+            continue
+
+        post.search_rank = rank
+        post.search_snippet = highlight(snippet)
+        items.append(post)
+
+    return SearchResults(items, page, has_next)
+
+
+def search_communities(query, limit=10, communities=None):
+    """
+    Communities whose name starts with the query (out of `communities`, all of
+    them by default).
+
+    The slug is the lower-cased name and has a unique index, so a range
+    `slug >= 'pyth' AND slug < 'pyth\\uffff'` is an index range read (a
+    `LIKE 'pyth%'` would not be on SQLite, where LIKE ignores case).
+    """
+    prefix = slugify(query or '')
+
+    if communities is None:
+        communities = Community.objects.all()
+
+    if not prefix:
+        return communities.none()
+
+    return communities.filter(slug__gte=prefix, slug__lt=prefix + '\uffff').order_by('slug')[:limit]
+
+
+def community_suggestions(query, limit=10):
+    """
+    search_communities() as a list of {'id', 'name', 'slug'} dicts, for the
+    community picker. Everyone typing 'pyt' gets the same answer, so it is
+    cached until a community is created, edited or deleted (the 'communities'
+    version, see core/cache.py).
+    """
+    prefix = slugify(query or '')
+    version, = get_versions('communities')
+    key = f'community-suggestions:{version}:{prefix}:{limit}'
+
+    suggestions = cache.get(key)
+
+    if suggestions is None:
+        suggestions = list(search_communities(prefix, limit).values('id', 'name', 'slug'))
+        cache.set(key, suggestions, PAGE_TIMEOUT)
+
+    return suggestions
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>'))
+
+
+def get_backend(using=None):
+    db = connections[using or DEFAULT_DB_ALIAS]
+    return BACKENDS.get(db.vendor, LikeBackend)(db)
+
+
+def install_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate receiver: (re)creates whatever part of the search index is missing.
+    """
+    get_backend(using).install()
+
+
+class SearchBackend:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        # Nothing to do for most databases: PostgreSQL keeps expression indexes when a
+        # column is added to the table.
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SQLiteBackend(SearchBackend):
+    """
+    FTS5. The virtual table only stores the index (content='core_post'), the
+    text itself is read from core_post when a snippet is needed.
+    """
+
+    TRIGGERS = [
+        # Keep the index in sync with every INSERT / DELETE / UPDATE on core_post, including
+        # bulk_create() and queryset.update(), which never send Django signals.
+        """
+        CREATE TRIGGER IF NOT EXISTS core_post_fts_insert AFTER INSERT ON core_post BEGIN
+            INSERT INTO core_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS core_post_fts_delete AFTER DELETE ON core_post BEGIN
+            INSERT INTO core_post_fts(core_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        END
+        """,
+        # Only when the text changes, so a vote doesn't rewrite the index.
+        """
+        CREATE TRIGGER IF NOT EXISTS core_post_fts_update AFTER UPDATE OF title, content ON core_post BEGIN
+            INSERT INTO core_post_fts(core_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO core_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END
+        """,
+    ]
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'core_post_fts'")
+
+            if cursor.fetchone() is None:
+                # Before migration 0017 (or core_post doesn't exist yet): nothing to repair.
+                return
+
+            for statement in self.TRIGGERS:
+                cursor.execute(statement)
+
+    def matches(self, terms, limit, offset):
+        # "word"* = any word starting with `word`, separated by spaces = all must match.
+        match = ' '.join(f'"{term}"*' for term in terms)
+
+        with self.connection.cursor() as cursor:
+            # bm25() is "smaller is better", the weights are per column (title, content).
+            # snippet(-1, ...) picks whichever column matched best, with up to 24 words.
+            cursor.execute(
+                f"""
+                SELECT rowid,
+                       bm25(core_post_fts, {TITLE_WEIGHT}, 1.0) AS rank,
+                       snippet(core_post_fts, -1, %s, %s, '…', 24)
+                FROM core_post_fts
+                WHERE core_post_fts MATCH %s
+                ORDER BY rank, rowid DESC
+                LIMIT %s OFFSET %s
+                """,
+                [_START, _STOP, match, limit, offset],
+            )
+            return [(post_id, -rank, snippet) for post_id, rank, snippet in cursor.fetchall()]
+
+    def rebuild(self):
+        self.install()
+
+        with self.connection.cursor() as cursor:
+            # Re-reads every row of core_post and rewrites the whole index.
+            cursor.execute("INSERT INTO core_post_fts(core_post_fts) VALUES ('rebuild')")
+            cursor.execute("INSERT INTO core_post_fts(core_post_fts) VALUES ('optimize')")
+
+
+class PostgreSQLBackend(SearchBackend):
+    """
+    tsvector + GIN. The vector expression below must stay EXACTLY the same as
+    the one core_post_search_idx was created on (migration 0017), otherwise
+    PostgreSQL can't use the index for it.
+    """
+
+    VECTOR = (
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(content, '')), 'B')"
+    )
+
+    def matches(self, terms, limit, offset):
+        # word:* = prefix match, & = all must match. The terms are plain \w+ words,
+        # so they can't contain any tsquery syntax.
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id,
+                       ts_rank_cd('{{0.1, 0.2, {1 / TITLE_WEIGHT}, 1.0}}', {self.VECTOR}, query) AS rank,
+                       ts_headline('english', coalesce(content, '') || ' ' || title, query,
+                                   'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=24, MinWords=8')
+                FROM core_post, to_tsquery('english', %s) AS query
+                WHERE ({self.VECTOR}) @@ query
+                ORDER BY rank DESC, id DESC
+                LIMIT %s OFFSET %s
+                """,
+                [_START, _STOP, tsquery, limit, offset],
+            )
+            return cursor.fetchall()
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX core_post_search_idx')
+
+
+class LikeBackend(SearchBackend):
+    """
+    Any other database: the old LIKE scan, still unranked, so search keeps
+    working (slowly) until a real backend is added for it.
+    """
+
+    def matches(self, terms, limit, offset):
+        posts = Post.objects.all()
+
+        for term in terms:
+            posts = posts.filter(Q(title__icontains=term) | Q(content__icontains=term))
+
+        rows = posts.order_by('-created_at', '-id').values_list('id', 'title')[offset:offset + limit]
+        return [(post_id, 0.0, title) for post_id, title in rows]
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgreSQLBackend,
+}
@@ -0,0 +1,143 @@
+"""
+Per-community counters (members, posts, posts in the last 24 hours, last post),
+stored in CommunityStats so no page has to COUNT(*) the Subsriptions or Post tables.
+
+They are kept up to date as things happen (signals in models.py):
+
+    new post          post_count +1, posts_last_24h +1, last_post_at = its time
+    deleted post      post_count -1 (posts_last_24h -1 if it was from the last 24h)
+    join / leave      subscriber_count +1 / -1
+
+Each change is ONE UPDATE with F() expressions, so two requests at the same time
+can't overwrite each other's +1. It also bumps the 'stats' cache version, which
+the cached "Trending Communities" sidebar of the home page is keyed on.
+
+"The last 24 hours" keeps moving though: a post from yesterday should stop counting
+without anything happening to it. That part is fixed by
+`manage.py reconcile_community_stats` (run it every hour or so), which recounts
+everything from the real tables, the same way reconcile_vote_counts does for votes.
+"""
+
+from datetime import timedelta
+
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+
+from .cache import bump
+from .models import Community, CommunityStats, Post, Subsriptions
+
+# What "trending" looks at.
+ACTIVITY_WINDOW = timedelta(hours=24)
+
+
+def post_added(post):
+    if post.community_id is not None:
+        _change(
+            post.community_id,
+            post_count=F('post_count') + 1,
+            posts_last_24h=F('posts_last_24h') + 1,
+            last_post_at=post.created_at,
+        )
+
+
+def post_removed(post):
+    if post.community_id is None:
+        return
+
+    changes = {'post_count': F('post_count') - 1}
+
+    if post.created_at >= timezone.now() - ACTIVITY_WINDOW:
+        changes['posts_last_24h'] = F('posts_last_24h') - 1
+
+    # last_post_at may now be too recent: only the periodic recount moves it back.
+    _change(post.community_id, **changes)
+
+
+def subscriber_added(community_id):
+    _change(community_id, subscriber_count=F('subscriber_count') + 1)
+
+
+def subscriber_removed(community_id):
+    _change(community_id, subscriber_count=F('subscriber_count') - 1)
+
+
+def _change(community_id, **changes):
+    updated = CommunityStats.objects.filter(community_id=community_id).update(**changes)
+
+    if not updated:
+        # No row yet (a community created with bulk_create, e.g. by seed_threadit):
+        # count it properly once, the next changes are increments again.
+        recount([community_id])
+    else:
+        bump('stats')
+
+
+def recount(community_ids):
+    """
+    Recomputes the stats of these communities from the Subsriptions and Post tables
+    (three GROUP BY queries), creating missing rows. Returns how many rows changed.
+    """
+    since = timezone.now() - ACTIVITY_WINDOW
+
+    subscribers = dict(
+        Subsriptions.objects.filter(community_id__in=community_ids)
+        .values('community_id')
+        .annotate(total=Count('id'))
+        .values_list('community_id', 'total')
+    )
+
+    posts = {
+        row[0]: row[1:]
+        for row in Post.objects.filter(community_id__in=community_ids)
+        .values('community_id')
+        .annotate(total=Count('id'), recent=Count('id', filter=Q(created_at__gte=since)), last=Max('created_at'))
+        .values_list('community_id', 'total', 'recent', 'last')
+    }
+
+    existing = CommunityStats.objects.in_bulk(community_ids)
+    stale = []
+    missing = []
+
+    for community_id in community_ids:
+        post_count, posts_last_24h, last_post_at = posts.get(community_id, (0, 0, None))
+
+        stats = CommunityStats(
+            community_id=community_id,
+            subscriber_count=subscribers.get(community_id, 0),
+            post_count=post_count,
+            posts_last_24h=posts_last_24h,
+            last_post_at=last_post_at,
+        )
+
+        current = existing.get(community_id)
+
+        if current is None:
+            missing.append(stats)
+        elif _values(current) != _values(stats):
+            stale.append(stats)
+
+    # ignore_conflicts: a concurrent _change() may have created the same row meanwhile.
+    CommunityStats.objects.bulk_create(missing, ignore_conflicts=True)
+    CommunityStats.objects.bulk_update(stale, ['subscriber_count', 'post_count', 'posts_last_24h', 'last_post_at'])
+
+    if missing or stale:
+        bump('stats')
+
+    return len(missing) + len(stale)
+
+
+def _values(stats):
+    return (stats.subscriber_count, stats.post_count, stats.posts_last_24h, stats.last_post_at)
+
+
+def trending(limit=5):
+    """
+    The most active communities right now: most posts in the last 24 hours, then
+    most members. One read of the 'community_stats_trending_idx' index, with the
+    communities JOINed in.
+    """
+    return (
+        Community.objects.select_related('stats')
+        .filter(stats__isnull=False)
+        .order_by('-stats__posts_last_24h', '-stats__subscriber_count', '-stats__community_id')[:limit]
+    )
@@ -1,3 +1,1490 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import Http404
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from . import admin, async_views, bench, deletion, images, jobs, stats, timeline, views
+from .cache import PAGE_TIMEOUT
+from .comments import COMMENTS_PER_PAGE, DISPLAY_DEPTH, load_thread
+from .middleware import QueryBudgetExceeded
+from .forms import CommunityForm, PostForm
+from .models import Comment, Community, CommunityStats, Deletion, Job, Post, Subsriptions, TimelineEntry, Vote
+from .ranking import hot_rank
+from .search import search_communities, search_posts
+from .votes import cast_vote
+
+
+class VoteCounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass12345')
+        self.community = Community.objects.create(name='Python')
+        self.post = Post.objects.create(title='Hello', author=self.user, community=self.community)
+        self.client.force_login(self.user)
+
+    def vote(self, direction):
+        self.client.post(reverse(f'{direction}_post', args=[self.post.id]))
+        self.post.refresh_from_db()
+
+    def test_upvote_toggle_and_flip_keep_counters_in_sync(self):
+        self.vote('upvote')
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (1, 0, 1))
+
+        self.vote('downvote')
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (0, 1, -1))
+
+        self.vote('downvote')
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (0, 0, 0))
+        self.assertFalse(Vote.objects.filter(user=self.user, post=self.post).exists())
+
+    def test_vote_click_query_count_does_not_grow_with_voters(self):
+        voters = [User.objects.create_user(f'voter{i}') for i in range(30)]
+        Vote.objects.bulk_create(Vote(user=u, post=self.post, value=Vote.UP) for u in voters)
+
+        # session, user, post lookup, then savepoint + vote lookup + insert + counter update + release.
+        with self.assertNumQueries(8):
+            self.client.post(reverse('upvote_post', args=[self.post.id]))
+
+    def test_votes_move_hot_rank_in_the_same_update(self):
+        others = [User.objects.create_user(f'fan{i}') for i in range(9)]
+
+        self.vote('upvote')
+        for other in others:
+            cast_vote(other, self.post.id, Vote.UP)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 10)
+        self.assertAlmostEqual(self.post.hot_rank, hot_rank(10, self.post.created_at), places=5)
+
+    def test_reconcile_command_repairs_drifted_counters(self):
+        Vote.objects.create(user=self.user, post=self.post, value=Vote.UP)
+        Post.objects.filter(pk=self.post.pk).update(upvote_count=7, score=-3, hot_rank=0)
+
+        call_command('reconcile_vote_counts', stdout=StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.upvote_count, self.post.downvote_count, self.post.score), (1, 0, 1))
+        self.assertAlmostEqual(self.post.hot_rank, hot_rank(1, self.post.created_at), places=5)
+
+
+class HomePaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('bob', password='pass12345')
+        self.joined = Community.objects.create(name='Joined')
+        self.other = Community.objects.create(name='Other')
+        Subsriptions.objects.create(user=self.user, community=self.joined)
+
+        # The jobs (here the fan-out into the timelines) start when the transaction commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(25):
+                Post.objects.create(title=f'joined {i}', author=self.user, community=self.joined)
+                Post.objects.create(title=f'other {i}', author=self.user, community=self.other)
+
+    def test_cursor_walks_both_lists_without_repeats(self):
+        self.client.force_login(self.user)
+
+        first = self.client.get(reverse('home'))
+        self.assertEqual(len(first.context['feed_obj_list']), 20)
+        self.assertEqual(len(first.context['explore_list']), 20)
+        self.assertIsNotNone(first.context['next_cursor'])
+
+        second = self.client.get(reverse('home'), {'cursor': first.context['next_cursor']})
+        self.assertEqual(len(second.context['feed_obj_list']), 5)
+        self.assertEqual(len(second.context['explore_list']), 5)
+        self.assertIsNone(second.context['next_cursor'])
+
+        seen = [p.title for page in (first, second) for p in page.context['feed_obj_list']]
+        self.assertEqual(seen, [f'joined {i}' for i in reversed(range(25))])
+
+    def test_sort_top_orders_by_score(self):
+        best = Post.objects.get(title='other 3')
+        for i in range(3):
+            cast_vote(User.objects.create_user(f'v{i}'), best.id, Vote.UP)
+
+        response = self.client.get(reverse('home'), {'sort': 'top'})
+        self.assertEqual(response.context['sort'], 'top')
+        self.assertEqual(response.context['explore_list'].items[0], best)
+
+        response = self.client.get(reverse('home'), {'sort': 'hot'})
+        self.assertEqual(response.context['explore_list'].items[0], best)
+
+    def test_not_subscribed_by_leaves_out_the_joined_communities(self):
+        loose = Post.objects.create(title='no community', author=self.user)
+        posts = Post.objects.all()
+
+        explore = posts.not_subscribed_by(self.user)
+        self.assertEqual(explore.filter(community=self.joined).count(), 0)
+        self.assertEqual(explore.count(), 26)
+        self.assertIn(loose, explore)
+        self.assertNotIn('NOT IN', str(explore.query))
+
+        stranger = User.objects.create_user('nobody')
+        self.assertEqual(posts.not_subscribed_by(stranger).count(), 51)
+
+    def test_garbage_cursor_starts_from_the_top(self):
+        response = self.client.get(reverse('home'), {'cursor': 'not-a-cursor!!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['explore_list'].items[0].title, 'other 24')
+
+
+class ListingQueryCountTests(TestCase):
+    """
+    The number of queries a listing page runs must not depend on how many posts
+    it shows (no N+1 from post.author / post.community / vote or comment counts).
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('carol', password='pass12345')
+        self.community = Community.objects.create(name='Django')
+        Subsriptions.objects.create(user=self.user, community=self.community)
+        self.client.force_login(self.user)
+
+    def add_posts(self, n):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(n):
+                post = Post.objects.create(title=f'django tip {i}', content='word ' * 80, author=self.user, community=self.community)
+                Comment.objects.create(post=post, author=self.user, content='nice')
+                Vote.objects.create(post=post, user=self.user, value=Vote.UP)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_listing_pages_run_a_constant_number_of_queries(self):
+        urls = [
+            reverse('home'),
+            reverse('community_detail', args=[self.community.slug]),
+            reverse('profile', args=[self.user.username]),
+            reverse('search') + '?q=django',
+        ]
+
+        self.add_posts(2)
+        small = [self.count_queries(url) for url in urls]
+
+        self.add_posts(10)
+        large = [self.count_queries(url) for url in urls]
+
+        self.assertEqual(small, large)
+        # the page content really changed between the two runs
+        response = self.client.get(reverse('profile', args=[self.user.username]))
+        self.assertEqual(len(response.context['posts']), 12)
+
+    def test_cards_read_the_stored_excerpt_not_the_body(self):
+        self.add_posts(1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+
+        self.assertContains(response, 'word word')
+        listing = [query['sql'] for query in queries if 'FROM "core_post"' in query['sql'] and '"excerpt"' in query['sql']]
+        self.assertTrue(listing)
+        self.assertFalse(any('"core_post"."content"' in sql or '"content_html"' in sql for sql in listing))
+
+    def test_excerpt_and_html_follow_the_body(self):
+        post = Post.objects.create(title='t', content='<b>one</b>\n\n' + 'two ' * 60, author=self.user)
+
+        self.assertEqual(len(post.excerpt.split()), Post.EXCERPT_WORDS)
+        self.assertTrue(post.excerpt.endswith('…'))
+        self.assertTrue(post.content_html.startswith('<p>&lt;b&gt;one&lt;/b&gt;</p>'))
+
+        post.content = 'edited'
+        post.save(update_fields=['content'])
+        post.refresh_from_db()
+        self.assertEqual((post.excerpt, post.content_html), ('edited', '<p>edited</p>'))
+
+        # A short body is one line too, like a cut one.
+        post.content = 'first line\n\nsecond line'
+        post.save()
+        self.assertEqual(post.excerpt, 'first line second line')
+
+
+class QueryBudgetMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.community = Community.objects.create(name='Budget')
+
+    def test_server_timing_header_reports_queries(self):
+        response = self.client.get(reverse('community_detail', args=[self.community.slug]))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+
+    @override_settings(QUERY_BUDGETS={'community_detail': 1}, QUERY_BUDGET_STRICT=True)
+    def test_going_over_budget_fails_in_strict_mode(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('community_detail', args=[self.community.slug]))
+
+    @override_settings(QUERY_BUDGETS={'community_detail': 1}, QUERY_BUDGET_STRICT=False)
+    def test_going_over_budget_only_warns_otherwise(self):
+        with self.assertLogs('core.perf', level='WARNING'):
+            response = self.client.get(reverse('community_detail', args=[self.community.slug]))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(DEBUG=True, QUERY_DEBUG_PANEL=True)
+    def test_debug_panel_is_added_to_html_pages(self):
+        response = self.client.get(reverse('community_detail', args=[self.community.slug]))
+        self.assertContains(response, 'id="query-debug-panel"')
+
+
+class TimelineTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('dave', password='pass12345')
+        self.community = Community.objects.create(name='Rust')
+        self.client.force_login(self.user)
+
+    def feed_titles(self):
+        response = self.client.get(reverse('home'), {'sort': 'new'})
+        return [post.title for post in response.context['feed_obj_list']]
+
+    def test_join_backfills_and_new_posts_fan_out(self):
+        Post.objects.create(title='before', author=self.user, community=self.community)
+
+        self.client.post(reverse('join_community', args=[self.community.slug]))
+        self.assertEqual(self.feed_titles(), ['before'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title='after', author=self.user, community=self.community)
+
+        self.assertEqual(self.feed_titles(), ['after', 'before'])
+
+        self.client.post(reverse('join_community', args=[self.community.slug]))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    def test_big_communities_are_read_at_request_time(self):
+        Subsriptions.objects.create(user=self.user, community=self.community)
+        self.community.fanout_on_read = True
+        self.community.save()
+
+        Post.objects.create(title='big', author=self.user, community=self.community)
+
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed_titles(), ['big'])
+
+    def test_trim_keeps_only_the_newest_entries(self):
+        Subsriptions.objects.create(user=self.user, community=self.community)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                Post.objects.create(title=f'p{i}', author=self.user, community=self.community)
+
+        with patch.object(timeline, 'TIMELINE_LENGTH', 3):
+            timeline.trim(self.user.pk)
+
+        self.assertEqual(self.feed_titles(), ['p4', 'p3', 'p2'])
+
+    def test_fan_out_keeps_timelines_trimmed(self):
+        Subsriptions.objects.create(user=self.user, community=self.community)
+        other = User.objects.create_user('erin', password='pass12345')
+        Subsriptions.objects.create(user=other, community=self.community)
+
+        with patch.object(timeline, 'TIMELINE_LENGTH', 3), self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                Post.objects.create(title=f'p{i}', author=self.user, community=self.community)
+
+        self.assertEqual(self.feed_titles(), ['p4', 'p3', 'p2'])
+        self.assertEqual(TimelineEntry.objects.filter(user=other).count(), 3)
+
+    def test_rebuild_empties_the_timelines_of_users_who_left_everything(self):
+        Subsriptions.objects.create(user=self.user, community=self.community)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(title='p', author=self.user, community=self.community)
+
+        # Gone without going through leave (e.g. removed in the admin).
+        Subsriptions.objects.filter(user=self.user).delete()
+
+        call_command('rebuild_timelines', stdout=StringIO())
+
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    def feed_plans(self, sort):
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            self.client.get(reverse('home'), {'sort': sort})
+
+        plans = []
+
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                if 'core_timelineentry' in sql and sql.lstrip().upper().startswith('SELECT'):
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                    plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+
+        return plans
+
+    def test_new_feed_is_an_index_range_read_on_the_timeline(self):
+        Subsriptions.objects.create(user=self.user, community=self.community)
+        for i in range(3):
+            Post.objects.create(title=f'p{i}', author=self.user, community=self.community)
+
+        # sort=new: the timeline rows alone, in index order (the posts come after, by id).
+        [(sql, plan)] = self.feed_plans('new')
+        self.assertNotIn('core_post"', sql)
+        self.assertEqual(plan, ['SEARCH core_timelineentry USING COVERING INDEX timeline_user_created_idx (user_id=?)'])
+
+        # hot (and top): a JOIN from the same index, sorted in memory (at most TIMELINE_LENGTH rows).
+        plans = self.feed_plans('hot')
+        self.assertTrue(plans)
+
+        for sql, plan in plans:
+            self.assertTrue(plan[0].startswith('SEARCH core_timelineentry USING COVERING INDEX timeline_user_created_idx'))
+            self.assertIn('SEARCH core_post USING INTEGER PRIMARY KEY (rowid=?)', plan)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('erin', password='pass12345')
+        self.community = Community.objects.create(name='Python Tips')
+
+    def post(self, title, content=''):
+        return Post.objects.create(title=title, content=content, author=self.user, community=self.community)
+
+    def test_prefix_match_ranks_title_hits_first(self):
+        body = self.post('Unrelated', 'a long post that mentions django once')
+        title = self.post('Django tricks', 'nothing else here')
+        self.post('Flask', 'no match at all')
+
+        results = search_posts('djang')
+        self.assertEqual([post.pk for post in results], [title.pk, body.pk])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = self.post('Original title')
+
+        post.title = 'Renamed'
+        post.save()
+        self.assertFalse(search_posts('original'))
+        self.assertEqual(len(search_posts('renamed')), 1)
+
+        post.delete()
+        self.assertFalse(search_posts('renamed'))
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        self.post('x', 'hello <script>alert(1)</script> world')
+
+        snippet = search_posts('world').items[0].search_snippet
+        self.assertIn('<mark>world</mark>', snippet)
+        self.assertNotIn('<script>', snippet)
+
+    def test_results_are_paginated(self):
+        for i in range(25):
+            self.post(f'paged {i}')
+
+        first = search_posts('paged')
+        second = search_posts('paged', page=2)
+        self.assertEqual((len(first), first.has_next), (20, True))
+        self.assertEqual((len(second), second.has_next), (5, False))
+
+    def test_operators_in_the_query_are_harmless(self):
+        self.post('Quotes')
+        response = self.client.get(reverse('search'), {'q': '"quo* OR -) NEAR('})
+        self.assertEqual(response.status_code, 200)
+
+    def test_communities_match_by_prefix(self):
+        self.assertEqual(list(search_communities('pyth')), [self.community])
+        self.assertFalse(search_communities('tips'))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-users'},
+})
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('frank', password='pass12345')
+        self.community = Community.objects.create(name='Go')
+        self.post = Post.objects.create(title='Goroutines', author=self.user, community=self.community)
+
+    def test_anonymous_pages_are_cached_until_something_changes(self):
+        urls = [
+            reverse('home'),
+            reverse('community_detail', args=[self.community.slug]),
+            reverse('post_detail', args=[self.post.id]),
+        ]
+
+        for url in urls:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        # A vote only invalidates the post itself: the listings keep their cached
+        # copy (until PAGE_CACHE_TIMEOUT), a new post invalidates them.
+        cast_vote(self.user, self.post.id, Vote.UP)
+
+        self.assertEqual(self.client.get(urls[2])['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(urls[0])['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(urls[1])['X-Cache'], 'HIT')
+
+        Post.objects.create(title='Channels', author=self.user, community=self.community)
+
+        for url in urls[:2]:
+            self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_new_post_shows_up_right_away(self):
+        self.client.get(reverse('home'))
+        Post.objects.create(title='Channels', author=self.user, community=self.community)
+
+        self.assertContains(self.client.get(reverse('home')), 'Channels')
+
+    def test_edited_post_card_is_rebuilt(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('home')), 'Goroutines')
+
+        self.post.title = 'Green threads'
+        self.post.save()
+
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Green threads')
+        self.assertNotContains(response, 'Goroutines')
+
+    def test_sidebar_follows_the_community_counters(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('home')), '0 members')
+
+        self.client.post(reverse('join_community', args=[self.community.slug]))
+
+        self.assertContains(self.client.get(reverse('home')), '1 member ')
+
+    def test_logged_in_pages_are_never_served_from_the_cache(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('home'))
+
+        self.assertFalse(self.client.get(reverse('home')).has_header('X-Cache'))
+
+
+class CommentThreadTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('gina', password='pass12345')
+        self.post = Post.objects.create(title='Threads', author=self.user)
+        self.client.force_login(self.user)
+
+    def comment(self, content, parent=None):
+        return Comment.objects.create(post=self.post, author=self.user, content=content, parent=parent)
+
+    def test_tree_is_loaded_in_one_query_in_reading_order(self):
+        first = self.comment('first')
+        second = self.comment('second')
+        reply = self.comment('reply to first', parent=first)
+        self.comment('reply to reply', parent=reply)
+        self.comment('reply to second', parent=second)
+
+        with self.assertNumQueries(1):
+            roots = load_thread(self.post)
+
+        self.assertEqual([c.content for c in roots], ['first', 'second'])
+        self.assertEqual(roots[0].children[0].children[0].content, 'reply to reply')
+        self.assertEqual(roots[1].children[0].content, 'reply to second')
+
+    def test_counters_follow_replies_and_deletes(self):
+        root = self.comment('root')
+        reply = self.comment('reply', parent=root)
+        self.comment('reply 2', parent=reply)
+
+        self.post.refresh_from_db()
+        root.refresh_from_db()
+        self.assertEqual((self.post.comment_count, root.reply_count), (3, 2))
+
+        reply.refresh_from_db()
+        reply.delete()
+
+        self.post.refresh_from_db()
+        root.refresh_from_db()
+        self.assertEqual((self.post.comment_count, root.reply_count), (1, 0))
+
+    def test_deep_threads_continue_on_their_own_page(self):
+        parent = None
+        for depth in range(DISPLAY_DEPTH + 2):
+            parent = self.comment(f'level {depth}', parent=parent)
+
+        deepest_shown = load_thread(self.post)[0]
+        while deepest_shown.children:
+            deepest_shown = deepest_shown.children[0]
+
+        self.assertEqual(deepest_shown.depth, DISPLAY_DEPTH - 1)
+        self.assertEqual(deepest_shown.more_replies, 2)
+
+        response = self.client.get(reverse('comment_thread', args=[self.post.id, deepest_shown.id]))
+        self.assertContains(response, f'level {DISPLAY_DEPTH + 1}')
+
+    def test_reply_through_the_post_page(self):
+        root = self.comment('root')
+        self.client.post(reverse('post_detail', args=[self.post.id]), {'content': 'a reply', 'parent': root.id})
+
+        reply = Comment.objects.get(content='a reply')
+        self.assertEqual((reply.parent, reply.depth), (root, 1))
+
+
+class CommentPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('hank', password='pass12345')
+        self.post = Post.objects.create(title='Busy thread', author=self.user)
+        self.url = reverse('post_detail', args=[self.post.id])
+        self.client.force_login(self.user)
+
+    def add_comments(self, n):
+        for i in range(n):
+            root = Comment.objects.create(post=self.post, author=self.user, content=f'root {i}')
+            Comment.objects.create(post=self.post, author=self.user, content=f'reply {i}', parent=root)
+
+    def test_pages_walk_every_top_level_comment_once(self):
+        self.add_comments(COMMENTS_PER_PAGE + 5)
+
+        first = self.client.get(self.url, {'sort': 'old'})
+        self.assertEqual(len(first.context['comments']), COMMENTS_PER_PAGE)
+        self.assertEqual(first.context['comments'].items[0].children[0].content, 'reply 0')
+
+        more = self.client.get(
+            reverse('post_comments', args=[self.post.id]),
+            {'sort': 'old', 'cursor': first.context['next_comment_cursor']},
+        ).json()
+
+        self.assertIsNone(more['next_cursor'])
+        self.assertIn(f'root {COMMENTS_PER_PAGE + 4}', more['html'])
+        self.assertNotIn('root 0<', more['html'])
+
+    def test_sort_top_puts_the_biggest_discussion_first(self):
+        self.add_comments(3)
+        busy = Comment.objects.get(content='root 1')
+        Comment.objects.create(post=self.post, author=self.user, content='another', parent=busy)
+
+        response = self.client.get(self.url, {'sort': 'top'})
+        self.assertEqual(response.context['comments'].items[0], busy)
+
+    def test_query_count_does_not_grow_with_comments(self):
+        self.add_comments(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+
+        self.add_comments(30)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(self.url)
+
+        self.assertEqual(len(small), len(large))
+
+
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query the main pages make and fails if SQLite
+    would read a whole table ("SCAN core_post") instead of using an index
+    ("SEARCH core_post USING INDEX ..." or "SCAN core_post USING INDEX ..." for an
+    ordered index walk), or sort a listing in memory. Catches a new query shape
+    that has no matching index.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('ivy', password='pass12345')
+        self.community = Community.objects.create(name='Databases')
+        Subsriptions.objects.create(user=self.user, community=self.community)
+        self.post = Post.objects.create(title='Indexes', content='b-trees', author=self.user, community=self.community)
+        self.comment = Comment.objects.create(post=self.post, author=self.user, content='nice')
+        Comment.objects.create(post=self.post, author=self.user, content='reply', parent=self.comment)
+        self.client.force_login(self.user)
+
+    def unindexed_queries(self, method, url, data=None):
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            getattr(self.client, method)(url, data or {})
+
+        scans = set()
+
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+
+                for row in cursor.fetchall():
+                    detail = row[-1]
+
+                    if detail.startswith('SCAN core_') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail:
+                        scans.add(f'{detail}  <-  {sql}')
+
+                    # Sorting in memory instead of reading an index in order. Allowed only where
+                    # the rows are bounded anyway: a user's timeline (TIMELINE_LENGTH rows),
+                    # ?sort=rising (the last few hours of posts) and full-text matches
+                    # (ordered by relevance, which no index can give).
+                    elif 'TEMP B-TREE FOR ORDER BY' in detail and not any(
+                        bounded in sql for bounded in ('core_timelineentry', '"core_post"."created_at" >=', 'core_post_fts')
+                    ):
+                        scans.add(f'{detail}  <-  {sql}')
+
+        return scans
+
+    def test_pages_use_an_index_for_every_query(self):
+        pages = [
+            ('get', reverse('home'), {'sort': sort}) for sort in ('hot', 'new', 'top', 'rising')
+        ] + [
+            ('get', reverse('community_detail', args=[self.community.slug]), {'sort': sort})
+            for sort in ('hot', 'new', 'top', 'rising')
+        ] + [
+            ('get', reverse('post_detail', args=[self.post.id]), {'sort': sort}) for sort in ('top', 'new', 'old')
+        ] + [
+            ('get', reverse('comment_thread', args=[self.post.id, self.comment.id]), None),
+            ('get', reverse('profile', args=[self.user.username]), None),
+            ('get', reverse('search'), {'q': 'index'}),
+            ('post', reverse('upvote_post', args=[self.post.id]), None),
+            ('post', reverse('join_community', args=[self.community.slug]), None),
+            ('post', reverse('join_community', args=[self.community.slug]), None),
+        ]
+
+        for method, url, data in pages:
+            with self.subTest(url=url, data=data):
+                self.assertEqual(self.unindexed_queries(method, url, data), set())
+
+
+class ImageVariantTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create_user('alice', password='pass12345')
+        self.community = Community.objects.create(name='Python')
+
+    def upload(self, width, height, name='photo.jpg'):
+        # A JPEG with EXIF metadata (a camera model and the "rotate 90°" orientation tag).
+        exif = Image.Exif()
+        exif[0x0110] = 'Secret Camera'
+        exif[0x0112] = 6
+
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_post_upload_gets_webp_variants_without_metadata(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Photo', author=self.user, community=self.community, image=self.upload(3000, 1000))
+
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['source'], post.image.name)
+
+        for name, width in images.POST_VARIANTS.items():
+            with default_storage.open(post.image_variants[name]['name']) as file, Image.open(file) as variant:
+                self.assertEqual(variant.format, 'WEBP')
+                # Rotated upright, never wider than the spec nor the (rotated) original.
+                self.assertEqual(variant.width, min(width, 1000))
+                self.assertEqual(len(variant.getexif()), 0)
+
+        self.assertIn(post.image_variants['card']['name'], post.card_image_url)
+        self.assertEqual(post.image_srcset.count('w,'), 2)   # 320, 640 and one 1000px file
+
+    def test_replacing_the_image_replaces_the_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Photo', author=self.user, community=self.community, image=self.upload(800, 600))
+
+        post.refresh_from_db()
+        old_card = post.image_variants['card']['name']
+
+        post.image = self.upload(400, 300, 'other.png')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['source'], post.image.name)
+        self.assertFalse(default_storage.exists(old_card))
+
+        # Saving without touching the image queues no work.
+        with override_settings(JOBS_RUN_EAGERLY=False):
+            post.save()
+
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOBS_RUN_EAGERLY=False)
+    def test_default_avatar_is_not_processed(self):
+        user = User.objects.create_user('bob', password='pass12345')
+
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(user.profile.avatar_url, user.profile.profile_image.url)
+
+    def test_validation_rejects_non_images_and_huge_files(self):
+        with self.assertRaises(ValidationError):
+            images.validate_image_upload(SimpleUploadedFile('notes.jpg', b'not an image'))
+
+        with patch.object(images, 'MAX_UPLOAD_BYTES', 100), self.assertRaises(ValidationError):
+            images.validate_image_upload(self.upload(50, 50))
+
+        images.validate_image_upload(self.upload(50, 50))
+
+    def test_truncated_upload_is_rejected_and_never_breaks_the_job(self):
+        data = self.upload(800, 600).read()
+        truncated = SimpleUploadedFile('cut.jpg', data[:len(data) // 2], content_type='image/jpeg')
+
+        with self.assertRaises(ValidationError):
+            images.validate_image_upload(truncated)
+
+        # Files that skip the form validation still get stored, just without variants.
+        with self.assertLogs('core.images', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title='Cut', author=self.user, community=self.community, image=truncated)
+
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, {'source': post.image.name})
+        self.assertEqual(post.card_image_url, post.image.url)
+        self.assertFalse(images.needs_variants(post, 'image'))
+
+
+def flaky_job(fail_times, counter_key):
+    # Raises the first `fail_times` times it is called (the count lives in the cache).
+    calls = cache.get_or_set(counter_key, 0)
+    cache.set(counter_key, calls + 1)
+
+    if calls < fail_times:
+        raise RuntimeError('not yet')
+
+
+@override_settings(
+    JOBS_RUN_EAGERLY=False,
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'jobs-tests'},
+        'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'jobs-tests-users'},
+    },
+)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pass12345')
+        self.community = Community.objects.create(name='Python')
+        Subsriptions.objects.create(user=self.user, community=self.community)
+
+    def run_worker(self):
+        call_command('runworker', '--once', '--threads', '1', stdout=StringIO())
+
+    def test_new_post_fan_out_runs_in_the_worker(self):
+        post = Post.objects.create(title='Queued', author=self.user, community=self.community)
+
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        self.assertEqual(Job.objects.get().task, 'core.timeline.fan_out')
+
+        self.run_worker()
+
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post=post).exists())
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_same_key_is_queued_once(self):
+        first = jobs.enqueue(flaky_job, key='once', fail_times=0, counter_key='a')
+        second = jobs.enqueue(flaky_job, key='once', fail_times=0, counter_key='a')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_eager_jobs_wait_for_the_commit_and_only_log_failures(self):
+        with self.settings(JOBS_RUN_EAGERLY=True), self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(jobs.enqueue(flaky_job, fail_times=1, counter_key='d'))
+
+        self.assertIsNone(cache.get('d'))
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            callbacks[0]()
+
+        self.assertEqual(cache.get('d'), 1)
+
+    def test_finished_job_does_not_block_its_key(self):
+        failed = jobs.enqueue(flaky_job, key='again', fail_times=0, counter_key='c')
+        Job.objects.filter(pk=failed.pk).update(status=Job.FAILED)
+
+        retry = jobs.enqueue(flaky_job, key='again', fail_times=0, counter_key='c')
+
+        self.assertNotEqual(retry.pk, failed.pk)
+        self.assertEqual(retry.status, Job.QUEUED)
+        self.assertIsNone(Job.objects.get(pk=failed.pk).key)
+
+    def test_failed_job_is_retried_with_backoff_then_gives_up(self):
+        job = jobs.enqueue(flaky_job, max_attempts=2, fail_times=5, counter_key='b')
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.run_worker()
+        job.refresh_from_db()
+
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('not yet', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        # Not due yet: the worker leaves it alone.
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.run_worker()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_retry_succeeds(self):
+        job = jobs.enqueue(flaky_job, fail_times=1, counter_key='c')
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.run_worker()
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.run_worker()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), (Job.DONE, 2, ''))
+
+    def test_login_does_not_save_the_profile(self):
+        with patch('core.models.Profile.save') as save:
+            self.client.login(username='alice', password='pass12345')
+
+        save.assert_not_called()
+
+
+class SeedCommandTests(TestCase):
+
+    def seed(self, **options):
+        call_command(
+            'seed_threadit', users=30, communities=5, subscriptions=60, posts=80, votes=400, comments=300,
+            stdout=StringIO(), **options,
+        )
+
+    def test_seeded_counters_and_threads_are_consistent(self):
+        self.seed()
+
+        self.assertEqual(User.objects.filter(username__startswith='seed').count(), 30)
+        self.assertEqual(Post.objects.count(), 80)
+        self.assertEqual(Comment.objects.count(), 300)
+
+        # Nothing for reconcile_vote_counts to fix.
+        out = StringIO()
+        call_command('reconcile_vote_counts', stdout=out)
+        self.assertIn('fixed 0.', out.getvalue())
+
+        for post in Post.objects.all():
+            self.assertEqual(post.comment_count, post.comments.count())
+            self.assertEqual(post.hot_rank, hot_rank(post.score, post.created_at))
+
+        for comment in Comment.objects.select_related('parent'):
+            expected = (comment.parent.path if comment.parent else '') + f'{comment.pk:010d}'
+            self.assertEqual(comment.path, expected)
+            self.assertEqual(comment.reply_count, Comment.objects.filter(path__startswith=comment.path).count() - 1)
+
+        # Timelines were rebuilt, and the pages work on the seeded data.
+        self.assertTrue(TimelineEntry.objects.exists())
+        self.client.force_login(User.objects.get(username='seed0'))
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+
+    def test_same_seed_gives_the_same_data(self):
+        def snapshot():
+            return list(Comment.objects.order_by('pk').values_list('post__title', 'author__username', 'depth', 'content'))
+
+        self.seed(seed=7)
+        first = snapshot()
+
+        Post.objects.all().delete()
+        User.objects.filter(username__startswith='seed').delete()
+        Community.objects.all().delete()
+
+        self.seed(seed=7)
+        self.assertEqual(snapshot(), first)
+
+
+class BenchTests(TestCase):
+
+    def test_every_scenario_runs_within_its_query_budget(self):
+        bench.seed('tiny')
+
+        # QUERY_BUDGET_STRICT is on in the tests: a view over budget raises here.
+        results = bench.run(iterations=3, warmup=1)
+
+        self.assertEqual(len(results), len(bench.scenarios()[0]))
+
+        for name, result in results.items():
+            with self.subTest(name):
+                self.assertIn(result['status'], (200, 302))
+                self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+
+    def test_compare_flags_regressions(self):
+        def view(queries, p95, memory):
+            return {'queries': queries, 'peak_memory_kb': memory, 'latency_ms': {'p95': p95}}
+
+        baseline = {'small': {'views': {'home': view(7, 20.0, 400), 'search': view(6, 10.0, 300)}}}
+
+        unchanged = {'small': {'views': {'home': view(7, 21.0, 420), 'search': view(6, 10.5, 300)}}}
+        self.assertEqual(bench.compare(unchanged, baseline), [])
+
+        worse = {'small': {'views': {'home': view(8, 20.0, 400), 'search': view(6, 30.0, 900)}}}
+        self.assertEqual(len(bench.compare(worse, baseline)), 3)
+
+
+class CommunityStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('heidi', password='pass12345')
+        self.quiet = Community.objects.create(name='Cobol')
+        self.busy = Community.objects.create(name='Python')
+
+    def counts(self, community):
+        row = CommunityStats.objects.get(community=community)
+        return row.subscriber_count, row.post_count, row.posts_last_24h
+
+    def test_joins_posts_and_deletes_move_the_counters(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('join_community', args=[self.busy.slug]))
+        post = Post.objects.create(title='Walrus', author=self.user, community=self.busy)
+        Post.objects.create(title='Match', author=self.user, community=self.busy)
+
+        self.assertEqual(self.counts(self.busy), (1, 2, 2))
+        self.assertEqual(CommunityStats.objects.get(community=self.busy).last_post_at, Post.objects.latest('created_at').created_at)
+
+        self.client.post(reverse('delete_post', args=[post.id]))
+        self.client.post(reverse('join_community', args=[self.busy.slug]))  # leave
+
+        self.assertEqual(self.counts(self.busy), (0, 1, 1))
+        self.assertEqual(self.counts(self.quiet), (0, 0, 0))
+
+    def test_moving_a_post_moves_its_count(self):
+        post = Post.objects.create(title='Walrus', author=self.user, community=self.busy)
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('edit_post', args=[post.id]), {'title': 'Walrus', 'content': '', 'community': str(self.quiet.pk)})
+
+        self.assertEqual(self.counts(self.busy), (0, 0, 0))
+        self.assertEqual(self.counts(self.quiet), (0, 1, 1))
+        self.assertIsNone(CommunityStats.objects.get(community=self.busy).last_post_at)
+
+    def test_reconcile_rolls_the_window_and_fixes_drift(self):
+        old = Post.objects.create(title='Yesterday', author=self.user, community=self.busy)
+        Post.objects.filter(pk=old.pk).update(created_at=timezone.now() - stats.ACTIVITY_WINDOW * 2)
+        CommunityStats.objects.filter(community=self.quiet).update(post_count=7)
+        CommunityStats.objects.filter(community=self.busy).delete()
+
+        call_command('reconcile_community_stats', stdout=StringIO())
+
+        self.assertEqual(self.counts(self.busy), (0, 1, 0))
+        self.assertEqual(self.counts(self.quiet), (0, 0, 0))
+
+    def test_trending_orders_by_recent_activity(self):
+        Subsriptions.objects.create(user=self.user, community=self.quiet)
+        Post.objects.create(title='Generators', author=self.user, community=self.busy)
+
+        self.assertEqual(list(stats.trending()), [self.busy, self.quiet])
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(list(response.context['top_communities']), [self.busy, self.quiet])
+        self.assertContains(response, '1 post today')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api-tests'},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'api-tests-users'},
+})
+class ApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('judy', password='pass12345')
+        self.community = Community.objects.create(name='Kotlin')
+        self.posts = [
+            Post.objects.create(title=f'coroutine tip {i}', content='suspend ' * 50, author=self.user, community=self.community)
+            for i in range(25)
+        ]
+        self.parent = Comment.objects.create(post=self.posts[0], author=self.user, content='first')
+        Comment.objects.create(post=self.posts[0], author=self.user, content='second')
+        Comment.objects.create(post=self.posts[0], author=self.user, content='reply', parent=self.parent)
+
+    def test_cursor_pages_and_sparse_fields(self):
+        url = reverse('api_community_posts', args=[self.community.slug])
+
+        first = self.client.get(url, {'sort': 'new', 'fields': 'id,title'}).json()
+        self.assertEqual(len(first['data']), 20)
+        self.assertEqual(first['data'][0], {'id': self.posts[-1].id, 'title': 'coroutine tip 24'})
+
+        second = self.client.get(url, {'sort': 'new', 'fields': 'id,title', 'cursor': first['next_cursor']}).json()
+        self.assertEqual([post['id'] for post in second['data']], [post.id for post in reversed(self.posts[:5])])
+        self.assertIsNone(second['next_cursor'])
+
+        default = self.client.get(reverse('api_posts'), {'limit': 1}).json()['data'][0]
+        self.assertNotIn('content', default)
+        self.assertEqual(default['community'], 'kotlin')
+
+        response = self.client.get(url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_community_posts', args=['nope'])).status_code, 404)
+
+    def test_comments_come_in_thread_order(self):
+        data = self.client.get(reverse('api_post_comments', args=[self.posts[0].id])).json()['data']
+        self.assertEqual([comment['content'] for comment in data], ['first', 'reply', 'second'])
+        self.assertEqual(data[1]['parent'], self.parent.id)
+
+    def test_etag_gives_304_until_something_changes(self):
+        url = reverse('api_posts')
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A vote shows up once the PAGE_CACHE_TIMEOUT window is over, a new post right away.
+        cast_vote(self.user, self.posts[3].id, Vote.UP)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with patch('core.api.time.time', return_value=time.time() + PAGE_TIMEOUT):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        Post.objects.create(title='Fresh', author=self.user, community=self.community)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_ndjson_export_streams_every_row(self):
+        with patch('core.api.EXPORT_BATCH_SIZE', 10):
+            response = self.client.get(reverse('api_posts'), {'format': 'ndjson', 'fields': 'id', 'sort': 'new'})
+            lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['id'] for line in lines], [post.id for post in reversed(self.posts)])
+
+    def test_search(self):
+        data = self.client.get(reverse('api_search'), {'q': 'coroutine', 'fields': 'id'}).json()
+        self.assertEqual(len(data['posts']), 20)
+        self.assertEqual(data['next_page'], 2)
+        self.assertEqual(self.client.get(reverse('api_search'), {'q': 'kot'}).json()['communities'][0]['slug'], 'kotlin')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'viewer-tests'},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'viewer-tests-users'},
+})
+class ViewerCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['users'].clear()
+        self.user = User.objects.create_user('kim', password='pass12345')
+        self.community = Community.objects.create(name='Haskell')
+        self.client.login(username='kim', password='pass12345')
+
+    def test_navbar_costs_no_queries_once_cached(self):
+        self.client.get(reverse('search'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('search'))
+
+        self.assertContains(response, reverse('profile', args=['kim']))
+
+    def test_the_user_row_stays_out_of_the_default_cache(self):
+        self.client.get(reverse('search'))
+
+        self.assertIsNone(cache.get(f'user:{self.user.pk}'))
+        self.assertEqual(caches['users'].get(f'user:{self.user.pk}'), self.user)
+
+    def test_edit_profile_and_join_refresh_the_summary(self):
+        url = reverse('community_detail', args=[self.community.slug])
+        self.assertFalse(self.client.get(url).context['is_subscribed'])
+
+        self.client.post(reverse('join_community', args=[self.community.slug]))
+        self.assertTrue(self.client.get(url).context['is_subscribed'])
+
+        self.client.post(reverse('edit_profile'), {'username': 'kimberly', 'email': 'kim@example.com', 'bio': '', 'location': ''})
+        self.assertContains(self.client.get(reverse('search')), reverse('profile', args=['kimberly']))
+
+
+class AsyncViewTests(TransactionTestCase):
+    # Not TestCase: parallel() runs the queries on other threads (other connections),
+    # which can't see the rows of a transaction that was never committed.
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.user = User.objects.create_user('grace', password='pass12345')
+        self.joined = Community.objects.create(name='Rust')
+        self.other = Community.objects.create(name='Zig')
+        Subsriptions.objects.create(user=self.user, community=self.joined)
+        self.feed_post = Post.objects.create(title='Borrow checker', author=self.user, community=self.joined)
+        self.explore_post = Post.objects.create(title='Comptime', author=self.user, community=self.other)
+        Comment.objects.create(post=self.feed_post, author=self.user, content='Lifetimes everywhere')
+
+    def get(self, view, user, path='/', **kwargs):
+        request = self.factory.get(path)
+        request.user = user
+        return async_to_sync(view)(request, **kwargs)
+
+    def get_sync(self, view, user, path='/', **kwargs):
+        request = RequestFactory().get(path)
+        request.user = user
+        return view(request, **kwargs)
+
+    def test_home_splits_feed_and_explore_like_the_sync_view(self):
+        response = self.get(async_views.home, self.user)
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('Borrow checker', content)
+        self.assertIn('Comptime', content)
+        self.assertLess(content.index('Borrow checker'), content.index('Comptime'))
+
+    def test_pages_show_the_same_posts_as_the_sync_views(self):
+        pages = [
+            (views.community_detail, async_views.community_detail, {'slug': self.joined.slug}),
+            (views.post_detail, async_views.post_detail, {'post_id': self.feed_post.id}),
+            (views.profile_view, async_views.profile_view, {'username': 'grace'}),
+        ]
+
+        for sync_view, async_view, kwargs in pages:
+            with self.subTest(async_view.__name__):
+                sync_content = self.get_sync(sync_view, self.user, **kwargs).content.decode()
+                response = self.get(async_view, self.user, **kwargs)
+                self.assertEqual(response.status_code, 200)
+
+                for title in ['Borrow checker', 'Comptime', 'Lifetimes everywhere']:
+                    self.assertEqual(title in response.content.decode(), title in sync_content, title)
+
+        response = self.get(async_views.search, AnonymousUser(), '/search/?q=comptime')
+        self.assertIn('Comptime', response.content.decode())
+
+    def test_missing_objects_are_404s(self):
+        with self.assertRaises(Http404):
+            self.get(async_views.post_detail, self.user, post_id=999)
+
+        with self.assertRaises(Http404):
+            self.get(async_views.profile_view, self.user, username='nobody')
+
+
+class DeletionTests(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user('ada', password='pass12345')
+        self.other = User.objects.create_user('bob', password='pass12345')
+        self.community = Community.objects.create(name='Python')
+        Subsriptions.objects.create(user=self.other, community=self.community)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post = Post.objects.create(title='Doomed', author=self.author, community=self.community)
+            self.kept = Post.objects.create(title='Kept', author=self.other, community=self.community)
+
+        parent = Comment.objects.create(post=self.post, author=self.other, content='top')
+        reply = Comment.objects.create(post=self.post, author=self.author, content='reply', parent=parent)
+        Comment.objects.create(post=self.post, author=self.other, content='deeper', parent=reply)
+        cast_vote(self.other, self.post.id, Vote.UP)
+
+    def purge_all(self, batch_size):
+        out = StringIO()
+        call_command('purge_deleted', batch_size=batch_size, stdout=out)
+        return out.getvalue()
+
+    def test_delete_post_hides_it_and_purges_its_comments_and_votes(self):
+        self.client.force_login(self.author)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_post', args=[self.post.id]))
+
+        self.assertFalse(Post.all_objects.filter(pk=self.post.pk).exists())
+        self.assertFalse(Comment.objects.filter(post_id=self.post.pk).exists())
+        self.assertFalse(Vote.objects.filter(post_id=self.post.pk).exists())
+        self.assertEqual(CommunityStats.objects.get(community=self.community).post_count, 1)
+
+        deletion = Deletion.objects.get(target=Deletion.POST, object_id=self.post.pk)
+        self.assertIsNotNone(deletion.finished_at)
+        self.assertEqual(deletion.rows_deleted, 6)  # 3 comments, the vote, bob's timeline entry, the post
+
+    @override_settings(JOBS_RUN_EAGERLY=False)
+    def test_soft_deleted_post_is_hidden_then_purged_in_batches(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            deletion.soft_delete(self.post)
+
+        self.assertFalse(Post.objects.filter(pk=self.post.pk).exists())
+        self.assertTrue(Post.all_objects.filter(pk=self.post.pk).exists())
+        self.assertEqual(self.client.get(reverse('post_detail', args=[self.post.id])).status_code, 404)
+        self.assertTrue(Job.objects.filter(task='core.deletion.purge').exists())
+
+        output = self.purge_all(batch_size=2)
+
+        # 2 + 1 comments (deepest first, so no batch cascades), the vote, the timeline entry, the post.
+        self.assertEqual(output.count('rows deleted'), 5)
+        self.assertFalse(Post.all_objects.filter(pk=self.post.pk).exists())
+        self.assertEqual(CommunityStats.objects.get(community=self.community).post_count, 1)
+
+    def test_deleting_a_community_hides_its_posts_and_keeps_its_name(self):
+        with self.settings(JOBS_RUN_EAGERLY=False):
+            deletion.soft_delete(self.community)
+
+        self.assertFalse(Post.objects.filter(community=self.community).exists())
+        self.assertEqual(self.client.get(reverse('community_detail', args=[self.community.slug])).status_code, 404)
+        self.assertFalse(CommunityForm({'name': 'Python'}).is_valid())
+
+        self.purge_all(batch_size=500)
+
+        self.assertFalse(Community.all_objects.filter(pk=self.community.pk).exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Subsriptions.objects.exists())
+
+    def test_deleting_a_user_fixes_the_counters_of_the_posts_that_stay(self):
+        cast_vote(self.author, self.kept.id, Vote.DOWN)
+        comment = Comment.objects.create(post=self.kept, author=self.author, content='mine')
+        Comment.objects.create(post=self.kept, author=self.other, content='answer', parent=comment)
+        Comment.objects.create(post=self.kept, author=self.other, content='unrelated')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            deletion.soft_delete(self.author)
+
+        self.assertFalse(User.objects.filter(pk=self.author.pk).exists())
+        self.assertFalse(Post.all_objects.filter(author_id=self.author.pk).exists())
+
+        self.kept.refresh_from_db()
+        self.assertEqual((self.kept.score, self.kept.downvote_count), (0, 0))
+        self.assertEqual(self.kept.comment_count, 1)
+        self.assertEqual(list(Comment.objects.values_list('content', flat=True)), ['unrelated'])
+        self.assertEqual(CommunityStats.objects.get(community=self.community).post_count, 1)
+
+    def test_soft_delete_returns_before_anything_is_purged(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            deletion.soft_delete(self.community)
+
+        # Hidden, but nothing under it deleted yet: the purge starts after the commit.
+        self.assertFalse(Post.objects.filter(community=self.community).exists())
+        self.assertEqual(Comment.objects.count(), 3)
+        self.assertIsNone(Deletion.objects.get(target=Deletion.COMMUNITY).finished_at)
+
+        # Run eagerly (no worker), one purge gets one time slice and doesn't queue the rest.
+        with patch.object(deletion, 'TIME_SLICE', 0), self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+
+        self.assertIsNone(Deletion.objects.get(target=Deletion.COMMUNITY).finished_at)
+        self.assertFalse(Job.objects.exists())
+
+        self.purge_all(batch_size=500)
+        self.assertFalse(Comment.objects.exists())
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'deletion-tests'},
+        'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'deletion-tests-users'},
+    })
+    def test_hidden_posts_leave_the_comment_page_caches(self):
+        urls = [reverse('post_comments', args=[self.kept.id]), reverse('api_post_comments', args=[self.kept.id])]
+
+        for url in urls:
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        with self.settings(JOBS_RUN_EAGERLY=False), self.captureOnCommitCallbacks(execute=True):
+            deletion.soft_delete(self.other)
+
+        # Only this job, not the purge (deleting the rows would invalidate them too).
+        jobs.run(Job.objects.get(task='core.deletion.forget_posts'))
+
+        for url in urls:
+            self.assertNotEqual(self.client.get(url).get('X-Cache'), 'HIT')
+
+
+class AdminTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', password='pass12345')
+        self.community = Community.objects.create(name='Python')
+        self.posts = [
+            Post.objects.create(title=f'Admin post {i}', author=self.admin, community=self.community)
+            for i in range(3)
+        ]
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model_name, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:core_{model_name}_changelist'), params)
+
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_run_the_same_number_of_queries_for_more_rows(self):
+        for post in self.posts:
+            Comment.objects.create(post=post, author=self.admin, content='hi')
+        Subsriptions.objects.create(user=self.admin, community=self.community)
+
+        before = {name: self.changelist_queries(name) for name in ['post', 'comment', 'subsriptions', 'community']}
+
+        other = User.objects.create_user('bob', password='pass12345')
+        community = Community.objects.create(name='Rust')
+        Subsriptions.objects.create(user=other, community=community)
+        for i in range(5):
+            post = Post.objects.create(title=f'More {i}', author=other, community=community)
+            Comment.objects.create(post=post, author=other, content='hello')
+
+        after = {name: self.changelist_queries(name) for name in before}
+
+        self.assertEqual(before, after)
+
+        # The change form has no <select> of every user / community.
+        response = self.client.get(reverse('admin:core_post_change', args=[post.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<option value="%d">bob</option>' % other.pk, html=False)
+
+    def test_post_search_uses_the_full_text_index(self):
+        Post.objects.create(title='Borrow checker', author=self.admin)
+
+        response = self.client.get(reverse('admin:core_post_changelist'), {'q': 'borrow'})
+
+        self.assertEqual([post.title for post in response.context['cl'].result_list], ['Borrow checker'])
+
+    def test_paginator_uses_the_table_estimate_for_big_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        estimate = admin.estimated_row_count(Post)
+        self.assertIsNotNone(estimate)
+
+        with patch.object(admin, 'ESTIMATE_ABOVE', 0), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(admin.EstimatedCountPaginator(Post.objects.order_by('pk'), 50).count, estimate)
+
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+        # A filtered list is counted for real.
+        posts = Post.objects.filter(title='Admin post 1').order_by('pk')
+        self.assertEqual(admin.EstimatedCountPaginator(posts, 50).count, 1)
+
+    def test_delete_selected_soft_deletes_posts_and_keeps_comment_counters(self):
+        parent = Comment.objects.create(post=self.posts[0], author=self.admin, content='parent')
+        reply = Comment.objects.create(post=self.posts[0], author=self.admin, content='reply', parent=parent)
+        Comment.objects.create(post=self.posts[0], author=self.admin, content='other')
+
+        self.client.post(reverse('admin:core_comment_changelist'), {
+            'action': 'delete_selected', 'post': 'yes', '_selected_action': [parent.pk, reply.pk],
+        })
+
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].comment_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:core_post_changelist'), {
+                'action': 'delete_selected', 'post': 'yes', '_selected_action': [self.posts[1].pk, self.posts[2].pk],
+            })
+
+        self.assertEqual(list(Post.all_objects.values_list('pk', flat=True)), [self.posts[0].pk])
+        self.assertEqual(Deletion.objects.filter(target=Deletion.POST).count(), 2)
+
+    def test_deleting_a_user_goes_through_the_soft_delete(self):
+        author = User.objects.create_user('bob', password='pass12345')
+        parent = Comment.objects.create(post=self.posts[0], author=author, content='parent')
+        Comment.objects.create(post=self.posts[0], author=self.admin, content='reply', parent=parent)
+        Comment.objects.create(post=self.posts[0], author=self.admin, content='other')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:auth_user_delete', args=[author.pk]), {'post': 'yes'})
+
+        self.assertFalse(User.objects.filter(pk=author.pk).exists())
+        self.assertTrue(Deletion.objects.filter(target=Deletion.USER, object_id=author.pk).exists())
+
+        # Comment.delete() ran for bob's comment (and the reply under it).
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].comment_count, 1)
+
+    def test_suspend_and_reinstate_users(self):
+        users = [User.objects.create_user(f'user{i}', password='pass12345') for i in range(3)]
+        deleted = User.objects.create_user('gone', password='pass12345')
+
+        deletion.soft_delete(deleted)  # (its purge never runs here: no commit)
+
+        selected = [user.pk for user in users] + [deleted.pk, self.admin.pk]
+        changelist = reverse('admin:auth_user_changelist')
+
+        self.client.post(changelist, {'action': 'suspend_users', '_selected_action': selected})
+
+        self.assertEqual(User.objects.filter(is_active=False).count(), 4)
+        self.assertTrue(User.objects.get(pk=self.admin.pk).is_active)
+
+        self.client.post(changelist, {'action': 'reinstate_users', '_selected_action': selected})
+
+        self.assertEqual(list(User.objects.filter(is_active=False).values_list('pk', flat=True)), [deleted.pk])
+
+
+class CommunityPickerTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('ada', password='pass12345')
+        self.joined = Community.objects.create(name='Python Tips')
+        self.other = Community.objects.create(name='Python')
+        Community.objects.create(name='Rust')
+        Subsriptions.objects.create(user=self.user, community=self.joined)
+        self.client.force_login(self.user)
+
+    def suggest(self, query=''):
+        return self.client.get(reverse('community_autocomplete'), {'q': query}).json()['results']
+
+    def test_create_post_page_doesnt_list_the_communities(self):
+        response = self.client.get(reverse('create_post'))
+
+        self.assertContains(response, 'data-community-picker')
+        self.assertNotContains(response, '<option')
+        self.assertNotContains(response, 'Rust')
+
+    def test_suggestions_put_the_joined_communities_first(self):
+        self.assertEqual([community['name'] for community in self.suggest()], ['Python Tips'])
+
+        results = self.suggest('pyth')
+        self.assertEqual([(community['name'], community['joined']) for community in results], [
+            ('Python Tips', True),
+            ('Python', False),
+        ])
+        self.assertEqual(self.suggest('ru')[0]['slug'], 'rust')
+
+    def test_only_the_submitted_community_is_read(self):
+        form = PostForm({'title': 'Hello', 'community': str(self.other.pk)})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(form.is_valid())
+
+        # The field's lookup, and the model's foreign key check: both by id.
+        self.assertTrue(all(f'"core_community"."id" = {self.other.pk}' in query['sql'] for query in queries))
+        self.assertEqual(form.cleaned_data['community'], self.other)
+
+        deletion.soft_delete(self.other)
+        self.assertFalse(PostForm({'title': 'Hello', 'community': str(self.other.pk)}).is_valid())
+        self.assertTrue(PostForm({'title': 'Hello', 'community': ''}).is_valid())
+
+    def test_a_typed_name_is_resolved_or_rejected(self):
+        form = PostForm({'title': 'Hello', 'community': '', 'community_name': 'python tips'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['community'], self.joined)
+
+        form = PostForm({'title': 'Hello', 'community': '', 'community_name': 'Pyth'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('community', form.errors)
+
+    def test_the_preselected_community_is_not_read_again(self):
+        url = reverse('create_post') + f'?community={self.joined.slug}'
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertContains(response, 'value="Python Tips"')
+        self.assertEqual(sum('FROM "core_community"' in query['sql'] for query in queries), 1)
@@ -0,0 +1,261 @@
+"""
+The materialized home timeline ("Your Feed").
+
+Without it, the feed is "every post whose community is in the list of communities I
+joined, newest first": the database has to look at the posts of ALL those communities
+and sort them, on every single home page view.
+
+With it, each user has their own pre-built list (the TimelineEntry table):
+
+    - fan_out_post():      a new post is copied into the timeline of every subscriber
+                           of its community (fan-out on WRITE, run by the job
+                           worker through fan_out()),
+    - backfill():          joining a community copies its latest posts in,
+    - remove_community():  leaving a community takes them out again,
+    - trim():              keeps each timeline at most TIMELINE_LENGTH posts long
+                           (trim_users() does it for a whole fan-out batch at once).
+
+Reading the "new" feed is then a single range read on the (user, created_at) index,
+keyset-paginated on the timeline rows themselves, plus one `WHERE id IN (...)` for the
+20 posts of the page (feed_page()). The other sort orders (hot, top, rising) rank by
+columns of the post, which the timeline rows don't have: those stay a JOIN (the
+user's timeline rows, then each post by primary key) sorted in memory. That sort is
+bounded: backfill() and every fan-out batch trim the timelines they added to, so a
+timeline never has more than TIMELINE_LENGTH rows.
+
+Communities with more than TIMELINE_FANOUT_LIMIT subscribers would make one post
+write thousands of rows, so they are flagged `fanout_on_read` and their posts are
+read directly at request time instead (fan-out on READ). feed_posts() merges both.
+"""
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q, Value, Window
+from django.db.models.constants import OnConflict
+from django.db.models.functions import RowNumber
+
+from .models import Post, Subsriptions, TimelineEntry
+from .pagination import KeysetPage, paginate
+from .ranking import sort_posts
+
+# How many posts a timeline keeps (older ones are trimmed off).
+TIMELINE_LENGTH = getattr(settings, 'TIMELINE_LENGTH', 1000)
+
+# Above this many subscribers, a community switches to fan-out on read.
+TIMELINE_FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 10000)
+
+BATCH_SIZE = 1000
+
+
+# The timeline rows are in the same order as ranking.SORT_KEYS['new'], so a cursor
+# from either one works for the other.
+ENTRY_KEYS = ('-created_at', '-post_id')
+
+
+def _large_community_ids(user):
+    # Usually empty: only communities above TIMELINE_FANOUT_LIMIT end up here.
+    return list(
+        Subsriptions.objects.filter(user=user, community__fanout_on_read=True)
+        .values_list('community_id', flat=True)
+    )
+
+
+def feed_page(user, posts, sort, cursor, stream='feed'):
+    """
+    One KeysetPage of `user`'s home feed, in the `sort` order (see core/ranking.py).
+    `posts` is the Post queryset to show them with (e.g. Post.objects.for_listing()).
+    """
+    large_ids = _large_community_ids(user)
+
+    if sort == 'new' and not large_ids:
+        # The timeline alone: a range read on (user, -created_at, -post), no JOIN.
+        entries = paginate(
+            TimelineEntry.objects.filter(user=user).only('created_at', 'post_id'),
+            cursor, stream, ENTRY_KEYS,
+        )
+        by_id = posts.in_bulk([entry.post_id for entry in entries])
+
+        # A post deleted since it was fanned out is simply skipped.
+        items = [by_id[entry.post_id] for entry in entries if entry.post_id in by_id]
+        return KeysetPage(items, entries.next_position)
+
+    _, feed, keys = sort_posts(feed_posts(user, posts, large_ids), sort)
+    return paginate(feed, cursor, stream, keys)
+
+
+def feed_posts(user, posts, large_ids=None):
+    """
+    Narrows a Post queryset (e.g. Post.objects.for_listing()) down to the posts in
+    `user`'s home feed.
+    """
+    if large_ids is None:
+        large_ids = _large_community_ids(user)
+
+    if not large_ids:
+        # The common case: a plain JOIN with this user's timeline rows.
+        return posts.filter(timeline_entries__user=user)
+
+    return posts.filter(
+        Q(pk__in=TimelineEntry.objects.filter(user=user).values('post_id'))
+        | Q(community_id__in=large_ids)
+    )
+
+
+def fan_out_post(post):
+    """
+    Copies a new post into the timeline of every subscriber of its community.
+    """
+    community = post.community
+
+    if community is None or community.fanout_on_read:
+        return
+
+    subscriber_ids = (
+        Subsriptions.objects.filter(community=community)
+        .values_list('user_id', flat=True)
+        .order_by()
+    )
+
+    batch = []
+
+    # iterator() streams the ids instead of loading all subscribers at once.
+    for user_id in subscriber_ids.iterator(chunk_size=BATCH_SIZE):
+        batch.append(TimelineEntry(user_id=user_id, post=post, community=community, created_at=post.created_at))
+
+        if len(batch) >= BATCH_SIZE:
+            _add_entries(batch)
+            batch = []
+
+    _add_entries(batch)
+
+
+def _add_entries(entries):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+    # Each of these timelines just got one post longer.
+    trim_users([entry.user_id for entry in entries])
+
+
+def fan_out(post_id):
+    """
+    Background job (see core/jobs.py): fan_out_post() for a post created earlier.
+    """
+    post = Post.objects.select_related('community').filter(pk=post_id).first()
+
+    # Deleted before the worker got to it: nothing to do.
+    if post is not None:
+        fan_out_post(post)
+
+
+def remove_post(post):
+    """
+    Takes a post out of every timeline (e.g. it was moved to another community).
+    """
+    TimelineEntry.objects.filter(post=post).delete()
+
+
+def backfill(user, community):
+    """
+    Copies the latest posts of a community into a user's timeline (on join).
+    """
+    if community.fanout_on_read:
+        # Read directly at request time, nothing to copy.
+        return
+
+    latest = (
+        Post.objects.filter(community=community)
+        .order_by('-created_at', '-id')
+        # Only annotations in the SELECT, so its columns come in exactly this order.
+        .annotate(entry_user=Value(user.pk), entry_post=F('id'), entry_community=F('community_id'), entry_created_at=F('created_at'))
+        .values_list('entry_user', 'entry_post', 'entry_community', 'entry_created_at')[:TIMELINE_LENGTH]
+    )
+
+    # INSERT ... SELECT: the rows are copied inside the database, instead of loading up
+    # to TIMELINE_LENGTH posts into Python and sending them back (the ORM can't write
+    # this, so the SELECT built by the ORM is wrapped by hand). Like ignore_conflicts=True,
+    # posts already in the timeline are skipped.
+    select_sql, params = latest.query.sql_with_params()
+    fields = [TimelineEntry._meta.get_field(name) for name in ('user', 'post', 'community', 'created_at')]
+    ops = connection.ops
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {ops.quote_name(TimelineEntry._meta.db_table)} "
+            f"({', '.join(ops.quote_name(field.column) for field in fields)}) "
+            f"{select_sql} {ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)}",
+            params,
+        )
+
+    trim(user.pk)
+
+
+def remove_community(user, community):
+    """
+    Takes a community's posts out of a user's timeline (on leave).
+    """
+    TimelineEntry.objects.filter(user=user, community=community).delete()
+
+
+def trim(user_id):
+    """
+    Deletes everything older than the newest TIMELINE_LENGTH entries of one timeline.
+    """
+    cutoff = (
+        TimelineEntry.objects.filter(user_id=user_id)
+        .order_by('-created_at', '-post_id')
+        .values_list('created_at', 'post_id')[TIMELINE_LENGTH:TIMELINE_LENGTH + 1]
+    )
+    cutoff = list(cutoff)
+
+    if not cutoff:
+        return
+
+    created_at, post_id = cutoff[0]
+
+    # Everything at or after the cutoff position (in newest-first order) goes.
+    TimelineEntry.objects.filter(user_id=user_id).filter(
+        Q(created_at__lt=created_at) | Q(created_at=created_at, post_id__lte=post_id)
+    ).delete()
+
+
+def trim_users(user_ids):
+    """
+    trim() for many timelines at once: ONE DELETE of every entry that is past the
+    newest TIMELINE_LENGTH of its user's timeline (ROW_NUMBER() per user).
+    """
+    if not user_ids:
+        return
+
+    past_the_end = (
+        TimelineEntry.objects.filter(user_id__in=user_ids)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('created_at').desc(), F('post_id').desc()],
+        ))
+        .filter(position__gt=TIMELINE_LENGTH)
+        .values_list('pk', flat=True)
+    )
+
+    TimelineEntry.objects.filter(pk__in=list(past_the_end)).delete()
+
+
+def update_fanout_mode(community):
+    """
+    Switches a community to fan-out on read once it has more than
+    TIMELINE_FANOUT_LIMIT subscribers.
+    """
+    if community.fanout_on_read:
+        return
+
+    # Only looks at most LIMIT + 1 rows, instead of COUNT(*)-ing every subscriber.
+    over_limit = (
+        Subsriptions.objects.filter(community=community)
+        .order_by()
+        .values('pk')[TIMELINE_FANOUT_LIMIT:TIMELINE_FANOUT_LIMIT + 1]
+        .exists()
+    )
+
+    if over_limit:
+        community.fanout_on_read = True
+        community.save(update_fields=['fanout_on_read'])
@@ -1,6 +1,13 @@
 from django.urls import path
-from . import views  # This means "from the same directory, import the views.py file"
+from . import api, views  # This means "from the same directory, import the views.py file"
 from django.contrib.auth import views as auth_views # Import Django's built-in authentication views
+from django.conf import settings
+
+# Under ASGI the read-heavy pages use their async versions (see core/async_views.py).
+if settings.ASYNC_VIEWS:
+    from . import async_views as read_views
+else:
+    read_views = views
 
 
 # This list holds all the URL patterns for just this one app
@@ -18,7 +25,7 @@ urlpatterns = [
     # NICKNAME: name='home'
     # This is a unique, human-readable name for this URL. It lets us
     # refer to this link easily in our HTML templates without hard-coding the URL.
-    path('', views.home, name='home'),
+    path('', read_views.home, name='home'),
 
     
     # Path for our new sign-up page
@@ -73,7 +80,7 @@ urlpatterns = [
 
     # path('community/<str:community_name>/', views.community_detail, name='community_detail'),
 
-    path('t/<slug:slug>', views.community_detail, name="community_detail"),
+    path('t/<slug:slug>', read_views.community_detail, name="community_detail"),
 
 # --- ADD THIS NEW LINE for the create new post functionality---
 
@@ -86,7 +93,13 @@ urlpatterns = [
     # This is a dynamic URL. <int:post_id> is a "path converter".
     # It captures the number from the URL (e.g., '1', '2') as an
     # integer and passes it to the view as a variable named 'post_id'.
-    path('post/<int:post_id>/', views.post_detail, name='post_detail'),
+    path('post/<int:post_id>/', read_views.post_detail, name='post_detail'),
+
+    # "Load more comments" (JSON with the next page of comments as HTML)
+    path('post/<int:post_id>/comments/', views.post_comments, name='post_comments'),
+
+    # "Continue this thread": one comment and the replies under it
+    path('post/<int:post_id>/comment/<int:comment_id>/', views.comment_thread, name='comment_thread'),
 
     # Path for upvoting a post
     # This will be triggered when a user clicks an upvote link
@@ -100,7 +113,7 @@ urlpatterns = [
     # Path for the User Profile page
     # This is a dynamic URL that captures a string (the username)
     # e.g., /user/rohan/
-    path('u/<str:username>/', views.profile_view, name='profile'),
+    path('u/<str:username>/', read_views.profile_view, name='profile'),
 
 
     path('create-community/', views.create_community, name='create_community'),
@@ -119,10 +132,20 @@ urlpatterns = [
 
     path('register/', views.register, name='register'),
 
-    path('search/', views.search, name='search'),
+    path('search/', read_views.search, name='search'),
 
     path('t/<slug:slug>/join', views.join_community, name='join_community'),
 
+    # The community picker of the create / edit post form (JSON).
+    path('communities/autocomplete', views.community_autocomplete, name='community_autocomplete'),
+
     # path('create-post/<slug:slug>/', views.create_post_in_community, name='community_specific_post'),
 
+    # The JSON API for the mobile app (see core/api.py). The "v1" lets us change
+    # the format later without breaking the apps already installed on phones.
+    path('api/v1/posts', api.posts, name='api_posts'),
+    path('api/v1/t/<slug:slug>/posts', api.community_posts, name='api_community_posts'),
+    path('api/v1/post/<int:post_id>/comments', api.post_comments, name='api_post_comments'),
+    path('api/v1/search', api.search, name='api_search'),
+
 ]
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+The logged-in user, without a database query on every page.
+
+Out of the box, every request of a logged-in user costs:
+
+    1. the session row          (SessionMiddleware)
+    2. the User row             (AuthenticationMiddleware, on the first use of request.user)
+    3. the Profile row          (the avatar in the navbar of base.html)
+
+and pages like community_detail add "has this user joined?" queries on top.
+Here, all of it comes from the cache instead:
+
+    sessions       SESSION_ENGINE = cached_db (cache first, database as the backup)
+    the User       CachedModelBackend.get_user(), under 'user:<id>'
+    the rest       the "viewer summary" under 'viewer:<id>': id, username, avatar URL
+                   and the ids of the joined communities, available in every
+                   template as {{ viewer }} (see context_processor below)
+
+Both entries are deleted by the receivers in models.py whenever the user, their
+profile or their subscriptions change (edit_profile, join_community, logging in...),
+so they are never stale for longer than one request. 'user:<id>' holds the password
+hash, so it lives in a cache of its own (CACHES['users'] in settings.py), not in the
+default one the pages and fragments are stored in.
+"""
+
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache, caches
+from django.utils.functional import SimpleLazyObject
+
+from .models import Profile, Subsriptions
+
+TIMEOUT = 60 * 60
+
+
+def _user_key(user_id):
+    return f'user:{user_id}'
+
+
+def _user_cache():
+    # Looked up every time: override_settings(CACHES=...) in the tests swaps the caches.
+    return caches['users']
+
+
+def _summary_key(user_id):
+    return f'viewer:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    The normal username/password backend, except that loading the logged-in user
+    (on every request) is a cache read.
+    """
+
+    def get_user(self, user_id):
+        user = _user_cache().get(_user_key(user_id))
+
+        if user is None:
+            user = super().get_user(user_id)
+
+            if user is not None:
+                _user_cache().set(_user_key(user_id), user, TIMEOUT)
+
+        return user
+
+
+class ViewerSummary:
+    """
+    What the navigation bar and the "joined?" buttons need to know about the
+    logged-in user.
+    """
+
+    def __init__(self, id, username, avatar_url):
+        self.id = id
+        self.username = username
+        self.avatar_url = avatar_url
+        # Loaded on the first has_joined() (most pages never ask), then cached too.
+        self.communities = None
+
+    def has_joined(self, community):
+        if self.communities is None:
+            self.communities = frozenset(
+                Subsriptions.objects.filter(user_id=self.id).values_list('community_id', flat=True)
+            )
+            cache.set(_summary_key(self.id), self, TIMEOUT)
+
+        return community.pk in self.communities
+
+
+def get_summary(request):
+    """
+    The ViewerSummary of the logged-in user (None for anonymous visitors): from
+    the cache, or built with one query and cached. Kept on the request, so the
+    view and the templates share it.
+    """
+    if not hasattr(request, '_viewer_summary'):
+        request._viewer_summary = _load_summary(request.user)
+
+    return request._viewer_summary
+
+
+def _load_summary(user):
+    if not user.is_authenticated:
+        return None
+
+    summary = cache.get(_summary_key(user.pk))
+
+    if summary is None:
+        profile = Profile.objects.filter(user=user).only('profile_image', 'image_variants').first()
+
+        summary = ViewerSummary(
+            id=user.pk,
+            username=user.username,
+            avatar_url=profile.avatar_url if profile else None,
+        )
+        cache.set(_summary_key(user.pk), summary, TIMEOUT)
+
+    return summary
+
+
+def invalidate(user_id):
+    if user_id is not None:
+        _user_cache().delete(_user_key(user_id))
+        cache.delete(_summary_key(user_id))
+
+
+def context_processor(request):
+    # Lazy: a page that never shows {{ viewer }} doesn't even read the cache.
+    return {'viewer': SimpleLazyObject(lambda: get_summary(request))}
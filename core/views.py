@@ -1,5 +1,6 @@
 from django.shortcuts import render, redirect, get_object_or_404 # added get_object_or_404 for the specific community search.
-from .models import Post, Community, Comment, Subsriptions  # added Community for the specific community search
+from .models import Post, Community, Comment, Subsriptions, Vote  # added Community for the specific community search
+from .votes import cast_vote, get_viewer_vote
 
 from django.contrib.auth import login
 from .forms import SignUpForm, PostForm, CommentForm, CommunityForm,EditProfileForm, ProfileForm  # <-- Import our new form
@@ -9,14 +10,25 @@ from django.contrib.auth.decorators import login_required
 
 from django.contrib.auth.models import User # for the user profile page
 
-from django.core.paginator import Paginator # for the creation of the pages in home page. 
+from .pagination import decode_cursor, next_cursor, paginate # keyset pagination (what the home page uses now)
+from .ranking import sort_posts # ?sort=hot|top|new|rising
+from . import timeline # the materialized "Your Feed" (fan-out on write)
+from . import stats # stored per-community counters (members, posts, activity)
+from . import deletion # soft delete + purging in the background
+from .viewer import get_summary as get_viewer_summary # the cached logged-in user
+from .search import community_suggestions, search_communities, search_posts # full-text search
+from .comments import load_page, load_thread # threaded comments, a page at a time
+from .cache import attach_card_versions, cache_page_for_anonymous, get_versions, invalidate_communities # page + fragment caching
 
 from django.contrib.auth.forms import UserCreationForm # for the register functionality
 
-from django.db.models import Q # in order to use the OR function.
-
 from django.contrib import messages 
 
+from django.http import JsonResponse # for the "load more comments" endpoint
+from django.template.loader import render_to_string
+
+# Logged-out visitors get the whole page from the cache (see core/cache.py).
+@cache_page_for_anonymous(lambda request: ['posts', 'communities'])
 def home(request):
 
     # 1. Get all the Post objects from the database
@@ -33,69 +45,75 @@ def home(request):
 
     """
     This is the view for our homepage.
-    It now includes pagination.
+    It now includes (keyset) pagination, see core/pagination.py.
     """
 
-    # 1. Get the list of ALL posts, in order (no change here).
-    #    This is the "master list" we will paginate. (descending)
-    
-    # post_list = Post.objects.all().order_by('-created_at')
-
-    # 2. Create a Paginator object.
-    #    We tell it:
-    #    - What list to paginate (post_list)
-    #    - How many items per page (e.g., 5)
-    
-    # paginator = Paginator(post_list, 5)
+    # 1. A page-number Paginator would need a COUNT(*)
+    #    of every post plus an OFFSET that gets slower the deeper you go.
+    #    Instead, the URL carries an opaque ?cursor= token saying where the last
+    #    page of EACH list stopped, e.g. /?cursor=eyJmZWVkIjpb...
+    #    No cursor (the first visit) means "start from the newest post".
+    cursor = decode_cursor(request.GET.get('cursor'))
 
-    # 3. Get the page number from the URL's query parameters.
-    #    e.g., /?page=1, /?page=2
-    #    request.GET.get('page') looks for the 'page' parameter.
-    
-    # page_number = request.GET.get('page')
+    # ?sort=hot|top|new|rising (see core/ranking.py). Hot is the default so a good
+    # post doesn't fall off the front page the moment a newer one arrives.
+    sort = request.GET.get('sort')
 
-    # 4. Get the "Page" object for the requested page number.
-    #    paginator.get_page() is a safe way to do this.
-    #    - If page_number is valid (e.g., 2), it gets Page 2.
-    #    - If page_number is not provided (None), it gets Page 1.
-    #    - If page_number is invalid (e.g., 999), it gets the last page. 
-    
-    # page_obj = paginator.get_page(page_number)
+    # The 5 most active communities for the sidebar ("trending"): most posts in the
+    # last 24 hours, then most members, read from the stored counters (core/stats.py).
+    # (It used to be the 5 newest: Community.objects.order_by('-created_at')[:5])
+    top_communities = stats.trending(5)
 
-    # Get the top 5 newest communities for the sidebar
-    # .order_by('-created_at') means "Newest first" (descending)
-    # [:5] means "Limit to 5 items" (Slicing)
-    top_communities = Community.objects.order_by('-created_at')[:5]
+    # for_listing() = author + community JOINed in, full body left out (see PostQuerySet).
+    posts = Post.objects.for_listing()
 
-    feed_obj_list = []
-    explore_list = Post.objects.all().order_by('-created_at')
+    explore_posts = posts
 
     if request.user.is_authenticated:
 
-        # .value part means --> filter out only the values for community id and make the (5,) as 5 using flat = true
-        joined_ids = Subsriptions.objects.filter(user=request.user).values_list('community', flat = True)
+        # (We used to load the ids of the joined communities first, and send them
+        # back with NOT IN (...): slow for someone who joined thousands of them.)
 
-        if joined_ids:
+        # Everything else: a NOT EXISTS on the subscriptions (see PostQuerySet).
+        explore_posts = posts.not_subscribed_by(request.user)
 
-            feed_obj_list = Post.objects.filter(community__in = joined_ids).order_by('-created_at')
+    # 2. Take just ONE page (20 posts) of each list, in the chosen order.
+    #    Every sort order has a matching index on Post (e.g. 'post_hot_idx'),
+    #    so this is a short index read.
+    sort, explore_posts, keys = sort_posts(explore_posts, sort)
+    explore_list = paginate(explore_posts, cursor, 'explore', keys)
 
-            explore_list = Post.objects.exclude(community__in = joined_ids).order_by('-created_at')
+    if request.user.is_authenticated:
 
+        # "Your Feed" is read from the user's own pre-built timeline instead of
+        # scanning the posts of every joined community (see core/timeline.py).
+        feed_obj_list = timeline.feed_page(request.user, posts, sort, cursor)
 
-    # 5. Define the "context".
-    #    We no longer pass the *entire* list of posts.
-    #    We pass the 'page_obj' which contains *only* the posts
-    #    for the current page, plus all the pagination info.
+    else:
+        feed_obj_list = paginate(posts.none(), cursor, 'feed', keys)
+
+    # The post cards are cached {% cache %} fragments, keyed on each post's version.
+    attach_card_versions([*feed_obj_list, *explore_list])
+
+    # 3. Define the "context".
+    #    We no longer pass the *entire* list of posts, only the current page
+    #    of each list, plus the token for the "Load more" link.
     context = {
 
-        # 'page_obj': page_obj,
         'top_communities': top_communities,
         'feed_obj_list': feed_obj_list,
         'explore_list': explore_list,
+        # None when both lists are finished (the template hides the link then).
+        'next_cursor': next_cursor(feed=feed_obj_list, explore=explore_list),
+        'is_first_page': not cursor,
+        'sort': sort,
+        # The sidebar is a cached fragment too, rebuilt when a community or its
+        # counters (members, posts today) change.
+        'sidebar_version': '-'.join(map(str, get_versions('communities', 'stats'))),
     }
 
 
-    # 3. Render the HTML page (home.html) and send it back
+    # 4. Render the HTML page (home.html) and send it back
     return render(request, 'home.html', context)
 
 
@@ -240,7 +258,7 @@ def create_post(request):
             new_post.author = request.user
             
             # Now, save the completed object to the database.
-            new_post.save()
+            new_post.save() # (this also copies it into subscribers' home timelines, see TimelineEntry)
 
             messages.success(request, 'Your post has been published successfully!')
             
@@ -275,13 +293,14 @@ def create_post(request):
 
 
 
+@cache_page_for_anonymous(lambda request, post_id: [f'post:{post_id}', 'communities'])
 def post_detail(request, post_id):
     """
     Shows a single post, its comments, and handles new comment submissions.
     """
     # 1. Get the specific post object using the 'post_id' from the URL.
     #    If the post doesn't exist, this will show a 404 page.
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.select_related('author', 'community'), id=post_id)
     
     # 2. Get all comments related to this *one* post.
     #    We filter the Comment model where the 'post' field
@@ -304,6 +323,13 @@ def post_detail(request, post_id):
             # Assign the correct post and author (the logged-in user)
             new_comment.post = post
             new_comment.author = request.user
+
+            # A reply: the "Reply" forms send the id of the comment being answered.
+            # (filtered by post, so nobody can attach a reply to another post's thread)
+            parent_id = request.POST.get('parent')
+
+            if parent_id and parent_id.isdigit():
+                new_comment.parent = Comment.objects.filter(post=post, id=parent_id).first()
             
             # Now save the completed comment to the database.
             new_comment.save()
@@ -320,14 +346,71 @@ def post_detail(request, post_id):
     # 5. Prepare the context dictionary for the template
     context = {
         'post': post,
+        # 1, -1 or None: which arrow (if any) the logged-in user already clicked.
+        'viewer_vote': get_viewer_vote(request.user, post),
         # 'comments': comments,
         'comment_form': comment_form,
+        # One page of comments (100 top-level ones and their replies), see core/comments.py.
+        **comment_page_context(request, post),
     }
 
     # 6. Render the template
     return render(request, 'post_detail.html', context)
 
 
+def comment_page_context(request, post):
+    """
+    The template variables of comment_page.html: one page of top-level comments
+    in the ?sort= order, starting at ?cursor=.
+    """
+    cursor = decode_cursor(request.GET.get('cursor'))
+    sort, page = load_page(post, cursor, request.GET.get('sort'))
+
+    return {
+        'post': post,
+        'comments': page,
+        'comment_sort': sort,
+        'comment_sorts': [('top', 'Top'), ('new', 'New'), ('old', 'Old')],
+        'comment_cursor': bool(cursor),
+        'next_comment_cursor': next_cursor(comments=page),
+    }
+
+
+@cache_page_for_anonymous(lambda request, post_id: [f'post:{post_id}'])
+def post_comments(request, post_id):
+    """
+    "Load more comments": the next page of comments as an HTML fragment inside a
+    small JSON object, {"html": "...", "next_cursor": "..."}, for the script in
+    post_detail.html. Only this page's rows are loaded and rendered.
+    """
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
+    context = comment_page_context(request, post)
+
+    return JsonResponse({
+        'html': render_to_string('comment_page.html', context, request=request),
+        'next_cursor': context['next_comment_cursor'],
+    })
+
+
+@cache_page_for_anonymous(lambda request, post_id, comment_id: [f'post:{post_id}'])
+def comment_thread(request, post_id, comment_id):
+    """
+    "Continue this thread": one comment and the replies under it, for threads
+    that are too deep (or too wide) to show on the post page.
+    """
+    comment = get_object_or_404(
+        Comment.objects.select_related('post', 'post__community'), id=comment_id, post_id=post_id
+    )
+
+    context = {
+        'post': comment.post,
+        'comments': load_thread(comment.post, root=comment),
+        'comment_form': CommentForm(),
+    }
+
+    return render(request, 'comment_thread.html', context)
+
+
 # The following code is for the VOTING SYSTEM functionality.
 
 @login_required # Ensures only logged-in users can run this view
@@ -335,32 +418,18 @@ def upvote_post(request, post_id):
     """
     Handles upvoting a post.
     """
-    # 1. Get the post object that the user is trying to upvote
-    #    using the post_id from the URL.
-    post = get_object_or_404(Post, id=post_id)
-    
-    # 2. Get the user object for the person making the request.
-    user = request.user
-
-    # 3. The Core Voting Logic
-    
-    # Case 1: Has the user already upvoted this post?
-    if user in post.upvotes.all():
-        # Yes. This means they are clicking "upvote" again to *remove* their upvote.
-        post.upvotes.remove(user)
-    
-    # Case 2: Has the user already *downvoted* this post?
-    elif user in post.downvotes.all():
-        # Yes. This means they are changing their vote from down to up.
-        # We must remove their downvote AND add their upvote.
-        post.downvotes.remove(user)
-        post.upvotes.add(user)
-        
-    # Case 3: The user has not voted on this post at all.
-    else:
-        # This is a new upvote. Add them to the upvotes list.
-        post.upvotes.add(user)
-
+    # 1. Make sure the post exists (a 404 otherwise).
+    #    .only('id') because we don't need the title/content/etc. to vote.
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
+
+    # 2. The Core Voting Logic lives in core/votes.py.
+    #    cast_vote() handles all three cases for us:
+    #    - Already upvoted?   -> the upvote is removed.
+    #    - Already downvoted? -> the vote is flipped to an upvote.
+    #    - Not voted yet?     -> a new upvote is added.
+    #    It only ever looks at THIS user's vote row, so it costs the same on a
+    #    post with 3 voters and on a post with 100k voters.
+    cast_vote(request.user, post.id, Vote.UP)
 
     next_page = request.GET.get('next', 'home')
     
@@ -392,27 +461,11 @@ def downvote_post(request, post_id):
     Handles downvoting a post. This logic is the
     exact mirror opposite of the upvote_post view.
     """
-    # 1. Get the post and user
-    post = get_object_or_404(Post, id=post_id)
-    user = request.user
+    # 1. Make sure the post exists
+    post = get_object_or_404(Post.objects.only('id'), id=post_id)
 
-    # 3. The Core Voting Logic (Reversed)
-
-    # Case 1: Has the user already downvoted this post?
-    if user in post.downvotes.all():
-        # Yes. Remove their downvote.
-        post.downvotes.remove(user)
-    
-    # Case 2: Has the user already *upvoted* this post?
-    elif user in post.upvotes.all():
-        # Yes. Change their vote from up to down.
-        post.upvotes.remove(user)
-        post.downvotes.add(user)
-        
-    # Case 3: The user has not voted on this post at all.
-    else:
-        # This is a new downvote. Add them to the downvotes list.
-        post.downvotes.add(user)
+    # 2. The Core Voting Logic (Reversed), see upvote_post
+    cast_vote(request.user, post.id, Vote.DOWN)
 
     next_page = request.GET.get('next', 'home')
     
@@ -426,8 +479,9 @@ Click: User clicks the href="{% url 'upvote_post' post.id %}" link.
 
 URL Route: core/urls.py matches the path and calls the upvote_post view.
 
-View Logic: The upvote_post view runs. It gets the post and user, and then 
-modifies the post.upvotes or post.downvotes list (e.g., post.upvotes.add(user)). This change is saved to the database immediately.
+View Logic: The upvote_post view runs. It checks the post exists, and then 
+calls cast_vote(), which inserts, flips or deletes this user's row in the Vote
+table and moves the post's counters. This change is saved to the database immediately.
 
 Redirect: The view finishes and sends a return redirect('home') command back 
 to the browser.
@@ -439,9 +493,9 @@ Home View: The home view runs again, fetching the (now updated) posts from
 the database.
 
 Template Render: The home.html template is rendered. When it gets 
-to {{ post.score }}, it calls the score property, which runs the 
-self.upvotes.count() - self.downvotes.count() calculation using the newly 
-updated lists, displaying the correct score.
+to {{ post.score }}, it simply reads the 'score' column of the post row,
+which cast_vote already moved inside the same transaction as
+the vote itself, so the correct score is displayed without any extra query.
 """
 
 
@@ -455,16 +509,28 @@ def profile_view(request, username):
     # We use get_object_or_404 to find one User where their 'username'
     # field exactly matches the 'username' captured from the URL.
     # If no user is found, it automatically shows a 404 Page Not Found.
-    profile_user = get_object_or_404(User, username=username)
+    # (A deleted account is deactivated first, and its page disappears right away.)
+    profile_user = get_object_or_404(User, username=username, is_active=True)
     
     # 2. Get all posts made by this user, newest first.
     # We filter the Post model, looking for all posts where the
     # 'author' field (our ForeignKey) is equal to the 'profile_user' object.
-    posts = Post.objects.filter(author=profile_user).order_by('-created_at')
+    # for_listing() JOINs in the community of each post, so the
+    # "Posted in t/..." badge doesn't cost one query per post.
+    posts = Post.objects.for_listing().filter(author=profile_user).order_by('-created_at')
     
     # 3. Get all comments made by this user, newest first.
     # We do the same thing for comments, filtering by the 'author' field.
-    comments = Comment.objects.filter(author=profile_user).order_by('-created_at')
+    # select_related('post') JOINs in the post each comment was made on
+    # (the template shows {{ comment.post.title }}), and only() keeps us from
+    # loading the whole body of those posts. Comments on deleted posts are
+    # still there until they are purged (core/deletion.py), so they are left out.
+    comments = (
+        Comment.objects.filter(author=profile_user, post__deleted_at=None)
+        .select_related('post')
+        .only('content', 'created_at', 'post__id', 'post__title')
+        .order_by('-created_at')
+    )
 
     # below is my logic to gather communities subscribed by the specific user
     # community_ids = Subsriptions.objects.filter(user=profile_user).values_list('community', flat=True)
@@ -602,7 +668,8 @@ def edit_post(request, post_id):
     Handles editing an existing post.
     """
     # 1. Get the specific post object we want to edit
-    post = get_object_or_404(Post, id=post_id)
+    #    (with its community JOINed in: the community picker shows its name).
+    post = get_object_or_404(Post.objects.select_related('community'), id=post_id)
     
     # 2. --- CRITICAL SECURITY CHECK ---
     #    Check if the currently logged-in user is the author of this post.
@@ -616,11 +683,21 @@ def edit_post(request, post_id):
         # This is a POST request. User is submitting the edited form.
         # We fill the PostForm with the new data from request.POST
         # AND we link it to the existing 'post' object using 'instance=post'.
+        # (Remember the community first: validating the form already changes 'post'.)
+        old_community_id = post.community_id
         form = PostForm(request.POST, request.FILES, instance=post)
         
         if form.is_valid():
             # The form is valid! Save the changes to the *existing* post.
             form.save()
+
+            # Moved to another community: it now belongs in other people's timelines,
+            # and it counts for the new community's stats instead of the old one's.
+            if 'community' in form.changed_data:
+                timeline.remove_post(post)
+                timeline.fan_out_post(post)
+                stats.recount([community_id for community_id in (old_community_id, post.community_id) if community_id])
+                invalidate_communities()
             
             # Redirect back to the post's detail page
             return redirect('post_detail', post_id=post.id)
@@ -659,8 +736,9 @@ def delete_post(request, post_id):
     # 3. We only allow deletion via a POST request for security.
     #    (This prevents Google from accidentally deleting posts)
     if request.method == 'POST':
-        # The user has confirmed the deletion. Delete the post.
-        post.delete()
+        # The user has confirmed the deletion. Hide the post now; its comments,
+        # votes... are deleted in the background, in small batches (core/deletion.py).
+        deletion.soft_delete(post)
         
         messages.success(request, 'Post deleted successfully.')
 
@@ -845,23 +923,37 @@ def register(request):
 #     return render(request, 'create_post.html', context)
 
 
+@cache_page_for_anonymous(lambda request, slug: ['posts', 'communities'])
 def community_detail(request, slug):
 
-    community = get_object_or_404(Community, slug=slug)
+    # select_related('stats'): the member/post counters come in the same query.
+    community = get_object_or_404(Community.objects.select_related('stats'), slug=slug)
 
-    posts = Post.objects.filter(community=community).order_by('-created_at')
+    posts = Post.objects.for_listing().filter(community=community)
 
-    is_subscribed = False
+    # every post gets a 'viewer_vote' attribute, so the arrows can be highlighted
+    # without asking the database once per post.
+    posts = posts.with_viewer_vote(request.user)
 
-    if request.user.is_authenticated:
+    # ?sort=hot|top|new|rising, one page at a time (same as the home page).
+    # The (community, hot_rank/score/created_at, id) indexes make this an index range read.
+    sort, posts, keys = sort_posts(posts, request.GET.get('sort'))
+    cursor = decode_cursor(request.GET.get('cursor'))
+    page = paginate(posts, cursor, 'posts', keys)
+    attach_card_versions(page)
 
-        is_subscribed = Subsriptions.objects.filter(user=request.user, community=community).exists()
+    # "Has this user joined?" comes from the cached viewer summary (core/viewer.py), not a query.
+    viewer = get_viewer_summary(request)
+    is_subscribed = viewer is not None and viewer.has_joined(community)
 
     context = {
 
         'community': community,
-        'posts': posts,
+        'posts': page,
         'is_subscribed': is_subscribed,
+        'sort': sort,
+        'next_cursor': next_cursor(posts=page),
+        'is_first_page': not cursor,
     }
 
     return render(request, 'community_detail.html', context)
@@ -876,11 +968,16 @@ def search(request):
 
     if query:
 
-        posts = Post.objects.filter(
-            Q(title__icontains=query) | Q(content__icontains=query)
-        )
+        # Full-text search (see core/search.py): an index lookup instead of
+        # LIKE '%word%' over every post, best matches first, 20 per page.
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
 
-        communities = Community.objects.filter(name__icontains=query)
+        posts = search_posts(query, page)
+
+        communities = search_communities(query)
     
 
     context = {
@@ -893,6 +990,8 @@ def search(request):
     return render(request, 'search.html', context)
 
 
+# (Below: how the OLD version of this search worked, with Q objects and icontains.)
+
 # The comma , means AND. Django translates this to: "Find a post where the title says 'python' AND the "
 # "content says 'python'." This is too strict! If the word is only in the body, it won't show up.
 
@@ -910,6 +1009,44 @@ def search(request):
 # With i: "Apple", "apple", "APPLE" all match.
 
 
+# How many communities the picker of the post form suggests at once.
+AUTOCOMPLETE_LIMIT = 10
+
+
+@login_required
+def community_autocomplete(request):
+    """
+    The JSON behind the community picker of the post form (CommunityPicker in
+    core/forms.py), so the form doesn't have to list every community:
+
+        ?q=pyt  ->  the communities whose name starts with "pyt", the ones the user joined first
+        no ?q=  ->  the user's own communities (shown as soon as the box is clicked)
+    """
+    query = request.GET.get('q', '')
+
+    # 1. The communities this user joined (one query, on the subscriptions index).
+    joined = Community.objects.filter(subscribers__user=request.user)
+
+    if query:
+        joined = search_communities(query, AUTOCOMPLETE_LIMIT, communities=joined)
+    else:
+        joined = joined.order_by('slug')[:AUTOCOMPLETE_LIMIT]
+
+    results = [dict(community, joined=True) for community in joined.values('id', 'name', 'slug')]
+
+    # 2. Then every other match, from the cache (it's the same for everybody).
+    if query:
+        joined_ids = {community['id'] for community in results}
+
+        results += [
+            dict(community, joined=False)
+            for community in community_suggestions(query, AUTOCOMPLETE_LIMIT)
+            if community['id'] not in joined_ids
+        ]
+
+    return JsonResponse({'results': results[:AUTOCOMPLETE_LIMIT]})
+
+
 @login_required
 def join_community(request, slug):
 
@@ -921,11 +1058,17 @@ def join_community(request, slug):
     if subscription:
 
         subscription.delete()
+        timeline.remove_community(request.user, community)
         messages.warning(request, f'You have left t/{community.name}')
 
     else:
 
         Subsriptions.objects.create(user=request.user, community=community)
+
+        # Bring the community's latest posts into the user's home timeline, and switch
+        # very big communities over to being read at request time instead.
+        timeline.update_fanout_mode(community)
+        timeline.backfill(request.user, community)
         messages.success(request, f'Welcome to t/{community.name}')
 
     
@@ -0,0 +1,102 @@
+"""
+The voting engine.
+
+Every upvote/downvote click goes through cast_vote(). It does a constant amount of
+work no matter how many people already voted on the post:
+
+    1. ONE indexed lookup of this user's existing vote (on the unique (user, post) index),
+    2. ONE write to the Vote table (insert, update or delete),
+    3. ONE UPDATE that moves the counters (and the hot rank) on the Post row.
+
+All three happen inside a single transaction.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .cache import invalidate_post
+from .models import Post, Vote
+from .ranking import hot_rank_after_score_change
+
+
+def cast_vote(user, post_id, value):
+    """
+    Applies a click on the upvote (value=1) or downvote (value=-1) button.
+
+    Clicking the same button twice removes the vote, clicking the other button
+    flips it. Returns the user's vote after the click: 1, -1 or 0 (no vote).
+    """
+    try:
+        return _cast_vote(user, post_id, value)
+    except IntegrityError:
+        # Two clicks from the same user raced each other and both tried to INSERT.
+        # The unique constraint stopped the second one; now the row exists, so
+        # running again takes the "toggle/flip" path instead.
+        return _cast_vote(user, post_id, value)
+
+
+def _cast_vote(user, post_id, value):
+
+    with transaction.atomic():
+        # select_for_update() locks the vote row (on PostgreSQL) until we commit,
+        # so two clicks can't both read the old value and both apply a change.
+        existing = (
+            Vote.objects.select_for_update()
+            .filter(user=user, post_id=post_id)
+            .values_list('pk', 'value')
+            .first()
+        )
+
+        if existing is None:
+            # Case 1: a brand new vote.
+            Vote.objects.create(user=user, post_id=post_id, value=value)
+            old_value, new_value = 0, value
+
+        elif existing[1] == value:
+            # Case 2: same button again -> remove the vote.
+            Vote.objects.filter(pk=existing[0]).delete()
+            old_value, new_value = value, 0
+
+        else:
+            # Case 3: the other button -> flip the vote.
+            Vote.objects.filter(pk=existing[0]).update(value=value)
+            old_value, new_value = existing[1], value
+
+        update_vote_counters(post_id, old_value, new_value)
+
+    # The post's score changed: its page and its card are now stale. The listings
+    # catch up on their own within PAGE_CACHE_TIMEOUT (see core/cache.py).
+    invalidate_post(post_id)
+
+    return new_value
+
+
+def update_vote_counters(post_id, old_value, new_value):
+    """
+    Moves the denormalized counters on a post from old_value to new_value.
+    """
+    up_change = (new_value == Vote.UP) - (old_value == Vote.UP)
+    down_change = (new_value == Vote.DOWN) - (old_value == Vote.DOWN)
+
+    # F('upvote_count') means "the value that is in the database RIGHT NOW",
+    # so the database does the +1/-1 itself in a single UPDATE statement.
+    # If we did post.upvote_count += 1 in Python instead, two users voting at
+    # the same moment could both read 10 and both write 11 (a lost vote).
+    # hot_rank depends on the score, so it moves in the very same UPDATE
+    # (see core/ranking.py for how the database computes it).
+    Post.objects.filter(pk=post_id).update(
+        upvote_count=F('upvote_count') + up_change,
+        downvote_count=F('downvote_count') + down_change,
+        score=F('score') + (new_value - old_value),
+        hot_rank=hot_rank_after_score_change(new_value - old_value),
+    )
+
+
+def get_viewer_vote(user, post):
+    """
+    Returns the logged-in user's vote on a single post (1, -1 or None).
+    """
+    if not user.is_authenticated:
+        return None
+
+    return Vote.objects.filter(user=user, post=post).values_list('value', flat=True).first()
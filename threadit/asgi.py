@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'threadit.settings')
 
+# Serve the read-heavy pages with the async views (see core/async_views.py).
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+
 application = get_asgi_application()
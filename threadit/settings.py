@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 
 import os
+import sys
 import dj_database_url
 from dotenv import load_dotenv
 
@@ -64,6 +65,7 @@ MIDDLEWARE = [ # these are like "filters" that process requests and responses gl
     # these check if the request is secure, manages sessions, handles CSRF protection, etc.
     'django.middleware.security.SecurityMiddleware',  # 1. Is this HTTPS?
     'whitenoise.middleware.WhiteNoiseMiddleware', # 2. Serve static files efficiently in production
+    'core.middleware.QueryBudgetMiddleware', # 2. Counts SQL queries / DB time / template time per request (see core/middleware.py). Placed after WhiteNoise so static files are not measured.
     'django.contrib.sessions.middleware.SessionMiddleware', # 2. Who is this user? (reads cookie)
     'django.middleware.common.CommonMiddleware', # 3. Common tasks (e.g., append slash to URLs, handle 404s gracefully)
     'django.middleware.csrf.CsrfViewMiddleware', # 3. Is this form submission safe and legit, verification of csrf token happens. 
@@ -74,6 +76,44 @@ MIDDLEWARE = [ # these are like "filters" that process requests and responses gl
 
 ROOT_URLCONF = 'threadit.urls'
 
+# True while `python manage.py test` is running.
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# --- QUERY BUDGETS (used by core.middleware.QueryBudgetMiddleware) ---
+# The maximum number of SQL queries each page (by URL name) may run, for a logged-in user.
+# These numbers must NOT depend on how many posts/comments a page shows; if a change
+# makes a page go over, something started running one query per row (N+1).
+QUERY_BUDGETS = {
+    'home': 8,
+    'community_detail': 7,
+    'post_detail': 10,  # posting a reply: insert + path + 2 counter UPDATEs in one transaction
+    'comment_thread': 6,
+    'profile': 9,
+    'search': 6,
+    'upvote_post': 8,
+    'downvote_post': 8,
+    'join_community': 10,
+    'community_autocomplete': 4,
+    'api_posts': 3,
+    'api_community_posts': 4,
+    'api_post_comments': 4,
+    'api_search': 5,
+}
+
+# Over budget -> raise an error (fails the test) instead of just logging a warning.
+QUERY_BUDGET_STRICT = TESTING or os.environ.get('QUERY_BUDGET_STRICT') == 'True'
+
+# --- HOME TIMELINE (see core/timeline.py) ---
+# How many posts each user's materialized "Your Feed" keeps.
+TIMELINE_LENGTH = int(os.environ.get('TIMELINE_LENGTH', 1000))
+
+# Communities with more subscribers than this are read at request time instead of
+# being copied into every subscriber's timeline on each new post.
+TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT', 10000))
+
+# Show the little "N queries, X ms" panel at the bottom of every page (only when DEBUG is on).
+QUERY_DEBUG_PANEL = os.environ.get('QUERY_DEBUG_PANEL', 'True') == 'True'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -85,6 +125,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.viewer.context_processor',  # {{ viewer }}, see core/viewer.py
             ],
         },
     },
@@ -114,6 +155,110 @@ DATABASES = {
 #         ssl_require=True
     # )
 
+# --- CACHE (see core/cache.py) ---
+# CACHE_BACKEND picks where cached pages and fragments live:
+#   locmem (default): inside the Python process, fine for development.
+#   file:             a folder on disk (CACHE_LOCATION), shared by the workers of one server.
+#   redis:            a Redis server (REDIS_URL), shared by every server, for production.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+            'KEY_PREFIX': 'threadit',
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', BASE_DIR / '.cache'),
+        }
+    }
+elif CACHE_BACKEND == 'dummy' or TESTING:
+    # Caches nothing. The tests use this so one test's cached page can't leak into
+    # the next one (the cache tests switch a real cache on with override_settings).
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'threadit',
+        }
+    }
+
+# The cached logged-in User rows (core/viewer.py) include the password hash: they get a
+# cache of their own, never the one the public pages and fragments are stored in.
+# With Redis, point USER_CACHE_URL at a database only the site itself can read.
+if CACHE_BACKEND == 'redis':
+    CACHES['users'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('USER_CACHE_URL', CACHES['default']['LOCATION']),
+        'KEY_PREFIX': 'threadit-users',
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES['users'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('USER_CACHE_LOCATION', BASE_DIR / '.cache-users'),
+    }
+else:
+    CACHES['users'] = {**CACHES['default'], 'LOCATION': 'threadit-users'}
+
+# --- SESSIONS AND THE LOGGED-IN USER (see core/viewer.py) ---
+# Sessions are read from the cache (and written to the database too, so nobody is
+# logged out when the cache is cleared), and so is the logged-in User row.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+AUTHENTICATION_BACKENDS = [
+    'core.viewer.CachedModelBackend',
+    # Sessions started before the cached backend still name this one; keeping it
+    # listed keeps those users logged in.
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Upper bound (seconds) on how long anonymous pages and post cards are served from
+# the cache. Edits, votes and comments invalidate them right away anyway.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 60))
+
+# --- BACKGROUND JOBS (core/jobs.py, run by `python manage.py runworker`) ---
+# Jobs are queued for the `worker` of the Procfile. JOBS_RUN_EAGERLY=True runs each
+# one inside the request instead (after its transaction commits): the tests use it,
+# and it is handy in development when no worker is running.
+JOBS_RUN_EAGERLY = TESTING or os.environ.get('JOBS_RUN_EAGERLY') == 'True'
+JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 4))
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 10))
+
+# --- ASYNC VIEWS (core/async_views.py) ---
+# Under an ASGI server (uvicorn threadit.asgi:application) the read-heavy pages
+# are served by async views instead. threadit/asgi.py turns this on.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == 'True'
+
+# --- LOGGING ---
+# 'core.perf' prints one JSON line per request with its query count and timings.
+# Set PERF_LOG_LEVEL=WARNING to only see the requests that go over their query budget.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.perf': {
+            'handlers': ['console'],
+            'level': os.environ.get('PERF_LOG_LEVEL', 'WARNING' if TESTING else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -209,6 +354,9 @@ MEDIA_URL = '/media/'
 #    in your main project directory (alongside 'static' and 'core').
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 3. Uploaded images are resized into WebP variants by a background job (core/images.py).
+MAX_IMAGE_UPLOAD_BYTES = int(os.environ.get('MAX_IMAGE_UPLOAD_BYTES', 10 * 1024 * 1024))
+
 # This tells Django to use Cloudinary for all file uploads
 # *only* when we are in production (when DEBUG is False).
 # When DEBUG is True (on your laptop), it will still use